@@ -46,12 +46,19 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
-    'django.contrib.sessions.middleware.SessionMiddleware',
+    'core.middleware.CompressionMiddleware',
     'django.middleware.common.CommonMiddleware',
+    'core.middleware.PathScopedMiddleware',
+    'django.middleware.clickjacking.XFrameOptionsMiddleware',
+]
+
+# Run by core.middleware.PathScopedMiddleware for every request outside
+# LEAN_MIDDLEWARE_PATHS, which only serve the token authenticated API.
+SCOPED_MIDDLEWARE = [
+    'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
-    'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
 ROOT_URLCONF = 'app.urls'
@@ -88,6 +95,26 @@ DATABASES = {
     }
 }
 
+# Recipe data is spread over the databases named in RECIPE_SHARD_DATABASES
+# (comma separated, on the default database's server) by user id, see
+# core.sharding. Users, tokens and image blobs stay in the default database.
+# Run ``migrate --database shard_<n>`` for each of them as well.
+SHARD_DATABASE_NAMES = [
+    name.strip()
+    for name in os.environ.get('RECIPE_SHARD_DATABASES', '').split(',')
+    if name.strip()
+]
+RECIPE_SHARDS = [f'shard_{n}' for n in range(len(SHARD_DATABASE_NAMES))]
+DATABASES.update({
+    alias: dict(DATABASES['default'], NAME=name)
+    for alias, name in zip(RECIPE_SHARDS, SHARD_DATABASE_NAMES)
+})
+DATABASE_ROUTERS = ['core.sharding.UserShardRouter'] if RECIPE_SHARDS else []
+
+# Hash partitions of each recipe table created by migration 0017 on
+# PostgreSQL 11 or later (core.partitioning); 0 keeps plain tables.
+RECIPE_PARTITIONS = int(os.environ.get('RECIPE_PARTITIONS', 0))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/2.1/ref/settings/#auth-password-validators
@@ -129,7 +156,99 @@ STATIC_URL = '/static/'
 MEDIA_URL = '/media/'
 
 MEDIA_ROOT = '/vol/web/media'
+
+LEAN_MIDDLEWARE_PATHS = ('/api/', MEDIA_URL)
+
+# JSON responses smaller than this go out uncompressed, see
+# core.compression. Brotli is used when the ``brotli`` module is installed.
+COMPRESS_MIN_BYTES = int(os.environ.get('COMPRESS_MIN_BYTES', 1024))
 STAIC_ROOT = '/vol/web/static'
 
+# Uploads are stored once per distinct content, see core.storage
+DEFAULT_FILE_STORAGE = 'core.storage.ContentAddressedStorage'
+
+# How recipe images are handed to the front-end server once ownership is
+# checked: 'x-accel' (nginx), 'x-sendfile' (Apache/lighttpd) or '' to
+# stream them from Django.
+MEDIA_ACCEL = os.environ.get('MEDIA_ACCEL', '')
+MEDIA_ACCEL_PREFIX = '/protected-media/'
+
 
 AUTH_USER_MODEL = 'core.User'
+
+# Worker threads used by core.concurrency to overlap independent queries
+# within a request; 0 runs them sequentially.
+ORM_EXECUTOR_WORKERS = int(os.environ.get('ORM_EXECUTOR_WORKERS', 4))
+
+# The sync feed holds back changes younger than this, so rows committed
+# slightly out of timestamp order are not skipped by a client's cursor.
+SYNC_SETTLE_SECONDS = int(os.environ.get('SYNC_SETTLE_SECONDS', 2))
+
+# Users whose tag/ingredient name dictionaries (core.names) each process
+# keeps in memory.
+NAME_DICTIONARY_USERS = int(os.environ.get('NAME_DICTIONARY_USERS', 256))
+
+# Users whose recipe recommendation indexes (core.recommend) each process
+# keeps in memory. One index takes about 200 bytes per recipe.
+RECOMMEND_INDEX_USERS = int(os.environ.get('RECOMMEND_INDEX_USERS', 32))
+
+# Recipe list snapshots of users flagged with ``recipe_list_snapshot``
+# (core.snapshots) live in the RECIPE_SNAPSHOT_CACHE cache. A served list
+# is at most RECIPE_SNAPSHOT_MAX_AGE seconds behind changes made through
+# processes that do not share that cache. Point SNAPSHOT_CACHE_BACKEND at
+# django.core.cache.backends.filebased.FileBasedCache and
+# SNAPSHOT_CACHE_LOCATION at a directory to share it between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'snapshots': {
+        'BACKEND': os.environ.get(
+            'SNAPSHOT_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache',
+        ),
+        'LOCATION': os.environ.get(
+            'SNAPSHOT_CACHE_LOCATION', 'recipe-snapshots'
+        ),
+        'OPTIONS': {
+            # One entry per 1000 recipes of a user
+            'MAX_ENTRIES': int(os.environ.get('SNAPSHOT_CACHE_ENTRIES', 5000)),
+        },
+    },
+}
+RECIPE_SNAPSHOT_CACHE = 'snapshots'
+RECIPE_SNAPSHOT_MAX_AGE = int(os.environ.get('RECIPE_SNAPSHOT_MAX_AGE', 5))
+RECIPE_SNAPSHOT_TIMEOUT = int(os.environ.get('RECIPE_SNAPSHOT_TIMEOUT', 86400))
+
+# Deferred work (core.jobs), run by ``manage.py run_worker``. A failed job
+# is retried after JOB_RETRY_DELAY seconds, doubling up to
+# JOB_RETRY_MAX_DELAY, until it has run JOB_MAX_ATTEMPTS times. Running
+# jobs whose worker renewed no lease for JOB_LEASE_SECONDS are queued again;
+# finished jobs are kept JOB_KEEP_SECONDS for the metrics.
+JOB_THREADS = int(os.environ.get('JOB_THREADS', 2))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 5))
+JOB_RETRY_DELAY = int(os.environ.get('JOB_RETRY_DELAY', 10))
+JOB_RETRY_MAX_DELAY = int(os.environ.get('JOB_RETRY_MAX_DELAY', 3600))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 900))
+JOB_KEEP_SECONDS = int(os.environ.get('JOB_KEEP_SECONDS', 86400))
+
+# Deleted accounts are purged by a job this long after the deletion.
+PURGE_GRACE_MINUTES = int(os.environ.get('PURGE_GRACE_MINUTES', 60))
+
+# Webhook deliveries (core.webhooks), sent by ``manage.py
+# dispatch_webhooks``. Each delivery carries up to WEBHOOK_BATCH_EVENTS
+# events; at most WEBHOOK_CONCURRENCY are in flight at once. A failing
+# webhook is retried with the same backoff as jobs, starting at
+# WEBHOOK_RETRY_DELAY seconds, and disabled after WEBHOOK_MAX_FAILURES
+# failures in a row.
+WEBHOOK_BATCH_EVENTS = int(os.environ.get('WEBHOOK_BATCH_EVENTS', 500))
+WEBHOOK_CONCURRENCY = int(os.environ.get('WEBHOOK_CONCURRENCY', 8))
+WEBHOOK_TIMEOUT = int(os.environ.get('WEBHOOK_TIMEOUT', 10))
+WEBHOOK_RETRY_DELAY = int(os.environ.get('WEBHOOK_RETRY_DELAY', 30))
+WEBHOOK_RETRY_MAX_DELAY = int(os.environ.get('WEBHOOK_RETRY_MAX_DELAY', 3600))
+WEBHOOK_MAX_FAILURES = int(os.environ.get('WEBHOOK_MAX_FAILURES', 20))
+# Webhook URLs must resolve to public addresses; set to 1 to allow
+# loopback and private networks, for development only
+WEBHOOK_ALLOW_PRIVATE_HOSTS = bool(
+    int(os.environ.get('WEBHOOK_ALLOW_PRIVATE_HOSTS', 0))
+)
@@ -0,0 +1,29 @@
+"""
+Settings spreading recipe data over two SQLite shards.
+
+Runs the sharding tests against real databases without a PostgreSQL
+server per shard:
+
+    python manage.py test core.tests.test_sharding \\
+        --settings app.settings_shards
+
+Only core.tests.test_sharding is written for them. The rest of the suite
+assumes a single database: its tests only roll back the default one, so
+rows they leave on the shards leak into later tests.
+"""
+import os
+
+from app.settings import *  # noqa: F401,F403
+from app.settings import BASE_DIR
+
+DATABASES = {
+    alias: {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, f'{alias}.sqlite3'),
+    }
+    for alias in ('default', 'shard_0', 'shard_1')
+}
+
+RECIPE_SHARDS = ['shard_0', 'shard_1']
+
+DATABASE_ROUTERS = ['core.sharding.UserShardRouter']
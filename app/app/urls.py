@@ -13,13 +13,25 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.apps import apps
 from django.conf import settings
-from django.conf.urls.static import static
-from django.contrib import admin
 from django.urls import path, include
 
+from core.models import RECIPE_IMAGE_DIR
+from recipe.views import RecipeImageView
+
 urlpatterns = [
-    path('admin/', admin.site.urls),
     path('api/user/', include('user.urls')),
     path('api/recipe/', include('recipe.urls')),
-] + static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    path(
+        settings.MEDIA_URL.lstrip('/') + RECIPE_IMAGE_DIR + '<str:filename>',
+        RecipeImageView.as_view(),
+        name='recipe-image',
+    ),
+]
+
+# The API-only settings (app.settings_api) leave the admin out
+if apps.is_installed('django.contrib.admin'):
+    from django.contrib import admin
+
+    urlpatterns.append(path('admin/', admin.site.urls))
@@ -1,10 +1,125 @@
 from django.contrib import admin
+from django.contrib.admin.views.main import ChangeList, ERROR_FLAG, \
+    IS_POPUP_VAR, ORDER_VAR, PAGE_VAR, TO_FIELD_VAR
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils import timezone
+from django.utils.functional import cached_property
 from django.utils.translation import gettext as _
-from core import models
+from core import bulk, deletion, models
 
+# Changelists page with ``?id__lt=<last id shown>`` instead of OFFSET
+KEYSET_VAR = 'id__lt'
+# Parameters that do not narrow a changelist down
+UNFILTERED_VARS = {
+    ERROR_FLAG, IS_POPUP_VAR, KEYSET_VAR, ORDER_VAR, PAGE_VAR, TO_FIELD_VAR,
+}
+# Tables smaller than this are counted exactly
+ESTIMATE_THRESHOLD = 100000
 
-class UserAdmin(BaseUserAdmin):
+
+def estimated_count(model):
+    """The planner's estimate of rows in ``model``'s table, if known"""
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT reltuples FROM pg_class WHERE relname = %s',
+            [model._meta.db_table],
+        )
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        return None
+    return int(row[0])
+
+
+class EstimatedCountPaginator(Paginator):
+    """Reports the table estimate instead of COUNT(*) for large tables"""
+
+    def __init__(self, *args, estimate=False, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.estimate = estimate
+
+    @cached_property
+    def count(self):
+        if self.estimate:
+            estimate = estimated_count(self.object_list.model)
+            if estimate is not None and estimate >= ESTIMATE_THRESHOLD:
+                return estimate
+        return super().count
+
+
+class KeysetChangeList(ChangeList):
+    """Newest first, one page past the last id shown at a time"""
+
+    def get_ordering(self, request, queryset):
+        return ['-pk']
+
+    def get_results(self, request):
+        rows = list(self.queryset[:self.list_per_page + 1])
+        self.paginator = self.model_admin.get_paginator(
+            request, self.queryset, self.list_per_page
+        )
+        self.result_count = self.paginator.count
+        self.result_list = rows[:self.list_per_page]
+        self.show_full_result_count = False
+        self.full_result_count = None
+        self.show_admin_actions = True
+        self.can_show_all = False
+        self.multi_page = len(rows) > self.list_per_page
+        self.next_url = self.get_query_string(
+            {KEYSET_VAR: self.result_list[-1].pk}, [PAGE_VAR]
+        ) if self.multi_page else None
+        self.first_url = self.get_query_string(
+            remove=[KEYSET_VAR, PAGE_VAR]
+        ) if KEYSET_VAR in self.params else None
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    """Changelist and form settings for tables with millions of rows"""
+    change_list_template = 'admin/keyset_change_list.html'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    sortable_by = ()
+
+    def get_changelist(self, request, **kwargs):
+        return KeysetChangeList
+
+    def get_paginator(self, request, queryset, per_page, orphans=0,
+                      allow_empty_first_page=True):
+        return self.paginator(
+            queryset, per_page, orphans, allow_empty_first_page,
+            estimate=not set(request.GET) - UNFILTERED_VARS,
+        )
+
+
+class SoftDeleteAdminMixin:
+    """Deletes through core.deletion and skips the related object tree
+
+    Soft deletion leaves related rows for ``purge_deleted``, so the
+    confirmation page does not need the collector walking all of them.
+    """
+
+    def get_deleted_objects(self, objs, request):
+        objs = list(objs)
+        opts = self.model._meta
+        perms_needed = set() if self.has_delete_permission(request) \
+            else {opts.verbose_name}
+        name = opts.verbose_name if len(objs) == 1 \
+            else opts.verbose_name_plural
+        return [str(obj) for obj in objs], {name: len(objs)}, \
+            perms_needed, []
+
+    def delete_model(self, request, obj):
+        self.soft_delete(obj)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            self.soft_delete(obj)
+
+
+class UserAdmin(SoftDeleteAdminMixin, BaseUserAdmin):
     ordering = ['id']
     list_display = ['email', 'name']
     fieldsets = (
@@ -13,6 +128,7 @@ class UserAdmin(BaseUserAdmin):
         (_('Permissions'),
          {'fields': ('is_active', 'is_staff', 'is_superuser')}),
         (_('Important dates'), {'fields': ('last_login',)}),
+        (_('Performance'), {'fields': ('recipe_list_snapshot',)}),
     )
     add_fieldsets = (
         (None, {
@@ -21,8 +137,88 @@ class UserAdmin(BaseUserAdmin):
         }),
     )
 
+    def soft_delete(self, obj):
+        deletion.delete_user(obj)
+
+
+class RecipeAttrAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'user', 'recipe_count')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    readonly_fields = ('recipe_count',)
+    search_fields = ('name',)
+
+
+class RecipeTagInline(admin.TabularInline):
+    model = models.RecipeTag
+    autocomplete_fields = ('tag',)
+    ordering = ('position', 'id')
+    extra = 0
+
+
+class RecipeIngredientInline(admin.TabularInline):
+    model = models.RecipeIngredient
+    autocomplete_fields = ('ingredient',)
+    ordering = ('position', 'id')
+    extra = 0
+
+
+class RecipeAdmin(SoftDeleteAdminMixin, LargeTableAdmin):
+    list_display = ('id', 'title', 'user', 'time_minutes', 'price',
+                    'updated_at')
+    list_select_related = ('user',)
+    raw_id_fields = ('user', 'copied_from')
+    inlines = (RecipeTagInline, RecipeIngredientInline)
+    link_fields = {models.RecipeTag: 'tags',
+                   models.RecipeIngredient: 'ingredients'}
+
+    def save_formset(self, request, form, formset, change):
+        """Apply inline link edits through core.bulk.set_links
+
+        Saved row by row the links would send no ``m2m_changed``, leaving
+        the counters behind. The recipe itself was just saved, which moves
+        it up in the sync feed, recommendations, snapshots and webhooks.
+        """
+        field = self.link_fields.get(formset.model)
+        if field is None:
+            return super().save_formset(request, form, formset, change)
+        # Only collects the changes, for the admin's change message
+        formset.save(commit=False)
+        target = models.Recipe._meta.get_field(field).m2m_reverse_field_name()
+        rows = []
+        for link_form in formset.forms:
+            data = link_form.cleaned_data
+            if not data.get(target) or data.get('DELETE'):
+                continue
+            data[target].link_quantity = data.get('quantity', '')
+            rows.append((data['position'], data[target]))
+        rows.sort(key=lambda row: row[0])
+        bulk.set_links(form.instance, field, [obj for _, obj in rows])
+
+    def soft_delete(self, obj):
+        deletion.delete_recipe(obj)
+
+
+class JobAdmin(LargeTableAdmin):
+    list_display = ('id', 'name', 'status', 'attempts', 'run_at',
+                    'finished_at', 'worker')
+    list_filter = ('status', 'name')
+    readonly_fields = ('created_at', 'started_at', 'heartbeat_at',
+                       'finished_at', 'worker', 'last_error')
+    actions = ('retry',)
+
+    def retry(self, request, queryset):
+        """Queue the selected failed jobs again with fresh attempts"""
+        count = queryset.filter(status=models.Job.FAILED).update(
+            status=models.Job.QUEUED, attempts=0, run_at=timezone.now(),
+            finished_at=None,
+        )
+        self.message_user(request, _('%d jobs queued again') % count)
+    retry.short_description = _('Retry selected failed jobs')
+
 
 admin.site.register(models.User, UserAdmin)
-admin.site.register(models.Tag)
-admin.site.register(models.Ingredient)
-admin.site.register(models.Recipe)
+admin.site.register(models.Tag, RecipeAttrAdmin)
+admin.site.register(models.Ingredient, RecipeAttrAdmin)
+admin.site.register(models.Recipe, RecipeAdmin)
+admin.site.register(models.Job, JobAdmin)
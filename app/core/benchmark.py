@@ -0,0 +1,656 @@
+"""Helpers used by the ``benchmark`` management command.
+
+Seeds users with realistic recipe libraries, drives the ``recipe`` and
+``user`` endpoints through either the Django test client or a live HTTP
+server and reports latency percentiles, throughput and queries per
+request. ``measure_startup`` times fresh worker processes instead.
+"""
+import io
+import json
+import math
+import os
+import random
+import re
+import subprocess
+import sys
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.core.handlers.base import BaseHandler
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import middleware, names, recommend, snapshots, stats
+from core.models import (
+    Ingredient, Recipe, RecipeIngredient, RecipeTag, Tag,
+)
+
+PASSWORD = 'benchmark-pass'
+
+# Number of recipes owned by each seeded user, per profile.
+PROFILES = {
+    'small': (10,),
+    'medium': (10, 1000),
+    'large': (10, 1000, 100000),
+}
+
+TAGS_PER_USER = 50
+INGREDIENTS_PER_USER = 300
+TAGS_PER_RECIPE = 5
+INGREDIENTS_PER_RECIPE = 15
+BATCH_SIZE = 5000
+
+
+def _bulk_create(objs):
+    """``bulk_create`` in batches the database backend can take"""
+    if not objs:
+        return
+    model = type(objs[0])
+    # Django 2.1 lets an explicit batch_size exceed the backend's limit
+    batch_size = min(BATCH_SIZE, connection.ops.bulk_batch_size(
+        model._meta.concrete_fields, objs
+    ))
+    model.objects.bulk_create(objs, batch_size=batch_size)
+
+
+def seed_user(recipe_count, email=None, seed=0,
+              ingredient_count=INGREDIENTS_PER_USER):
+    """Create a user owning ``recipe_count`` recipes with heavy fan-out"""
+    rng = random.Random(seed)
+    email = email or f'bench-{recipe_count}@example.com'
+    user = get_user_model().objects.create_user(email, PASSWORD)
+
+    _bulk_create(
+        [Tag(user=user, name=f'tag {i}') for i in range(TAGS_PER_USER)]
+    )
+    _bulk_create(
+        [Ingredient(user=user, name=f'ingredient {i}')
+         for i in range(ingredient_count)]
+    )
+    _bulk_create(
+        [Recipe(
+            user=user,
+            title=f'recipe {i}',
+            time_minutes=rng.randint(5, 180),
+            price=rng.randint(100, 9999) / 100,
+        ) for i in range(recipe_count)]
+    )
+
+    tag_ids = list(Tag.objects.filter(user=user).values_list('id', flat=True))
+    ingredient_ids = list(
+        Ingredient.objects.filter(user=user).values_list('id', flat=True)
+    )
+    recipe_ids = Recipe.objects.filter(user=user)\
+        .values_list('id', flat=True).iterator()
+
+    tag_links, ingredient_links = [], []
+    for recipe_id in recipe_ids:
+        tag_links.extend(
+            RecipeTag(recipe_id=recipe_id, tag_id=tag_id, position=n)
+            for n, tag_id in enumerate(rng.sample(tag_ids, TAGS_PER_RECIPE))
+        )
+        ingredient_links.extend(
+            RecipeIngredient(recipe_id=recipe_id, ingredient_id=ing_id,
+                             position=n, quantity=f'{n + 1} cups')
+            for n, ing_id in enumerate(
+                rng.sample(ingredient_ids, INGREDIENTS_PER_RECIPE)
+            )
+        )
+        if len(ingredient_links) >= BATCH_SIZE:
+            _bulk_create(tag_links)
+            _bulk_create(ingredient_links)
+            tag_links, ingredient_links = [], []
+    _bulk_create(tag_links)
+    _bulk_create(ingredient_links)
+    # bulk_create bypasses the signals maintaining the counters
+    stats.recompute(user=user)
+    return user
+
+
+def sample_image():
+    """Return the bytes of a tiny JPEG used by the upload scenario"""
+    from PIL import Image
+
+    buf = io.BytesIO()
+    Image.new('RGB', (10, 10)).save(buf, format='JPEG')
+    return buf.getvalue()
+
+
+class Scenario:
+    """A single request shape issued repeatedly against one endpoint"""
+
+    def __init__(self, name, method, url, payload=None, fmt=None):
+        self.name = name
+        self.method = method
+        self.url = url
+        self.payload = payload
+        self.format = fmt
+
+    def build_payload(self, iteration):
+        if callable(self.payload):
+            return self.payload(iteration)
+        return self.payload
+
+
+def user_scenarios(user):
+    """Scenarios covering every route in ``user.urls`` for ``user``"""
+    return [
+        Scenario(
+            'user-create', 'post', reverse('user:create'),
+            lambda i: {
+                'email': f'new-{i}-{time.time()}@example.com',
+                'password': PASSWORD,
+                'name': 'bench',
+            },
+        ),
+        Scenario('user-token', 'post', reverse('user:token'),
+                 {'email': user.email, 'password': PASSWORD}),
+        Scenario('user-me', 'get', reverse('user:me')),
+        Scenario('user-me-update', 'patch', reverse('user:me'),
+                 {'name': 'bench'}),
+    ]
+
+
+def recipe_scenarios(user):
+    """Scenarios covering every route in ``recipe.urls`` for ``user``"""
+    recipe = Recipe.objects.filter(user=user).order_by('id').first()
+    tag_ids = list(
+        Tag.objects.filter(user=user).values_list('id', flat=True)[:3]
+    )
+    ingredient_ids = list(
+        Ingredient.objects.filter(user=user).values_list('id', flat=True)[:5]
+    )
+    scenarios = [
+        Scenario('tag-list', 'get', reverse('recipe:tag-list')),
+        Scenario('tag-list-assigned', 'get',
+                 reverse('recipe:tag-list') + '?assigned_only=1'),
+        Scenario('tag-list-popular', 'get',
+                 reverse('recipe:tag-list') + '?ordering=-recipe_count'),
+        Scenario('tag-create', 'post', reverse('recipe:tag-list'),
+                 lambda i: {'name': f'new tag {i}'}),
+        Scenario('ingredient-list', 'get', reverse('recipe:ingredient-list')),
+        Scenario('ingredient-list-assigned', 'get',
+                 reverse('recipe:ingredient-list') + '?assigned_only=1'),
+        Scenario('ingredient-create', 'post',
+                 reverse('recipe:ingredient-list'),
+                 lambda i: {'name': f'new ingredient {i}'}),
+        Scenario('ingredient-create-batch', 'post',
+                 reverse('recipe:ingredient-list'),
+                 lambda i: [{'name': f'pantry {i} {n}'} for n in range(50)],
+                 'json'),
+        Scenario('recipe-list', 'get', reverse('recipe:recipe-list')),
+        Scenario('recipe-stats', 'get', reverse('recipe:stats')),
+        Scenario('recipe-sync', 'get',
+                 reverse('recipe:sync') + '?limit=100'),
+        Scenario('recipe-cookable', 'get',
+                 reverse('recipe:recipe-cookable') + '?ingredients='
+                 + ','.join(str(pk) for pk in ingredient_ids[:3])),
+    ]
+    if recipe is not None:
+        week = Recipe.objects.filter(user=user).order_by('id')\
+            .values_list('id', flat=True)[:7]
+        scenarios += [
+            Scenario('recipe-similar', 'get',
+                     reverse('recipe:recipe-similar', args=[recipe.id])),
+            Scenario('recipe-shopping-list', 'get',
+                     reverse('recipe:recipe-shopping-list') + '?ids='
+                     + ','.join(str(pk) for pk in week)),
+        ]
+    # Writes come last, so the reads above see a settled library
+    scenarios += [
+        Scenario('recipe-create', 'post', reverse('recipe:recipe-list'),
+                 lambda i: {
+                     'title': f'new recipe {i}',
+                     'time_minutes': 10,
+                     'price': '5.00',
+                     'tags': tag_ids,
+                     'ingredients': ingredient_ids,
+                 }, 'json'),
+    ]
+    if recipe is not None:
+        detail = reverse('recipe:recipe-detail', args=[recipe.id])
+        scenarios += [
+            Scenario('recipe-detail', 'get', detail),
+            Scenario('recipe-copy', 'post',
+                     reverse('recipe:recipe-copy', args=[recipe.id])),
+            Scenario('recipe-copy-many', 'post',
+                     reverse('recipe:recipe-copy-many'),
+                     {'ids': [recipe.id]}, 'json'),
+            Scenario('recipe-update', 'patch', detail,
+                     lambda i: {'title': f'renamed {i}',
+                                'tags': tag_ids[i % 2:]}, 'json'),
+            Scenario(
+                'recipe-upload-image', 'post',
+                reverse('recipe:recipe-upload-image', args=[recipe.id]),
+                lambda i: {'image': io.BytesIO(sample_image())},
+                'multipart',
+            ),
+        ]
+    return scenarios
+
+
+class ClientDriver:
+    """Issues requests in-process through DRF's test client"""
+
+    name = 'client'
+    counts_queries = True
+
+    def __init__(self, user):
+        token = Token.objects.get_or_create(user=user)[0]
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+
+    def request(self, scenario, iteration):
+        payload = scenario.build_payload(iteration)
+        if isinstance(payload, dict) and 'image' in payload:
+            payload['image'].name = 'bench.jpg'
+        method = getattr(self.client, scenario.method)
+        kwargs = {'format': scenario.format} if scenario.format else {}
+        res = method(scenario.url, payload, **kwargs)
+        return res.status_code
+
+
+class LiveServerDriver:
+    """Issues requests over HTTP against a running server"""
+
+    name = 'live'
+    counts_queries = False
+
+    def __init__(self, user, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.token = Token.objects.get_or_create(user=user)[0].key
+
+    def request(self, scenario, iteration):
+        payload = scenario.build_payload(iteration)
+        headers = {'Authorization': f'Token {self.token}'}
+        data = None
+        if payload is not None:
+            if scenario.format == 'multipart':
+                boundary = 'benchmarkboundary'
+                data = b''.join([
+                    f'--{boundary}\r\n'.encode(),
+                    b'Content-Disposition: form-data; name="image"; '
+                    b'filename="bench.jpg"\r\n',
+                    b'Content-Type: image/jpeg\r\n\r\n',
+                    payload['image'].getvalue(),
+                    f'\r\n--{boundary}--\r\n'.encode(),
+                ])
+                headers['Content-Type'] = \
+                    f'multipart/form-data; boundary={boundary}'
+            else:
+                data = json.dumps(payload).encode()
+                headers['Content-Type'] = 'application/json'
+        req = urllib.request.Request(
+            self.base_url + scenario.url,
+            data=data,
+            headers=headers,
+            method=scenario.method.upper(),
+        )
+        try:
+            with urllib.request.urlopen(req) as res:
+                res.read()
+                return res.status
+        except urllib.error.HTTPError as exc:
+            return exc.code
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values``"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(int(math.ceil(pct / 100.0 * len(ordered))), 1)
+    return ordered[rank - 1]
+
+
+def slow_queries(delay):
+    """``execute_wrapper`` adding ``delay`` seconds to every query"""
+    def wrapper(execute, sql, params, many, context):
+        time.sleep(delay)
+        return execute(sql, params, many, context)
+    return wrapper
+
+
+def run_scenario(driver, scenario, iterations, warmup=3, concurrency=1):
+    """Time ``iterations`` requests of ``scenario`` and summarise them
+
+    With ``concurrency`` above one, requests are issued from that many
+    threads at once and queries are not counted.
+    """
+    for i in range(warmup):
+        driver.request(scenario, -i - 1)
+
+    def timed(i):
+        t0 = time.perf_counter()
+        status = driver.request(scenario, i)
+        return status, time.perf_counter() - t0
+
+    timings, queries, statuses = [], [], set()
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            for status, elapsed in pool.map(timed, range(iterations)):
+                statuses.add(status)
+                timings.append(elapsed)
+    else:
+        for i in range(iterations):
+            with CaptureQueriesContext(connection) as ctx:
+                status, elapsed = timed(i)
+            statuses.add(status)
+            timings.append(elapsed)
+            queries.append(len(ctx.captured_queries))
+    elapsed = time.perf_counter() - started
+
+    return OrderedDict([
+        ('iterations', iterations),
+        ('status', sorted(statuses)),
+        ('throughput', round(iterations / elapsed, 2) if elapsed else None),
+        ('p50_ms', round(percentile(timings, 50) * 1000, 3)),
+        ('p99_ms', round(percentile(timings, 99) * 1000, 3)),
+        ('queries', percentile(queries, 50)
+         if driver.counts_queries and queries else None),
+    ])
+
+
+def compare(results, baseline, tolerance=0.5, check_timings=True):
+    """Return human readable regressions of ``results`` over ``baseline``
+
+    Query counts must not grow at all; latency and throughput may drift
+    by ``tolerance`` (a fraction) before being reported.
+    """
+    regressions = []
+    for key, current in sorted(results.items()):
+        previous = baseline.get(key)
+        if previous is None:
+            continue
+        if current.get('queries') is not None \
+                and previous.get('queries') is not None \
+                and current['queries'] > previous['queries']:
+            regressions.append(
+                f'{key}: queries {previous["queries"]} -> '
+                f'{current["queries"]}'
+            )
+        if not check_timings:
+            continue
+        if previous.get('p99_ms') and \
+                current['p99_ms'] > previous['p99_ms'] * (1 + tolerance):
+            regressions.append(
+                f'{key}: p99 {previous["p99_ms"]}ms -> '
+                f'{current["p99_ms"]}ms'
+            )
+        if previous.get('throughput') and current.get('throughput') and \
+                current['throughput'] < \
+                previous['throughput'] / (1 + tolerance):
+            regressions.append(
+                f'{key}: throughput {previous["throughput"]}/s -> '
+                f'{current["throughput"]}/s'
+            )
+    return regressions
+
+
+def _traced(fn):
+    """Return ``fn()``, the bytes it left allocated and its duration"""
+    tracemalloc.start()
+    try:
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        allocated = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return result, allocated, elapsed
+
+
+def measure_names(user, model=Ingredient, lookups=200):
+    """Compare a name dictionary of ``user``'s ``model`` with ORM instances
+
+    Reports the memory each representation holds, the time to build it
+    and the time to expand one recipe's worth of ids to names.
+    """
+    names.clear()
+    user.refresh_from_db()
+    instances, instances_bytes, instances_s = _traced(
+        lambda: list(model.objects.filter(user=user))
+    )
+    dictionary, _, build_s = _traced(lambda: names.get(model, user))
+    ids = [obj.pk for obj in instances]
+    rng = random.Random(0)
+    samples = [rng.sample(ids, min(INGREDIENTS_PER_RECIPE, len(ids)))
+               for _ in range(lookups)]
+
+    t0 = time.perf_counter()
+    for sample in samples:
+        names.expand(model, user, sample)
+    expand_s = (time.perf_counter() - t0) / lookups
+    t0 = time.perf_counter()
+    for sample in samples:
+        list(model.objects.filter(pk__in=sample).values('id', 'name'))
+    orm_s = (time.perf_counter() - t0) / lookups
+
+    return OrderedDict([
+        ('entries', len(dictionary)),
+        ('dictionary_kb', round(dictionary.nbytes / 1024, 1)),
+        ('instances_kb', round(instances_bytes / 1024, 1)),
+        ('build_ms', round(build_s * 1000, 3)),
+        ('instances_ms', round(instances_s * 1000, 3)),
+        ('expand_us', round(expand_s * 1e6, 1)),
+        ('orm_expand_us', round(orm_s * 1e6, 1)),
+    ])
+
+
+def measure_recommend(user, lookups=200):
+    """Time building ``user``'s recommendation index and querying it"""
+    recommend.clear()
+    index, index_bytes, build_s = _traced(
+        lambda: recommend.RecipeIndex.build(user)
+    )
+    rng = random.Random(0)
+    recipe_ids = [int(pk) for pk in rng.sample(
+        list(index.recipe_ids), min(lookups, len(index))
+    )]
+    ingredient_ids = list(
+        Ingredient.objects.filter(user=user).values_list('id', flat=True)
+    )
+
+    timings = {'similar': [], 'cookable': []}
+    for recipe_id in recipe_ids:
+        t0 = time.perf_counter()
+        index.similar(recipe_id)
+        timings['similar'].append(time.perf_counter() - t0)
+        sample = rng.sample(ingredient_ids, min(5, len(ingredient_ids)))
+        t0 = time.perf_counter()
+        index.cookable(sample)
+        timings['cookable'].append(time.perf_counter() - t0)
+
+    result = OrderedDict([
+        ('recipes', len(index)),
+        ('index_kb', round(index_bytes / 1024, 1)),
+        ('build_ms', round(build_s * 1000, 3)),
+    ])
+    for name, values in timings.items():
+        for pct in (50, 99):
+            result[f'{name}_p{pct}_ms'] = round(
+                percentile(values, pct) * 1000, 3
+            )
+    return result
+
+
+def measure_snapshot(user, requests=20):
+    """Time ``user``'s recipe list serialized, from a snapshot and patched"""
+    client = APIClient()
+    client.force_authenticate(user)
+    url = reverse('recipe:recipe-list')
+    caches[settings.RECIPE_SNAPSHOT_CACHE].clear()
+
+    def timed(count=1, **headers):
+        times = []
+        for _ in range(count):
+            t0 = time.perf_counter()
+            response = client.get(url, **headers)
+            times.append(time.perf_counter() - t0)
+        timed.size = len(response.content)
+        return times
+
+    user.recipe_list_snapshot = False
+    serialized = timed(3)
+    user.recipe_list_snapshot = True
+    build = timed()
+    fresh = timed(requests)
+    plain_size = timed.size
+    fresh_gzip = timed(requests, HTTP_ACCEPT_ENCODING='gzip')
+    gzip_size = timed.size
+    changed = Recipe.objects.filter(user=user).order_by('id')[:10]
+    patched = []
+    with override_settings(RECIPE_SNAPSHOT_MAX_AGE=0):
+        for recipe in changed:
+            recipe.save()
+            patched += timed()
+
+    meta = caches[settings.RECIPE_SNAPSHOT_CACHE].get(
+        snapshots._key(user.pk, 'meta')
+    )
+    segments = caches[settings.RECIPE_SNAPSHOT_CACHE].get_many(
+        [snapshots._key(user.pk, number) for number in meta[2]]
+    )
+    result = OrderedDict([
+        ('recipes', Recipe.objects.filter(user=user).count()),
+        ('snapshot_kb', round(sum(map(len, segments.values())) / 1024, 1)),
+        ('list_kb', round(plain_size / 1024, 1)),
+        ('gzip_kb', round(gzip_size / 1024, 1)),
+        ('build_ms', round(build[0] * 1000, 3)),
+    ])
+    for name, values in (('serialized', serialized), ('fresh', fresh),
+                         ('fresh_gzip', fresh_gzip), ('patched', patched)):
+        result[f'{name}_p50_ms'] = round(percentile(values, 50) * 1000, 3)
+    return result
+
+
+# Boots the WSGI application in a fresh interpreter and serves one
+# unauthenticated request, which needs no database query
+STARTUP_SCRIPT = """
+import io, json, sys, time
+t0 = time.perf_counter()
+from app.wsgi import application
+booted = time.perf_counter()
+statuses = []
+b''.join(application({
+    'REQUEST_METHOD': 'GET', 'PATH_INFO': sys.argv[1], 'QUERY_STRING': '',
+    'SCRIPT_NAME': '', 'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+    'HTTP_HOST': 'localhost', 'wsgi.input': io.BytesIO(),
+    'wsgi.errors': sys.stderr, 'wsgi.url_scheme': 'http',
+}, lambda status, headers, exc_info=None: statuses.append(status)))
+print(json.dumps({
+    'status': int(statuses[0].split()[0]),
+    'boot': booted - t0,
+    'modules': len(sys.modules),
+}))
+"""
+STARTUP_PATH = '/api/user/me/'
+IMPORTTIME_LINE = re.compile(r'import time:\s+(\d+) \|\s+\d+ \| *(\S+)')
+
+
+def _boot(settings_module, *flags):
+    """Run ``STARTUP_SCRIPT``, return its report, stderr and wall time"""
+    env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings_module)
+    t0 = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, *flags, '-c', STARTUP_SCRIPT, STARTUP_PATH],
+        cwd=settings.BASE_DIR, env=env, check=True,
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    elapsed = time.perf_counter() - t0
+    return json.loads(proc.stdout.splitlines()[-1]), proc.stderr, elapsed
+
+
+def import_summary(stderr, top=10):
+    """Self import time in ms per top-level package, from -X importtime"""
+    totals = {}
+    for match in IMPORTTIME_LINE.finditer(stderr):
+        package = match.group(2).split('.')[0]
+        totals[package] = totals.get(package, 0) + int(match.group(1))
+    ranked = sorted(totals.items(), key=lambda item: -item[1])
+    return OrderedDict(
+        (package, round(us / 1000, 1)) for package, us in ranked[:top]
+    )
+
+
+def measure_startup(settings_module, runs=5):
+    """Boot ``runs`` fresh processes with ``settings_module``
+
+    Reports the time from spawning a process to its first response and
+    the part spent importing and setting up Django, in the same shape as
+    ``run_scenario``, plus an import time summary of one extra run.
+    """
+    boots, totals, statuses = [], [], set()
+    for _ in range(runs):
+        report, _, elapsed = _boot(settings_module)
+        statuses.add(report['status'])
+        boots.append(report['boot'])
+        totals.append(elapsed)
+    report, stderr, _ = _boot(settings_module, '-X', 'importtime')
+
+    def row(timings):
+        return OrderedDict([
+            ('iterations', runs),
+            ('status', sorted(statuses)),
+            ('throughput', None),
+            ('p50_ms', round(percentile(timings, 50) * 1000, 3)),
+            ('p99_ms', round(percentile(timings, 99) * 1000, 3)),
+            ('queries', None),
+            ('modules', report['modules']),
+        ])
+
+    return row(boots), row(totals), import_summary(stderr)
+
+
+def middleware_overhead(requests=2000):
+    """Time one request through the scoped and unscoped middleware stacks
+
+    An anonymous ``user-me`` request is rejected by DRF without a query,
+    so what differs between the stacks is the middleware alone. Stacks
+    take turns request by request, so drift in machine load hits both.
+    ``[unscoped]`` applies ``SCOPED_MIDDLEWARE`` to every path.
+    """
+    handlers = OrderedDict()
+    for label, stack in (
+        ('scoped', settings.MIDDLEWARE),
+        ('unscoped', middleware.unscoped(settings.MIDDLEWARE)),
+    ):
+        with override_settings(MIDDLEWARE=stack):
+            handlers[label] = BaseHandler()
+            handlers[label].load_middleware()
+    factory = RequestFactory()
+    url = reverse('user:me')
+    timings = {label: [] for label in handlers}
+    statuses = {label: set() for label in handlers}
+    for _ in range(requests):
+        for label, handler in handlers.items():
+            request = factory.get(url)
+            t0 = time.perf_counter()
+            response = handler.get_response(request)
+            timings[label].append(time.perf_counter() - t0)
+            statuses[label].add(response.status_code)
+
+    return OrderedDict(
+        (f'middleware:user-me-anonymous[{label}]', OrderedDict([
+            ('iterations', requests),
+            ('status', sorted(statuses[label])),
+            ('throughput', round(requests / sum(timings[label]), 2)),
+            ('p50_ms', round(percentile(timings[label], 50) * 1000, 3)),
+            ('p99_ms', round(percentile(timings[label], 99) * 1000, 3)),
+            ('queries', None),
+        ]))
+        for label in handlers
+    )
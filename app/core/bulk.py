@@ -0,0 +1,312 @@
+"""Set-based bulk operations on recipes, tags and ingredients.
+
+These write with plain SQL instead of per-row ORM saves, so they update
+the counters in core.stats, image references in core.storage, name
+dictionaries in core.names and list snapshots in core.snapshots
+themselves rather than relying on core.signals.
+"""
+from collections import OrderedDict
+
+from django.db import connections, router, transaction
+from django.db.models import Case, Count, Max, Value, When
+from django.db.models.signals import m2m_changed
+from django.utils import timezone
+
+from core import names, sharding, snapshots, stats, storage, webhooks
+from core.models import OutboxEvent, Recipe, User
+
+COPIED_FIELDS = ('title', 'time_minutes', 'price', 'link', 'image')
+# Fields of the through models stored with each link
+LINK_VALUES = {'tags': ('position',), 'ingredients': ('position', 'quantity')}
+
+
+def _placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+def copy_recipes(user, recipe_ids):
+    """Duplicate ``user``'s recipes with their tags and ingredients
+
+    Rows and through-table links are copied with ``INSERT ... SELECT``
+    and image blobs are shared rather than duplicated. Returns the
+    copies ordered like their originals' ids.
+    """
+    recipe_ids = sorted(set(recipe_ids))
+    if not recipe_ids:
+        return Recipe.objects.none()
+
+    db = sharding.shard_for(user)
+    connection = connections[db]
+    qn = connection.ops.quote_name
+    table = qn(Recipe._meta.db_table)
+    columns = ', '.join(
+        qn(Recipe._meta.get_field(name).column) for name in COPIED_FIELDS
+    )
+    user_column = qn(Recipe._meta.get_field('user').column)
+    copied_column = qn(Recipe._meta.get_field('copied_from').column)
+    version_column = qn(Recipe._meta.get_field('version').column)
+    updated_column = qn(Recipe._meta.get_field('updated_at').column)
+    deleted_column = qn(Recipe._meta.get_field('deleted_at').column)
+    returning = connection.features.can_return_ids_from_bulk_insert
+
+    with sharding.pinned(user), transaction.atomic(using=db), \
+            connection.cursor() as cursor:
+        if not returning:
+            last_id = Recipe.all_objects.aggregate(
+                last=Max('id'),
+            )['last'] or 0
+        cursor.execute(
+            f'INSERT INTO {table} ({columns}, {user_column}, '
+            f'{copied_column}, {version_column}, {updated_column}) '
+            f'SELECT {columns}, {user_column}, id, 1, %s FROM {table} '
+            f'WHERE {user_column} = %s AND {deleted_column} IS NULL '
+            f'AND id IN ({_placeholders(recipe_ids)}) ORDER BY id'
+            + (' RETURNING id' if returning else ''),
+            [connection.ops.adapt_datetimefield_value(timezone.now()),
+             user.pk] + recipe_ids,
+        )
+        if returning:
+            new_ids = [row[0] for row in cursor.fetchall()]
+        else:
+            new_ids = list(Recipe.objects.filter(
+                user=user, copied_from__in=recipe_ids, id__gt=last_id,
+            ).values_list('id', flat=True))
+        if not new_ids:
+            return Recipe.objects.none()
+
+        for field in ('tags', 'ingredients'):
+            rel = Recipe._meta.get_field(field)
+            through = rel.remote_field.through
+            links = qn(through._meta.db_table)
+            source = qn(through._meta.get_field(
+                rel.m2m_field_name()
+            ).column)
+            copied = [
+                qn(through._meta.get_field(name).column) for name in
+                (rel.m2m_reverse_field_name(),) + LINK_VALUES[field]
+            ]
+            columns = ', '.join(copied)
+            values = ', '.join(f'l.{column}' for column in copied)
+            cursor.execute(
+                f'INSERT INTO {links} ({source}, {columns}) '
+                f'SELECT r.id, {values} FROM {table} r '
+                f'JOIN {links} l ON l.{source} = r.{copied_column} '
+                f'WHERE r.id IN ({_placeholders(new_ids)})',
+                new_ids,
+            )
+
+        copies = Recipe.objects.filter(id__in=new_ids)
+        stats.recipes_added(user.pk, copies)
+        stats.links_added(new_ids)
+        snapshots.mark_stale(user.pk)
+        webhooks.record(OutboxEvent.CREATED, 'recipe', user.pk, new_ids)
+        images = copies.exclude(image='').exclude(image__isnull=True)\
+            .order_by().values('image').annotate(n=Count('id'))
+        for row in images:
+            storage.retain(row['image'], row['n'])
+    return copies.using(db).order_by('copied_from')
+
+
+def _link_values(field, targets):
+    """``{pk: values}`` of links to ``targets`` in order, as in LINK_VALUES
+
+    Positions follow the order of ``targets``; an ingredient's quantity is
+    read from its ``link_quantity`` attribute when the caller set one.
+    """
+    values = OrderedDict()
+    for obj in targets:
+        if obj.pk in values:
+            continue
+        row = {
+            'position': len(values),
+            'quantity': getattr(obj, 'link_quantity', ''),
+        }
+        values[obj.pk] = tuple(row[name] for name in LINK_VALUES[field])
+    return values
+
+
+def _links(recipe, field):
+    """The through model, link queryset and signal kwargs for ``field``"""
+    rel = Recipe._meta.get_field(field)
+    through = rel.remote_field.through
+    db = router.db_for_write(through, instance=recipe)
+    links = through.objects.using(db).filter(
+        **{rel.m2m_field_name(): recipe}
+    )
+    signal = {
+        'sender': through, 'instance': recipe, 'reverse': False,
+        'model': rel.related_model, 'using': db,
+    }
+    return through, links, signal
+
+
+def _new_links(through, recipe, field, values):
+    target = Recipe._meta.get_field(field).m2m_reverse_field_name()
+    return [
+        through(recipe_id=recipe.pk, **{f'{target}_id': pk},
+                **dict(zip(LINK_VALUES[field], row)))
+        for pk, row in values.items()
+    ]
+
+
+def set_links(recipe, field, targets, current=None):
+    """Make ``recipe.<field>`` hold exactly ``targets``, in their order
+
+    Unlike ``RelatedManager.set`` the diff is applied as at most one
+    DELETE, one UPDATE (of moved links and changed quantities) and one
+    INSERT, the first and last each announced with a single exact
+    ``m2m_changed`` signal. Pass ``current`` when the links are already
+    known (e.g. an empty dict for a new recipe) to skip reading them; it
+    maps linked ids to their values as in LINK_VALUES. The recipe is
+    expected to be saved alongside, which is what moves its
+    ``updated_at`` for the sync feed.
+    """
+    through, links, signal = _links(recipe, field)
+    target = Recipe._meta.get_field(field).m2m_reverse_field_name()
+    names = LINK_VALUES[field]
+
+    wanted = _link_values(field, targets)
+    if current is None:
+        current = {
+            row[0]: row[1:]
+            for row in links.values_list(f'{target}_id', *names)
+        }
+    removed = set(current) - set(wanted)
+    added = OrderedDict(
+        (pk, row) for pk, row in wanted.items() if pk not in current
+    )
+    changed = {
+        pk: row for pk, row in wanted.items()
+        if pk in current and current[pk] != row
+    }
+
+    with transaction.atomic(using=signal['using'], savepoint=False):
+        if removed:
+            m2m_changed.send(action='pre_remove', pk_set=removed,
+                             exact=True, **signal)
+            # Nothing cascades from link rows, so skip the delete collector
+            links.filter(**{f'{target}_id__in': removed})\
+                ._raw_delete(links.db)
+            m2m_changed.send(action='post_remove', pk_set=removed,
+                             exact=True, **signal)
+        if changed:
+            links.filter(**{f'{target}_id__in': changed}).update(**{
+                name: Case(*[
+                    When(**{f'{target}_id': pk}, then=Value(row[i]))
+                    for pk, row in changed.items()
+                ], output_field=through._meta.get_field(name))
+                for i, name in enumerate(names)
+            })
+        if added:
+            m2m_changed.send(action='pre_add', pk_set=set(added),
+                             exact=True, **signal)
+            through.objects.using(links.db).bulk_create(
+                _new_links(through, recipe, field, added)
+            )
+            m2m_changed.send(action='post_add', pk_set=set(added),
+                             exact=True, **signal)
+    # Record the new links for serialization, saving a read
+    _remember(recipe, field, wanted)
+
+
+def _remember(recipe, field, values):
+    if not hasattr(recipe, '_link_ids'):
+        recipe._link_ids = {}
+    recipe._link_ids[field] = list(values)
+    if field == 'ingredients':
+        recipe._quantities = {
+            pk: row[1] for pk, row in values.items() if row[1]
+        }
+
+
+def _forget(recipe, field):
+    getattr(recipe, '_link_ids', {}).pop(field, None)
+    if field == 'ingredients' and hasattr(recipe, '_quantities'):
+        del recipe._quantities
+
+
+def add_links(recipe, field, targets):
+    """Link ``targets`` to ``recipe`` after its current links
+
+    This is what ``recipe.tags.add()`` runs (see core.models.LinkField):
+    the new links are announced with ``m2m_changed`` as Django's
+    ``add()`` would, which keeps the usage counters, the sync feed and
+    list snapshots up to date.
+    """
+    through, links, signal = _links(recipe, field)
+    target = Recipe._meta.get_field(field).m2m_reverse_field_name()
+    with transaction.atomic(using=signal['using'], savepoint=False):
+        current = dict(links.values_list(f'{target}_id', 'position'))
+        start = max(current.values(), default=-1) + 1
+        added = OrderedDict()
+        for pk, row in _link_values(field, targets).items():
+            if pk not in current:
+                values = dict(zip(LINK_VALUES[field], row),
+                              position=start + len(added))
+                added[pk] = tuple(values[name] for name in LINK_VALUES[field])
+        if not added:
+            return
+        m2m_changed.send(action='pre_add', pk_set=set(added), **signal)
+        through.objects.using(links.db).bulk_create(
+            _new_links(through, recipe, field, added)
+        )
+        m2m_changed.send(action='post_add', pk_set=set(added), **signal)
+    _forget(recipe, field)
+
+
+def remove_links(recipe, field, targets):
+    """Unlink ``targets`` from ``recipe``, run by ``remove()``"""
+    through, links, signal = _links(recipe, field)
+    target = Recipe._meta.get_field(field).m2m_reverse_field_name()
+    pks = {obj.pk for obj in targets}
+    with transaction.atomic(using=signal['using'], savepoint=False):
+        m2m_changed.send(action='pre_remove', pk_set=pks, **signal)
+        links.filter(**{f'{target}_id__in': pks})._raw_delete(links.db)
+        m2m_changed.send(action='post_remove', pk_set=pks, **signal)
+    _forget(recipe, field)
+
+
+def get_or_create_named(model, user, wanted):
+    """The tag/ingredient of ``user`` named like each of ``wanted``
+
+    Names already taken by a live row resolve to it, with one query for
+    the whole batch; the rest are inserted with a single ``bulk_create``.
+    Returns ``(instance, created)`` pairs in the order of ``wanted``,
+    repeated names sharing one instance. Batches of the same user are
+    serialized by locking the user row, so they do not race each other
+    into duplicates.
+    """
+    with sharding.pinned(user), sharding.atomic():
+        # The user's mirror when sharded, so the lock is taken where the
+        # rows are written
+        list(User.objects.using(sharding.alias()).select_for_update()
+             .filter(pk=user.pk).values_list('pk'))
+        found = {}
+        rows = model.objects.filter(user=user, name__in=set(wanted))\
+            .order_by('id')
+        for instance in rows:
+            found.setdefault(instance.name, instance)
+        new = [
+            model(user=user, name=name)
+            for name in OrderedDict.fromkeys(wanted) if name not in found
+        ]
+        model.objects.bulk_create(new)
+        if new and new[0].pk is None:
+            # The backend cannot return ids from a bulk insert
+            created = model.objects.filter(
+                user=user, name__in=[instance.name for instance in new],
+            ).order_by('id').values_list('name', 'id')
+            ids = {}
+            for name, pk in created:
+                ids.setdefault(name, pk)
+            for instance in new:
+                instance.pk = ids[instance.name]
+        if new:
+            names.bump(user.pk)
+            webhooks.record(OutboxEvent.CREATED, model._meta.model_name,
+                            user.pk, [instance.pk for instance in new])
+    created = {instance.name: instance for instance in new}
+    return [
+        (created[name], True) if name in created else (found[name], False)
+        for name in wanted
+    ]
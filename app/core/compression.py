@@ -0,0 +1,167 @@
+"""Negotiated response compression for JSON payloads.
+
+Recipe lists are large and repetitive, so JSON responses of at least
+``COMPRESS_MIN_BYTES`` are sent gzip or, when the ``brotli`` module is
+installed, Brotli encoded, whichever the client's ``Accept-Encoding``
+prefers. Streaming responses are compressed chunk by chunk and bodies
+that are cached anyway can keep their compressed bytes next to them
+(``cached_response``). HTML is left alone: the admin's pages carry CSRF
+tokens, which compression would expose to BREACH.
+"""
+import zlib
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import patch_vary_headers
+
+COMPRESSIBLE_TYPES = ('application/json',)
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+_brotli = None
+
+
+def brotli():
+    """The ``brotli`` module, or None when it is not installed"""
+    global _brotli
+    if _brotli is None:
+        try:
+            import brotli as module
+        except ImportError:
+            module = False
+        _brotli = module
+    return _brotli or None
+
+
+def available():
+    return ('br', 'gzip') if brotli() else ('gzip',)
+
+
+def negotiate(request):
+    """The encoding to use for ``request``'s response, if any"""
+    accepted = {}
+    for item in request.META.get('HTTP_ACCEPT_ENCODING', '').split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                continue
+        accepted[coding.strip().lower()] = quality
+    best, best_quality = None, 0
+    for encoding in available():
+        quality = accepted.get(encoding, accepted.get('*', 0))
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compressor(encoding):
+    """An object with ``compress(chunk)`` and ``flush()`` for ``encoding``"""
+    if encoding == 'br':
+        return _BrotliCompressor()
+    return _GzipCompressor()
+
+
+class _GzipCompressor:
+
+    def __init__(self):
+        # wbits 31 writes the gzip header and trailer
+        self.obj = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.obj.compress(data) + self.obj.flush(zlib.Z_SYNC_FLUSH)
+
+    def flush(self):
+        return self.obj.flush()
+
+
+class _BrotliCompressor:
+
+    def __init__(self):
+        self.obj = brotli().Compressor(quality=BROTLI_QUALITY)
+
+    def compress(self, data):
+        return self.obj.process(data) + self.obj.flush()
+
+    def flush(self):
+        return self.obj.finish()
+
+
+def compress(data, encoding):
+    obj = compressor(encoding)
+    return obj.compress(data) + obj.flush()
+
+
+def compress_stream(chunks, encoding):
+    """Compress ``chunks`` lazily, flushing after each one"""
+    obj = compressor(encoding)
+    for chunk in chunks:
+        data = obj.compress(chunk)
+        if data:
+            yield data
+    yield obj.flush()
+
+
+def compressible(response):
+    content_type = response.get('Content-Type', '').split(';')[0].strip()
+    return content_type in COMPRESSIBLE_TYPES \
+        and not response.has_header('Content-Encoding')
+
+
+def compress_response(request, response):
+    """``response`` compressed as ``request`` accepts, where worthwhile"""
+    if not compressible(response):
+        return response
+    patch_vary_headers(response, ('Accept-Encoding',))
+    encoding = negotiate(request)
+    if encoding is None:
+        return response
+    if response.streaming:
+        response.streaming_content = compress_stream(
+            response.streaming_content, encoding
+        )
+        del response['Content-Length']
+    else:
+        if len(response.content) < settings.COMPRESS_MIN_BYTES:
+            return response
+        compressed = compress(response.content, encoding)
+        if len(compressed) >= len(response.content):
+            return response
+        response.content = compressed
+        response['Content-Length'] = str(len(compressed))
+    # ETags are left strong: they name recipe versions for If-Match, not
+    # the bytes on the wire
+    response['Content-Encoding'] = encoding
+    return response
+
+
+def cached_response(request, body, content_type, cache, key, timeout):
+    """A response for the cached body ``body()`` identified by ``key``
+
+    Its compressed form is kept in ``cache`` under ``key`` and the
+    encoding, so identical bodies are compressed once per encoding.
+    """
+    encoding = negotiate(request) if content_type in COMPRESSIBLE_TYPES \
+        else None
+    data = None
+    if encoding is not None:
+        data = cache.get(f'{key}:{encoding}')
+        if data is None:
+            raw = body()
+            if len(raw) >= settings.COMPRESS_MIN_BYTES:
+                data = compress(raw, encoding)
+                cache.set(f'{key}:{encoding}', data, timeout)
+            else:
+                encoding = None
+                data = raw
+    response = HttpResponse(
+        data if data is not None else body(), content_type=content_type,
+    )
+    if encoding is not None:
+        response['Content-Encoding'] = encoding
+    if content_type in COMPRESSIBLE_TYPES:
+        patch_vary_headers(response, ('Accept-Encoding',))
+    return response
@@ -0,0 +1,69 @@
+"""Bounded thread pool for overlapping independent ORM reads.
+
+Django 2.1 has no async views, so a request thread always waits on its
+queries. ``parallel`` lets a view issue independent reads at the same
+time on a small pool of worker threads, each holding its own database
+connection, so a slow database costs one round trip instead of several.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections
+
+from core import sharding
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The process-wide executor, created on first use"""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ORM_EXECUTOR_WORKERS,
+                thread_name_prefix='orm',
+            )
+    return _executor
+
+
+def shutdown():
+    """Stop the worker threads, releasing their database connections"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=True)
+            _executor = None
+
+
+def _run(fn, db):
+    try:
+        # Recipe data goes to the shard the calling thread pinned
+        with sharding.using(db):
+            return fn()
+    finally:
+        # Worker connections are long lived; drop them once broken
+        for connection in connections.all():
+            if connection.errors_occurred:
+                connection.close()
+
+
+def parallel(*fns):
+    """Call ``fns`` concurrently and return their results in order
+
+    Falls back to calling them one after the other when the pool is
+    disabled, inside a transaction, whose uncommitted rows other
+    connections could not see, or while the caller's queries are being
+    captured (``assertNumQueries``, the benchmark), which only sees the
+    caller's connection.
+    """
+    connection = connections[sharding.alias()]
+    if len(fns) < 2 or not settings.ORM_EXECUTOR_WORKERS \
+            or connection.in_atomic_block or connection.queries_logged:
+        return [fn() for fn in fns]
+    db = sharding.current()
+    futures = [get_executor().submit(_run, fn, db) for fn in fns[1:]]
+    first = fns[0]()
+    return [first] + [future.result() for future in futures]
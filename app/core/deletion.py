@@ -0,0 +1,171 @@
+"""Soft deletion and the batched purge behind it.
+
+Deleting a recipe or a whole account only marks rows with ``deleted_at``,
+which ``objects`` managers then hide. ``purge`` (run by ``manage.py
+purge_deleted``) removes marked rows later in small batches, each in its
+own short transaction, instead of one huge cascade inside a request.
+"""
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from core import jobs, sharding, snapshots, stats, storage, sync, webhooks
+from core.models import Ingredient, OutboxEvent, Recipe, RecipeStats, Tag, \
+    Tombstone, User, Webhook
+
+LINK_FIELDS = ('tags', 'ingredients')
+
+
+def delete_recipe(recipe):
+    """Soft delete ``recipe``, accounting for it like a hard delete"""
+    now = timezone.now()
+    with sharding.pinned(recipe.user_id), sharding.atomic():
+        if not Recipe.objects.filter(pk=recipe.pk).update(
+            deleted_at=now, updated_at=now,
+        ):
+            return
+        recipe.deleted_at = now
+        stats.recipe_unlinked(recipe)
+        stats.recipe_removed(recipe.user_id, stats.recipe_values(recipe))
+        sync.record_deletion(recipe)
+        webhooks.record(OutboxEvent.DELETED, 'recipe', recipe.user_id,
+                        [recipe.pk])
+        snapshots.mark_stale(recipe.user_id)
+
+
+def delete_user(user):
+    """Deactivate ``user`` and soft delete everything they own
+
+    A handful of UPDATEs, however large the account. Counters and sync
+    tombstones are not maintained for the rows, nobody can read them any
+    more; the user row itself goes once ``purge`` has emptied it. A job
+    purging just this account runs ``settings.PURGE_GRACE_MINUTES`` later.
+    """
+    now = timezone.now()
+    with transaction.atomic(), sharding.pinned(user), \
+            sharding.atomic(savepoint=False):
+        user.is_active, user.deleted_at = False, now
+        # A save, so post_save deactivates the user's shard mirror too
+        user.save(update_fields=['is_active', 'deleted_at'])
+        Token.objects.filter(user=user).delete()
+        RecipeStats.objects.filter(user=user).delete()
+        Webhook.objects.filter(user=user).update(is_active=False)
+        for model in (Recipe, Tag, Ingredient):
+            model.objects.filter(user=user).update(deleted_at=now)
+        grace = settings.PURGE_GRACE_MINUTES
+        jobs.enqueue('core.tasks.purge_user', args=(user.pk, grace),
+                     delay=grace * 60)
+
+
+def _purge_recipes(ids):
+    """Remove soft-deleted recipes ``ids``, bypassing the delete signals"""
+    for field in LINK_FIELDS:
+        through = Recipe._meta.get_field(field).remote_field.through
+        links = through.objects.filter(recipe_id__in=ids)
+        links._raw_delete(links.db)
+    Recipe.all_objects.filter(copied_from__in=ids).update(copied_from=None)
+    images = Recipe.all_objects.filter(id__in=ids).exclude(image='')\
+        .exclude(image__isnull=True).order_by().values('image')\
+        .annotate(n=Count('id'))
+    for row in images:
+        storage.release(row['image'], row['n'])
+    recipes = Recipe.all_objects.filter(id__in=ids)
+    recipes._raw_delete(recipes.db)
+
+
+def _purge_attrs(field, ids):
+    """Remove the soft-deleted tags or ingredients ``ids``"""
+    rel = Recipe._meta.get_field(field)
+    links = rel.remote_field.through.objects.filter(
+        **{f'{rel.m2m_reverse_field_name()}__in': ids}
+    )
+    sync.touch_recipes(list(
+        Recipe.objects.filter(pk__in=links.values('recipe_id'))
+        .values_list('pk', flat=True)
+    ))
+    links._raw_delete(links.db)
+    rows = rel.related_model.all_objects.filter(id__in=ids)
+    rows._raw_delete(rows.db)
+
+
+def _owns_rows(user):
+    db = sharding.shard_for(user)
+    return any(
+        model.all_objects.using(db).filter(user=user).exists()
+        for model in (Recipe, Tag, Ingredient)
+    )
+
+
+def purge(grace, batch_size=500, user=None):
+    """Remove rows soft deleted at least ``grace`` ago
+
+    Yields ``(model name, rows removed)`` after every batch, so callers
+    can report progress or pause between them. With ``user`` (an id) only
+    that user's rows, and the user, are looked at.
+    """
+    cutoff = timezone.now() - grace
+    dbs = sharding.databases() if user is None \
+        else [sharding.shard_for(user)]
+    for db in dbs:
+        with sharding.using(db):
+            yield from _purge_rows(cutoff, batch_size, user)
+
+    sharded = bool(sharding.shards())
+    users = User.objects.filter(deleted_at__lt=cutoff)
+    if user is not None:
+        users = users.filter(pk=user)
+    if not sharded:
+        for model in (Recipe, Tag, Ingredient):
+            users = users.exclude(
+                pk__in=model.all_objects.values('user_id')
+            )
+    for user in users.iterator():
+        # Shards cannot be subqueried from the default database
+        if sharded and _owns_rows(user):
+            continue
+        yield from _purge_history(user, batch_size)
+        user.delete()
+        yield 'user', 1
+
+
+def _purge_history(user, batch_size):
+    """Remove the tombstones and outbox events of ``user`` batch by batch
+
+    They can outnumber the user's rows by far; left to the cascade of
+    ``user.delete()`` they would all go in one transaction.
+    """
+    with sharding.pinned(user):
+        for model in (Tombstone, OutboxEvent):
+            while True:
+                with sharding.atomic():
+                    ids = list(model.objects.filter(user=user)
+                               .values_list('id', flat=True)[:batch_size])
+                    if not ids:
+                        break
+                    rows = model.objects.filter(id__in=ids)
+                    rows._raw_delete(rows.db)
+                yield model._meta.model_name, len(ids)
+
+
+def _purge_rows(cutoff, batch_size, user=None):
+    for model, purge_batch in (
+        (Recipe, _purge_recipes),
+        (Tag, lambda ids: _purge_attrs('tags', ids)),
+        (Ingredient, lambda ids: _purge_attrs('ingredients', ids)),
+    ):
+        while True:
+            with sharding.atomic():
+                # Locked, so concurrent purges take different batches and
+                # never release the same images twice
+                rows = model.all_objects.select_for_update(
+                    skip_locked=True,
+                ).filter(deleted_at__lt=cutoff)
+                if user is not None:
+                    rows = rows.filter(user=user)
+                ids = list(rows.values_list('id', flat=True)[:batch_size])
+                if not ids:
+                    break
+                purge_batch(ids)
+            yield model._meta.model_name, len(ids)
@@ -0,0 +1,261 @@
+"""A job queue kept in the database, for work a request need not wait on.
+
+``enqueue`` stores a call of a ``@task`` function as a ``Job`` row and
+returns right away; ``manage.py run_worker`` runs the queued jobs on a
+pool of threads, optionally in several processes. Workers claim jobs with
+``SELECT ... FOR UPDATE SKIP LOCKED``, so any number of them can poll the
+table without waiting on each other's locks or running a job twice. A
+job that raises is retried with exponential backoff until it has used up
+its attempts, then left ``failed`` with its traceback.
+
+Jobs live on the default database. Tasks that touch recipe data pin the
+user's shard themselves (see core.sharding).
+"""
+import json
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Avg, Count, DurationField, ExpressionWrapper, \
+    F, Min, Q, Sum
+from django.utils import timezone
+
+from core.models import Job
+
+_tasks = {}
+
+
+def task(fn=None, *, max_attempts=None):
+    """Register ``fn`` as a task jobs can run, under its dotted path
+
+    ``max_attempts`` overrides ``settings.JOB_MAX_ATTEMPTS`` for its jobs.
+    """
+    def register(fn):
+        fn.task_name = f'{fn.__module__}.{fn.__qualname__}'
+        fn.max_attempts = max_attempts
+        _tasks[fn.task_name] = fn
+        return fn
+    return register(fn) if fn else register
+
+
+def enqueue(fn, args=(), kwargs=None, delay=0):
+    """Queue a call of the task ``fn`` (or its name) and return the ``Job``
+
+    ``args`` and ``kwargs`` have to be JSON serializable. The job becomes
+    due ``delay`` seconds from now. Inside a transaction on the default
+    database the job is only queued if that transaction commits.
+    """
+    name = getattr(fn, 'task_name', fn)
+    if name not in _tasks:
+        raise LookupError(f'{name} is not a registered task')
+    return Job.objects.create(
+        name=name,
+        payload=json.dumps({'args': list(args), 'kwargs': kwargs or {}}),
+        max_attempts=_tasks[name].max_attempts or settings.JOB_MAX_ATTEMPTS,
+        run_at=timezone.now() + timedelta(seconds=delay),
+    )
+
+
+def claim(worker, limit=1):
+    """Mark up to ``limit`` due jobs as run by ``worker`` and return them
+
+    Rows another worker has locked are skipped rather than waited for.
+    Each job is taken with a conditional UPDATE, so backends without
+    ``SKIP LOCKED`` (SQLite) still never hand a job out twice.
+    """
+    now = timezone.now()
+    claimed = []
+    with transaction.atomic():
+        due = Job.objects.select_for_update(skip_locked=True).filter(
+            status=Job.QUEUED, run_at__lte=now,
+        ).order_by('run_at', 'id')[:limit]
+        for job in due:
+            if Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(
+                status=Job.RUNNING, worker=worker, started_at=now,
+                heartbeat_at=now, attempts=F('attempts') + 1,
+            ):
+                job.status, job.worker, job.started_at, job.heartbeat_at = \
+                    Job.RUNNING, worker, now, now
+                job.attempts += 1
+                claimed.append(job)
+    return claimed
+
+
+def backoff(attempts, delay=None, limit=None):
+    """Seconds to wait before retrying after ``attempts`` failures
+
+    ``delay`` doubles with each failure up to ``limit``; they default to
+    the JOB_RETRY_DELAY and JOB_RETRY_MAX_DELAY settings.
+    """
+    delay = settings.JOB_RETRY_DELAY if delay is None else delay
+    limit = settings.JOB_RETRY_MAX_DELAY if limit is None else limit
+    return min(delay * 2 ** (attempts - 1), limit)
+
+
+def run(job):
+    """Run the claimed ``job`` and record the outcome; True on success"""
+    try:
+        fn = _tasks.get(job.name)
+        if fn is None:
+            raise LookupError(f'{job.name} is not a registered task')
+        payload = json.loads(job.payload)
+        fn(*payload['args'], **payload['kwargs'])
+    except Exception:
+        error = traceback.format_exc()
+        _close_broken_connections()
+        now = timezone.now()
+        if job.attempts < job.max_attempts:
+            job.status = Job.QUEUED
+            job.run_at = now + timedelta(seconds=backoff(job.attempts))
+        else:
+            job.status, job.finished_at = Job.FAILED, now
+        job.last_error = error
+        Job.objects.filter(pk=job.pk).update(
+            status=job.status, run_at=job.run_at,
+            finished_at=job.finished_at, last_error=error,
+        )
+        return False
+    _close_broken_connections()
+    job.status, job.finished_at = Job.DONE, timezone.now()
+    Job.objects.filter(pk=job.pk).update(
+        status=job.status, finished_at=job.finished_at,
+    )
+    return True
+
+
+def _close_broken_connections():
+    # Worker connections are long lived; drop them once broken
+    for connection in connections.all():
+        if connection.errors_occurred:
+            connection.close()
+
+
+def heartbeat(workers):
+    """Renew the lease of the jobs ``workers`` are running"""
+    return Job.objects.filter(status=Job.RUNNING, worker__in=workers)\
+        .update(heartbeat_at=timezone.now())
+
+
+def requeue_stale(lease=None):
+    """Give up on running jobs whose worker has been silent for ``lease``
+
+    Silent means no ``heartbeat`` for that long, however long the job has
+    been running. They are queued again, or marked failed when out of
+    attempts. Returns the number of jobs affected.
+    """
+    cutoff = timezone.now() - timedelta(
+        seconds=lease if lease is not None else settings.JOB_LEASE_SECONDS
+    )
+    stale = Job.objects.filter(status=Job.RUNNING).filter(
+        Q(heartbeat_at__lt=cutoff) |
+        Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    )
+    error = 'Lease expired, the worker stopped responding'
+    failed = stale.filter(attempts__gte=F('max_attempts')).update(
+        status=Job.FAILED, finished_at=timezone.now(), last_error=error,
+    )
+    return failed + stale.update(
+        status=Job.QUEUED, run_at=timezone.now(), last_error=error,
+    )
+
+
+def prune(keep=None):
+    """Delete jobs that finished successfully more than ``keep`` ago"""
+    cutoff = timezone.now() - timedelta(
+        seconds=keep if keep is not None else settings.JOB_KEEP_SECONDS
+    )
+    done = Job.objects.filter(status=Job.DONE, finished_at__lt=cutoff)
+    return done._raw_delete(done.db)
+
+
+def work(worker, stop, poll=1.0, drain=False):
+    """Claim and run jobs one at a time until ``stop`` is set
+
+    With ``drain`` it returns as soon as no job is due instead of polling
+    every ``poll`` seconds. Returns the number of jobs run.
+    """
+    ran = 0
+    while not stop.is_set():
+        jobs = claim(worker)
+        if not jobs:
+            if drain:
+                break
+            stop.wait(poll)
+            continue
+        for job in jobs:
+            run(job)
+            ran += 1
+    return ran
+
+
+def serve(worker, threads, stop, poll=1.0, drain=False):
+    """Run ``work`` on ``threads`` threads until ``stop`` is set
+
+    The calling thread requeues stale jobs and prunes finished ones
+    before starting them. Then every ``settings.JOB_LEASE_SECONDS / 10``
+    it renews the lease of the jobs its threads are running and does that
+    housekeeping again. Returns the number of jobs run.
+    """
+    counts = []
+    interval = settings.JOB_LEASE_SECONDS / 10
+    names = [f'{worker}/{n}' for n in range(threads)]
+
+    def target(n):
+        try:
+            counts.append(work(names[n], stop, poll, drain))
+        finally:
+            connections.close_all()
+
+    requeue_stale()
+    prune()
+    housekeeping = time.monotonic() + interval
+    pool = [threading.Thread(target=target, args=(n,), name=f'job-{n}')
+            for n in range(threads)]
+    for thread in pool:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in pool):
+            if time.monotonic() >= housekeeping:
+                heartbeat(names)
+                requeue_stale()
+                prune()
+                housekeeping = time.monotonic() + interval
+            stop.wait(min(poll, interval))
+    finally:
+        stop.set()
+        for thread in pool:
+            thread.join()
+        connections.close_all()
+    return sum(counts)
+
+
+def metrics():
+    """Queue statistics per task name
+
+    ``queued``/``running``/``done``/``failed`` count jobs by status,
+    ``retries`` the attempts beyond the first, ``runtime`` is the mean
+    seconds of the last attempt of successful jobs and ``lag`` the seconds
+    the most overdue queued job has been waiting.
+    """
+    now = timezone.now()
+    runtime = ExpressionWrapper(F('finished_at') - F('started_at'),
+                                output_field=DurationField())
+    rows = Job.objects.order_by().values('name').annotate(
+        **{status: Count('id', filter=Q(status=status))
+           for status, _ in Job.STATUSES},
+        retries=Sum(F('attempts') - 1, filter=Q(attempts__gt=1)),
+        runtime=Avg(runtime, filter=Q(status=Job.DONE)),
+        oldest=Min('run_at', filter=Q(status=Job.QUEUED, run_at__lte=now)),
+    )
+    stats = {}
+    for row in rows:
+        name, oldest, runtime = row.pop('name'), row.pop('oldest'), \
+            row.pop('runtime')
+        row['retries'] = row['retries'] or 0
+        row['runtime'] = runtime.total_seconds() if runtime else None
+        row['lag'] = (now - oldest).total_seconds() if oldest else 0
+        stats[name] = row
+    return stats
@@ -0,0 +1,268 @@
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.db.backends.signals import connection_created
+from django.test.testcases import LiveServerThread
+from django.test.utils import override_settings, \
+    setup_test_environment, teardown_test_environment
+
+from core import benchmark, concurrency
+
+DEFAULT_BASELINE = os.path.join(settings.BASE_DIR, 'benchmark_baseline.json')
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway database and benchmark the API endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--profile', choices=sorted(benchmark.PROFILES), default='small',
+            help='Recipe library sizes to seed',
+        )
+        parser.add_argument(
+            '--driver', choices=('client', 'live', 'both'), default='client',
+            help='Drive requests via the test client, a live server or both',
+        )
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help='Concurrent clients for read (GET) scenarios',
+        )
+        parser.add_argument(
+            '--db-latency-ms', type=float, default=0,
+            help='Artificial delay added to every database query',
+        )
+        parser.add_argument(
+            '--names', type=int, default=0, metavar='INGREDIENTS',
+            help='Also measure the name dictionary of a user with this '
+                 'many ingredients',
+        )
+        parser.add_argument(
+            '--recommend', type=int, default=0, metavar='RECIPES',
+            help='Also measure the recommendation index of a user with '
+                 'this many recipes',
+        )
+        parser.add_argument(
+            '--snapshot', type=int, default=0, metavar='RECIPES',
+            help='Also measure the recipe list snapshot of a user with '
+                 'this many recipes',
+        )
+        parser.add_argument(
+            '--startup', type=int, default=0, metavar='RUNS',
+            help='Also time booting this many fresh worker processes',
+        )
+        parser.add_argument(
+            '--startup-settings', metavar='MODULES',
+            help='Comma separated settings modules to boot with '
+                 '(default: the current settings and app.settings_api)',
+        )
+        parser.add_argument('--output', help='Write results as JSON here')
+        parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+        parser.add_argument(
+            '--compare', action='store_true',
+            help='Fail when results regress against the baseline',
+        )
+        parser.add_argument(
+            '--save-baseline', action='store_true',
+            help='Overwrite the baseline with these results',
+        )
+        parser.add_argument(
+            '--tolerance', type=float, default=0.5,
+            help='Allowed fractional latency/throughput drift',
+        )
+        parser.add_argument(
+            '--queries-only', action='store_true',
+            help='Only compare queries per request (ignore timings)',
+        )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False,
+        )
+        media_root = tempfile.mkdtemp(prefix='benchmark-media-')
+        slow = benchmark.slow_queries(options['db_latency_ms'] / 1000.0)
+
+        def slow_down(sender, connection, **kwargs):
+            connection.execute_wrappers.append(slow)
+
+        try:
+            with override_settings(DEBUG=False, ALLOWED_HOSTS=['*'],
+                                   MEDIA_ROOT=media_root):
+                results = self.run_benchmarks(options)
+                results.update(benchmark.middleware_overhead())
+                if options['names']:
+                    name_stats = benchmark.measure_names(benchmark.seed_user(
+                        10, email='bench-names@example.com',
+                        ingredient_count=options['names'],
+                    ))
+                if options['recommend']:
+                    recommend_stats = benchmark.measure_recommend(
+                        benchmark.seed_user(
+                            options['recommend'],
+                            email='bench-recommend@example.com',
+                        )
+                    )
+                if options['snapshot']:
+                    snapshot_stats = benchmark.measure_snapshot(
+                        benchmark.seed_user(
+                            options['snapshot'],
+                            email='bench-snapshot@example.com',
+                        )
+                    )
+                if options['db_latency_ms']:
+                    for conn in connections.all():
+                        conn.execute_wrappers.append(slow)
+                    connection_created.connect(slow_down)
+                    results.update(self.run_benchmarks(
+                        options, seed=False, label='slowdb',
+                    ))
+        finally:
+            connection_created.disconnect(slow_down)
+            for conn in connections.all():
+                if slow in conn.execute_wrappers:
+                    conn.execute_wrappers.remove(slow)
+            concurrency.shutdown()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        imports = OrderedDict()
+        for module in self.startup_settings(options):
+            boot, first_response, imports[module] = \
+                benchmark.measure_startup(module, options['startup'])
+            results[f'startup:boot[{module}]'] = boot
+            results[f'startup:first-response[{module}]'] = first_response
+
+        self.report(results)
+        for module, summary in imports.items():
+            self.stdout.write(f'import ms [{module}]: ' + ', '.join(
+                f'{package}={ms}' for package, ms in summary.items()
+            ))
+        if options['names']:
+            self.stdout.write('name dictionary: ' + ', '.join(
+                f'{key}={value}' for key, value in name_stats.items()
+            ))
+        if options['recommend']:
+            self.stdout.write('recommendation index: ' + ', '.join(
+                f'{key}={value}' for key, value in recommend_stats.items()
+            ))
+        if options['snapshot']:
+            self.stdout.write('recipe list snapshot: ' + ', '.join(
+                f'{key}={value}' for key, value in snapshot_stats.items()
+            ))
+        if options['output']:
+            self.write_json(options['output'], results)
+        if options['save_baseline']:
+            self.write_json(options['baseline'], results)
+            self.stdout.write(f'Baseline written to {options["baseline"]}')
+        if options['compare']:
+            self.check_regressions(results, options)
+
+    def run_benchmarks(self, options, seed=True, label=None):
+        sizes = benchmark.PROFILES[options['profile']]
+        if seed:
+            self.users = [
+                benchmark.seed_user(size, seed=size) for size in sizes
+            ]
+        users = self.users
+        drivers = ('client', 'live') if options['driver'] == 'both' \
+            else (options['driver'],)
+
+        results = OrderedDict()
+        for driver_name in drivers:
+            server = self.start_server() if driver_name == 'live' else None
+            try:
+                for size, user in zip(sizes, users):
+                    driver = self.make_driver(driver_name, user, server)
+                    scenarios = benchmark.recipe_scenarios(user)
+                    if user is users[0]:
+                        scenarios = benchmark.user_scenarios(user) + scenarios
+                    for scenario in scenarios:
+                        concurrency = options['concurrency'] \
+                            if scenario.method == 'get' else 1
+                        key = f'{driver_name}:{scenario.name}[{size}]'
+                        if concurrency > 1:
+                            key += f'x{concurrency}'
+                        if label:
+                            key += f'@{label}'
+                        results[key] = benchmark.run_scenario(
+                            driver, scenario, options['iterations'],
+                            concurrency=concurrency,
+                        )
+            finally:
+                if server is not None:
+                    server.terminate()
+        return results
+
+    def startup_settings(self, options):
+        if not options['startup']:
+            return []
+        if options['startup_settings']:
+            return options['startup_settings'].split(',')
+        return [settings.SETTINGS_MODULE, 'app.settings_api']
+
+    def make_driver(self, name, user, server):
+        if name == 'live':
+            return benchmark.LiveServerDriver(
+                user, f'http://{server.host}:{server.port}',
+            )
+        return benchmark.ClientDriver(user)
+
+    def start_server(self):
+        overrides = {}
+        if connection.vendor == 'sqlite' \
+                and connection.is_in_memory_db():
+            conn = connections[connection.alias]
+            conn.allow_thread_sharing = True
+            overrides[conn.alias] = conn
+        server = LiveServerThread(
+            'localhost', lambda handler: handler,
+            connections_override=overrides,
+        )
+        server.daemon = True
+        server.start()
+        server.is_ready.wait()
+        if server.error:
+            raise server.error
+        return server
+
+    def report(self, results):
+        header = f'{"scenario":<48}{"req/s":>10}{"p50 ms":>10}' \
+                 f'{"p99 ms":>10}{"queries":>9}'
+        self.stdout.write(header)
+        for key, row in results.items():
+            queries = '-' if row['queries'] is None else row['queries']
+            throughput = '-' if row['throughput'] is None \
+                else row['throughput']
+            self.stdout.write(
+                f'{key:<48}{throughput:>10}{row["p50_ms"]:>10}'
+                f'{row["p99_ms"]:>10}{queries:>9}'
+            )
+
+    def write_json(self, path, results):
+        with open(path, 'w') as fh:
+            json.dump(results, fh, indent=2, sort_keys=True)
+            fh.write('\n')
+
+    def check_regressions(self, results, options):
+        try:
+            with open(options['baseline']) as fh:
+                baseline = json.load(fh)
+        except FileNotFoundError:
+            raise CommandError(f'No baseline at {options["baseline"]}')
+
+        regressions = benchmark.compare(
+            results, baseline,
+            tolerance=options['tolerance'],
+            check_timings=not options['queries_only'],
+        )
+        if regressions:
+            raise CommandError(
+                'Performance regressions:\n' + '\n'.join(regressions)
+            )
+        self.stdout.write(self.style.SUCCESS('No regressions'))
@@ -0,0 +1,52 @@
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+
+from core import webhooks
+
+# Seconds between sweeps of delivered events
+PRUNE_INTERVAL = 60
+
+
+class Command(BaseCommand):
+    help = 'Deliver recipe changes to webhooks (see core.webhooks)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--poll', type=float, default=1.0,
+            help='Seconds to wait when no webhook had anything to deliver',
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Deliver one round of batches and exit',
+        )
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        # Finish the deliveries in flight on SIGINT/SIGTERM, then exit
+        previous = {
+            signum: signal.signal(signum, lambda *_: stop.set())
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+        totals, pruned_at = [0, 0], None
+        try:
+            while not stop.is_set():
+                delivered, failed = webhooks.dispatch()
+                totals[0] += delivered
+                totals[1] += failed
+                if pruned_at is None or \
+                        time.monotonic() - pruned_at >= PRUNE_INTERVAL:
+                    webhooks.prune()
+                    pruned_at = time.monotonic()
+                if options['once']:
+                    break
+                if not delivered:
+                    stop.wait(options['poll'])
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+        self.stdout.write(self.style.SUCCESS(
+            f'Delivered {totals[0]} batches, {totals[1]} failed'
+        ))
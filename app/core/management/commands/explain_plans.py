@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings, \
+    setup_test_environment, teardown_test_environment
+
+from core import benchmark, concurrency, plans
+
+DEFAULT_PLANS = os.path.join(settings.BASE_DIR, 'query_plans.json')
+
+
+class Command(BaseCommand):
+    help = 'Seed a throwaway database and check the query plans of the ' \
+           'recipe endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recipes', type=int, default=1000,
+            help='Recipes of the seeded user',
+        )
+        parser.add_argument('--plans', default=DEFAULT_PLANS)
+        parser.add_argument(
+            '--update', action='store_true',
+            help='Store these plans as the expected ones',
+        )
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='Print the scans of every statement',
+        )
+
+    def handle(self, *args, **options):
+        stored = self.read_plans(options['plans'])
+        if connection.vendor not in stored and not options['update']:
+            # Without them only the full-scan check would run, and a CI
+            # job on this database would pass without checking plans
+            raise CommandError(
+                f'No expected {connection.vendor} plans in '
+                f'{options["plans"]}. Run explain_plans --update against '
+                f'{connection.vendor} and commit the result.'
+            )
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(
+            verbosity=0, autoclobber=True, serialize=False,
+        )
+        media_root = tempfile.mkdtemp(prefix='plans-media-')
+        try:
+            # Statements are captured on this thread's connection only
+            with override_settings(DEBUG=False, ALLOWED_HOSTS=['*'],
+                                   MEDIA_ROOT=media_root,
+                                   ORM_EXECUTOR_WORKERS=0):
+                user = benchmark.seed_user(options['recipes'])
+                if connection.vendor == 'postgresql':
+                    # Row estimates need statistics. SQLite has no way to
+                    # rule out scans and would plan one user's table as a
+                    # scan once it knows that, so it plans by heuristics.
+                    with connection.cursor() as cursor:
+                        cursor.execute('ANALYZE')
+                captured = plans.capture_plans(
+                    benchmark.ClientDriver(user),
+                    benchmark.recipe_scenarios(user),
+                )
+        finally:
+            concurrency.shutdown()
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+
+        if options['verbose_plans']:
+            for name, statements in captured.items():
+                self.stdout.write(name)
+                for entry in statements:
+                    self.stdout.write('  ' + '; '.join(
+                        plans.label(scan) for scan in entry['scans']
+                    ))
+
+        if options['update']:
+            stored[connection.vendor] = plans.expectations(captured)
+            with open(options['plans'], 'w') as fh:
+                json.dump(stored, fh, indent=2, sort_keys=True)
+                fh.write('\n')
+            self.stdout.write(f'Plans written to {options["plans"]}')
+        problems = plans.violations(captured, stored[connection.vendor])
+        if problems:
+            raise CommandError(
+                'Query plan regressions:\n' + '\n'.join(problems)
+            )
+        self.stdout.write(f'{len(captured)} scenarios, plans OK')
+
+    def read_plans(self, path):
+        try:
+            with open(path) as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return {}
@@ -0,0 +1,32 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from core import storage
+
+
+class Command(BaseCommand):
+    help = 'Delete stored recipe images no recipe references any more'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-minutes', type=int, default=60,
+            help='Keep unreferenced files touched more recently than this',
+        )
+        parser.add_argument(
+            '--recount', action='store_true',
+            help='Rebuild reference counts from the recipes table first',
+        )
+        parser.add_argument('--dry-run', action='store_true')
+
+    def handle(self, *args, **options):
+        if options['recount']:
+            storage.recount()
+        removed = storage.collect_garbage(
+            timedelta(minutes=options['grace_minutes']),
+            dry_run=options['dry_run'],
+        )
+        for name in removed:
+            self.stdout.write(name)
+        verb = 'Would remove' if options['dry_run'] else 'Removed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(removed)} files'))
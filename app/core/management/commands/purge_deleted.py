@@ -0,0 +1,38 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from core import deletion
+
+
+class Command(BaseCommand):
+    help = 'Remove soft-deleted recipes, tags, ingredients and users'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace-minutes', type=int, default=60,
+            help='Keep rows deleted more recently than this',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Rows removed per transaction',
+        )
+        parser.add_argument(
+            '--pause', type=float, default=0,
+            help='Seconds to sleep between batches',
+        )
+
+    def handle(self, *args, **options):
+        totals = {}
+        for name, count in deletion.purge(
+            timedelta(minutes=options['grace_minutes']),
+            batch_size=options['batch_size'],
+        ):
+            totals[name] = totals.get(name, 0) + count
+            if options['pause']:
+                time.sleep(options['pause'])
+        summary = ', '.join(
+            f'{count} {name}s' for name, count in totals.items()
+        ) or 'nothing'
+        self.stdout.write(self.style.SUCCESS(f'Purged {summary}'))
@@ -0,0 +1,23 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from core import stats
+
+
+class Command(BaseCommand):
+    help = 'Rebuild recipe stats and tag/ingredient usage counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user', help='Only recompute counters for this email',
+        )
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = get_user_model().objects.get(email=options['user'])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f'No user {options["user"]}')
+        stats.recompute(user=user)
+        self.stdout.write(self.style.SUCCESS('Recipe stats recomputed'))
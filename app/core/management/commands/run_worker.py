@@ -0,0 +1,84 @@
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from core import jobs
+
+COLUMNS = ('queued', 'running', 'done', 'failed', 'retries', 'runtime', 'lag')
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs (see core.jobs)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--threads', type=int, default=settings.JOB_THREADS,
+            help='Jobs run at the same time by each process',
+        )
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help='Worker processes to fork, each with --threads threads',
+        )
+        parser.add_argument(
+            '--poll', type=float, default=1.0,
+            help='Seconds to wait before looking for due jobs again',
+        )
+        parser.add_argument(
+            '--drain', action='store_true',
+            help='Exit once no job is due instead of waiting for more',
+        )
+        parser.add_argument(
+            '--metrics', action='store_true',
+            help='Print queue statistics per task and exit',
+        )
+
+    def handle(self, *args, **options):
+        if options['metrics']:
+            return self.print_metrics()
+
+        worker = f'{socket.gethostname()}:{os.getpid()}'
+        processes = max(options['processes'], 1)
+        context = multiprocessing.get_context('fork')
+        stop = context.Event() if processes > 1 else threading.Event()
+        # Finish the jobs in hand on SIGINT/SIGTERM, then exit
+        previous = {
+            signum: signal.signal(signum, lambda *_: stop.set())
+            for signum in (signal.SIGINT, signal.SIGTERM)
+        }
+        serve_args = (options['threads'], stop, options['poll'],
+                      options['drain'])
+        try:
+            if processes == 1:
+                ran = jobs.serve(worker, *serve_args)
+                self.stdout.write(self.style.SUCCESS(f'Ran {ran} jobs'))
+                return
+            # Forked children must not share the parent's connections
+            connections.close_all()
+            children = [
+                context.Process(target=jobs.serve,
+                                args=(f'{worker}-{n}',) + serve_args)
+                for n in range(processes)
+            ]
+            for child in children:
+                child.start()
+            for child in children:
+                child.join()
+            self.stdout.write(self.style.SUCCESS('Workers stopped'))
+        finally:
+            for signum, handler in previous.items():
+                signal.signal(signum, handler)
+
+    def print_metrics(self):
+        stats = jobs.metrics()
+        self.stdout.write('\t'.join(('task',) + COLUMNS))
+        for name, row in sorted(stats.items()):
+            self.stdout.write('\t'.join(
+                [name] + ['-' if row[key] is None else str(row[key])
+                          for key in COLUMNS]
+            ))
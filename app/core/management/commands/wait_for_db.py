@@ -6,6 +6,9 @@ from django.core.management.base import BaseCommand
 
 
 class Command(BaseCommand):
+    # The checks import every app's admin and model dependencies (Pillow
+    # for ImageField) while the database is not even up yet
+    requires_system_checks = False
 
     def handle(self, *args, **kwargs):
         db_con = None
@@ -0,0 +1,86 @@
+"""Project middleware.
+
+``CompressionMiddleware`` encodes JSON responses as core.compression
+negotiates.
+
+The token authenticated API has no use for sessions, CSRF checks,
+``request.user`` or messages, but the admin does. ``PathScopedMiddleware``
+stands in for ``SCOPED_MIDDLEWARE`` in ``MIDDLEWARE`` and runs that chain
+only for requests outside ``LEAN_MIDDLEWARE_PATHS``; other requests go
+straight on to the next middleware.
+"""
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.handlers.exception import convert_exception_to_response
+from django.utils.module_loading import import_string
+
+from core import compression
+
+
+class CompressionMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        return compression.compress_response(
+            request, self.get_response(request)
+        )
+
+
+class PathScopedMiddleware:
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.view_hooks = []
+        self.exception_hooks = []
+        handler = get_response
+        # Built like BaseHandler.load_middleware builds the outer chain
+        for path in reversed(settings.SCOPED_MIDDLEWARE):
+            try:
+                middleware = import_string(path)(handler)
+            except MiddlewareNotUsed:
+                continue
+            if hasattr(middleware, 'process_view'):
+                self.view_hooks.insert(0, middleware.process_view)
+            if hasattr(middleware, 'process_exception'):
+                self.exception_hooks.append(middleware.process_exception)
+            handler = convert_exception_to_response(middleware)
+        self.full = handler
+
+    def is_lean(self, request):
+        return request.path_info.startswith(settings.LEAN_MIDDLEWARE_PATHS)
+
+    def __call__(self, request):
+        if self.is_lean(request):
+            return self.get_response(request)
+        return self.full(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if self.is_lean(request):
+            return None
+        for hook in self.view_hooks:
+            response = hook(request, view_func, view_args, view_kwargs)
+            if response is not None:
+                return response
+        return None
+
+    def process_exception(self, request, exception):
+        if self.is_lean(request):
+            return None
+        for hook in self.exception_hooks:
+            response = hook(request, exception)
+            if response is not None:
+                return response
+        return None
+
+
+def unscoped(middleware):
+    """``middleware`` with the scoped chain inlined, as if for every path"""
+    inlined = []
+    for path in middleware:
+        if path == 'core.middleware.PathScopedMiddleware':
+            inlined.extend(settings.SCOPED_MIDDLEWARE)
+        else:
+            inlined.append(path)
+    return inlined
@@ -0,0 +1,67 @@
+# Generated by Django 2.1.15 on 2026-10-19 09:28
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def populate_counters(apps, schema_editor):
+    Recipe = apps.get_model('core', 'Recipe')
+    RecipeStats = apps.get_model('core', 'RecipeStats')
+    for field in ('tags', 'ingredients'):
+        through = Recipe._meta.get_field(field).remote_field.through
+        column = Recipe._meta.get_field(field).m2m_reverse_field_name()
+        target = Recipe._meta.get_field(field).related_model
+        counts = through.objects.filter(**{column: models.OuterRef('pk')})\
+            .order_by().values(column)\
+            .annotate(n=models.Count('*')).values('n')
+        target.objects.update(recipe_count=Coalesce(
+            models.Subquery(counts, output_field=models.IntegerField()), 0
+        ))
+    rows = Recipe.objects.order_by().values('user').annotate(
+        recipe_count=models.Count('id'),
+        time_minutes_total=models.Sum('time_minutes'),
+        time_minutes_min=models.Min('time_minutes'),
+        time_minutes_max=models.Max('time_minutes'),
+        price_total=models.Sum('price'),
+        price_min=models.Min('price'),
+        price_max=models.Max('price'),
+    )
+    RecipeStats.objects.bulk_create(
+        [RecipeStats(user_id=row.pop('user'), **row) for row in rows]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_recipe_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RecipeStats',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='recipe_stats', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('recipe_count', models.PositiveIntegerField(default=0)),
+                ('time_minutes_total', models.BigIntegerField(default=0)),
+                ('time_minutes_min', models.IntegerField(null=True)),
+                ('time_minutes_max', models.IntegerField(null=True)),
+                ('price_total', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('price_min', models.DecimalField(decimal_places=2, max_digits=5, null=True)),
+                ('price_max', models.DecimalField(decimal_places=2, max_digits=5, null=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='ingredient',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='tag',
+            name='recipe_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
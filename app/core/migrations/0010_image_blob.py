@@ -0,0 +1,32 @@
+# Generated by Django 2.1.15 on 2026-10-19 09:32
+
+from django.db import migrations, models
+
+
+def populate_blobs(apps, schema_editor):
+    Recipe = apps.get_model('core', 'Recipe')
+    ImageBlob = apps.get_model('core', 'ImageBlob')
+    rows = Recipe.objects.exclude(image='').exclude(image__isnull=True)\
+        .order_by().values('image').annotate(n=models.Count('id'))
+    ImageBlob.objects.bulk_create(
+        [ImageBlob(name=row['image'], ref_count=row['n']) for row in rows]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_recipe_count_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImageBlob',
+            fields=[
+                ('name', models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ('ref_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(populate_blobs, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-19 09:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_soft_delete'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='names_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
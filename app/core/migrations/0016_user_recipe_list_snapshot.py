@@ -0,0 +1,18 @@
+# Generated by Django 2.1.15 on 2026-10-19 14:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_user_names_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='recipe_list_snapshot',
+            field=models.BooleanField(default=False),
+        ),
+    ]
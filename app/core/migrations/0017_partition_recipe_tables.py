@@ -0,0 +1,16 @@
+from django.db import migrations
+
+from core import partitioning
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_user_recipe_list_snapshot'),
+    ]
+
+    operations = [
+        # Reversing keeps the partitions, whose schema is the same to Django
+        migrations.RunPython(partitioning.partition_tables,
+                             migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+    """Explicit through models for Recipe.tags and Recipe.ingredients
+
+    The models take over the tables of the implicit ones, so only the
+    state changes; the link tables are not rebuilt, they gain two columns
+    with constant defaults (no rewrite on PostgreSQL 11+) and an index
+    each.
+    """
+
+    dependencies = [
+        ('core', '0017_partition_recipe_tables'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.CreateModel(
+                name='RecipeTag',
+                fields=[
+                    ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                    ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Recipe')),
+                    ('tag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Tag')),
+                ],
+                options={
+                    'db_table': 'core_recipe_tags',
+                    'unique_together': {('recipe', 'tag')},
+                },
+            ),
+            migrations.CreateModel(
+                name='RecipeIngredient',
+                fields=[
+                    ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                    ('recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Recipe')),
+                    ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='core.Ingredient')),
+                ],
+                options={
+                    'db_table': 'core_recipe_ingredients',
+                    'unique_together': {('recipe', 'ingredient')},
+                },
+            ),
+            migrations.AlterField(
+                model_name='recipe',
+                name='tags',
+                field=models.ManyToManyField(through='core.RecipeTag', to='core.Tag'),
+            ),
+            migrations.AlterField(
+                model_name='recipe',
+                name='ingredients',
+                field=models.ManyToManyField(through='core.RecipeIngredient', to='core.Ingredient'),
+            ),
+        ]),
+        migrations.AddField(
+            model_name='recipetag',
+            name='position',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recipeingredient',
+            name='position',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='recipeingredient',
+            name='quantity',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+        migrations.AddIndex(
+            model_name='recipetag',
+            index=models.Index(fields=['tag', 'recipe'], name='core_recipetag_tag_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipeingredient',
+            index=models.Index(fields=['ingredient', 'recipe'], name='core_recipeingr_ingr_idx'),
+        ),
+    ]
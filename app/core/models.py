@@ -5,13 +5,24 @@ from django.conf import settings
 from django.contrib.auth.models import AbstractBaseUser, \
     BaseUserManager, PermissionsMixin
 from django.db import models
+from django.db.models.fields.related_descriptors import \
+    ManyToManyDescriptor
+from django.utils.functional import cached_property
+
+
+RECIPE_IMAGE_DIR = 'uploads/recipe/'
+
+
+def recipe_image_name(filename):
+    """Storage name of the recipe image called ``filename``"""
+    return os.path.join(RECIPE_IMAGE_DIR, filename)
 
 
 def recipe_image_file_path(instance, filename):
     ext = filename.split('.')[-1]
     filename = f'{uuid.uuid4()}.{ext}'
 
-    return os.path.join('uploads/recipe/', filename)
+    return recipe_image_name(filename)
 
 
 class UserManager(BaseUserManager):
@@ -41,46 +52,390 @@ class User(AbstractBaseUser, PermissionsMixin):
     name = models.CharField(max_length=255)
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
+    deleted_at = models.DateTimeField(null=True, blank=True, editable=False)
+    names_version = models.PositiveIntegerField(default=0, editable=False)
+    # Serve the recipe list from a precomputed snapshot, see core.snapshots
+    recipe_list_snapshot = models.BooleanField(default=False)
 
     objects = UserManager()
 
     USERNAME_FIELD = 'email'
 
 
-class Tag(models.Model):
+class LiveManager(models.Manager):
+    """Hides soft-deleted rows"""
+
+    def get_queryset(self):
+        return super().get_queryset().filter(deleted_at__isnull=True)
+
+
+class SoftDeleteModel(models.Model):
+    """Base for models soft deleted first and purged later, see core.deletion
+
+    ``objects`` only sees live rows, ``all_objects`` sees every row.
+    """
+    deleted_at = models.DateTimeField(
+        null=True, blank=True, editable=False, db_index=True,
+    )
+
+    objects = LiveManager()
+    all_objects = models.Manager()
+
+    class Meta:
+        abstract = True
+
+
+class RecipeCountedModel(models.Model):
+    """Base for models whose recipe_count is maintained by core.stats"""
+    recipe_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        """Never write back a possibly stale recipe_count on update"""
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'recipe_count'
+            ]
+        super().save(*args, **kwargs)
+
+
+class Tag(SoftDeleteModel, RecipeCountedModel):
     name = models.CharField(max_length=255)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-recipe_count'],
+                         name='core_tag_user_count_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'],
+                         name='core_tag_user_sync_idx'),
+        ]
 
     def __str__(self):
         return str(self.name)
 
 
-class Ingredient(models.Model):
+class Ingredient(SoftDeleteModel, RecipeCountedModel):
     name = models.CharField(max_length=255)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-recipe_count'],
+                         name='core_ingr_user_count_idx'),
+            models.Index(fields=['user', 'updated_at', 'id'],
+                         name='core_ingr_user_sync_idx'),
+        ]
 
     def __str__(self):
         return str(self.name)
 
 
-class Recipe(models.Model):
+class VersionConflict(Exception):
+    """A save lost the race against a concurrent save of the same row"""
+
+
+class LinkDescriptor(ManyToManyDescriptor):
+    """``recipe.tags``/``recipe.ingredients`` with add, remove and set
+
+    Django 2.1 refuses these for fields with a through model. Here they go
+    through core.bulk, which fills in the link's position (after the
+    current links) and sends ``m2m_changed`` like the stock manager.
+    """
+
+    @cached_property
+    def related_manager_cls(self):
+        manager_cls = super().related_manager_cls
+        field = self.field.name
+
+        class LinkManager(manager_cls):
+
+            def _targets(self, objs):
+                return [obj if isinstance(obj, models.Model)
+                        else self.model(pk=obj) for obj in objs]
+
+            def add(self, *objs):
+                from core import bulk
+                bulk.add_links(self.instance, field, self._targets(objs))
+
+            def remove(self, *objs):
+                from core import bulk
+                if objs:
+                    bulk.remove_links(self.instance, field,
+                                      self._targets(objs))
+
+            def set(self, objs, *, clear=False):
+                objs = self._targets(objs)
+                if clear:
+                    self.clear()
+                    self.add(*objs)
+                    return
+                wanted = {obj.pk for obj in objs}
+                current = set(self.values_list('pk', flat=True))
+                self.remove(*(current - wanted))
+                self.add(*(obj for obj in objs if obj.pk not in current))
+
+        return LinkManager
+
+
+class LinkField(models.ManyToManyField):
+    """A ManyToManyField whose through model still supports ``add()``"""
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super().contribute_to_class(cls, name, **kwargs)
+        setattr(cls, self.name, LinkDescriptor(self.remote_field,
+                                               reverse=False))
+
+    def deconstruct(self):
+        # Migrations see a plain ManyToManyField
+        name, path, args, kwargs = super().deconstruct()
+        return name, 'django.db.models.ManyToManyField', args, kwargs
+
+
+class Recipe(SoftDeleteModel):
     title = models.CharField(max_length=255)
     time_minutes = models.IntegerField()
     price = models.DecimalField(max_digits=5, decimal_places=2)
     link = models.CharField(max_length=255, blank=True)
-    ingredients = models.ManyToManyField('Ingredient')
-    tags = models.ManyToManyField('Tag')
+    ingredients = LinkField('Ingredient', through='RecipeIngredient')
+    tags = LinkField('Tag', through='RecipeTag')
     image = models.ImageField(null=True, upload_to=recipe_image_file_path)
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL,
         on_delete=models.CASCADE,
     )
+    copied_from = models.ForeignKey(
+        'self',
+        null=True,
+        blank=True,
+        on_delete=models.SET_NULL,
+        related_name='copies',
+    )
+    version = models.PositiveIntegerField(default=1, editable=False)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'updated_at', 'id'],
+                         name='core_recipe_user_sync_idx'),
+        ]
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        """Remember the loaded values so signals can diff on save"""
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def _do_update(self, base_qs, using, pk_val, values, update_fields,
+                   forced_update):
+        """Update only if the row is still at ``version``, bumping it
+
+        The check and the increment happen in the same UPDATE, so no row
+        lock is taken. Raises VersionConflict when another save got in
+        first.
+        """
+        field = self._meta.get_field('version')
+        values = [value for value in values if value[0] is not field]
+        values.append((field, None, self.version + 1))
+        if super()._do_update(base_qs.filter(version=self.version), using,
+                              pk_val, values, update_fields, forced_update):
+            self.version += 1
+            return True
+        if base_qs.filter(pk=pk_val).exists():
+            raise VersionConflict(
+                f'Recipe {pk_val} is no longer at version {self.version}'
+            )
+        return False
 
     def __str__(self):
         return str(self.title)
+
+
+class RecipeTag(models.Model):
+    """A tag of a recipe, ``position`` ordering the recipe's tags"""
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    tag = models.ForeignKey(Tag, on_delete=models.CASCADE)
+    position = models.PositiveSmallIntegerField(default=0)
+
+    class Meta:
+        # The table of the implicit through model this replaced
+        db_table = 'core_recipe_tags'
+        unique_together = ('recipe', 'tag')
+        indexes = [
+            models.Index(fields=['tag', 'recipe'],
+                         name='core_recipetag_tag_idx'),
+        ]
+
+
+class RecipeIngredient(models.Model):
+    """An ingredient of a recipe, with its position and quantity"""
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE)
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
+    position = models.PositiveSmallIntegerField(default=0)
+    quantity = models.CharField(max_length=64, blank=True, default='')
+
+    class Meta:
+        db_table = 'core_recipe_ingredients'
+        unique_together = ('recipe', 'ingredient')
+        indexes = [
+            models.Index(fields=['ingredient', 'recipe'],
+                         name='core_recipeingr_ingr_idx'),
+        ]
+
+
+class Tombstone(models.Model):
+    """Records a deleted recipe, tag or ingredient for the sync feed"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    model = models.CharField(max_length=32)
+    object_id = models.PositiveIntegerField()
+    deleted_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'deleted_at', 'id'],
+                         name='core_tomb_user_sync_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.model} {self.object_id}'
+
+
+class ImageBlob(models.Model):
+    """A stored upload, shared by every recipe whose image has its content"""
+    name = models.CharField(max_length=255, primary_key=True)
+    ref_count = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.name} ({self.ref_count} refs)'
+
+
+class RecipeStats(models.Model):
+    """Running totals over a user's recipes, maintained by core.signals"""
+    user = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='recipe_stats',
+    )
+    recipe_count = models.PositiveIntegerField(default=0)
+    time_minutes_total = models.BigIntegerField(default=0)
+    time_minutes_min = models.IntegerField(null=True)
+    time_minutes_max = models.IntegerField(null=True)
+    price_total = models.DecimalField(
+        max_digits=15, decimal_places=2, default=0
+    )
+    price_min = models.DecimalField(
+        max_digits=5, decimal_places=2, null=True
+    )
+    price_max = models.DecimalField(
+        max_digits=5, decimal_places=2, null=True
+    )
+
+    @property
+    def time_minutes_avg(self):
+        if not self.recipe_count:
+            return None
+        return self.time_minutes_total / self.recipe_count
+
+    @property
+    def price_avg(self):
+        if not self.recipe_count:
+            return None
+        return round(self.price_total / self.recipe_count, 2)
+
+    def __str__(self):
+        return f'{self.user} ({self.recipe_count} recipes)'
+
+
+class Job(models.Model):
+    """Deferred work for ``manage.py run_worker``, see core.jobs"""
+    QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+    STATUSES = [(status, status) for status in (QUEUED, RUNNING, DONE, FAILED)]
+
+    name = models.CharField(max_length=100)
+    # JSON {"args": [...], "kwargs": {...}}
+    payload = models.TextField(default='{}')
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=1)
+    run_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    # Renewed by the worker's process while the job runs
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    last_error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'],
+                         name='core_job_status_run_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk} ({self.status})'
+
+
+class OutboxEvent(models.Model):
+    """A change to a recipe, tag or ingredient awaiting webhook delivery
+
+    Written in the transaction of the change itself, see core.webhooks.
+    """
+    CREATED, UPDATED, DELETED = 'created', 'updated', 'deleted'
+    ACTIONS = [(action, action) for action in (CREATED, UPDATED, DELETED)]
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+    )
+    model = models.CharField(max_length=16)
+    object_id = models.PositiveIntegerField()
+    action = models.CharField(max_length=8, choices=ACTIONS)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'id'], name='core_outbox_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.model} {self.object_id} {self.action}'
+
+
+class Webhook(models.Model):
+    """A partner URL receiving batches of a user's OutboxEvents"""
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='webhooks',
+    )
+    url = models.URLField(max_length=500)
+    secret = models.CharField(max_length=64)
+    is_active = models.BooleanField(default=True)
+    # Events up to this id have been delivered
+    last_event_id = models.PositiveIntegerField(default=0)
+    # Backoff after failures, and the lease of a delivery in progress
+    next_delivery_at = models.DateTimeField(null=True, blank=True)
+    failures = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.url
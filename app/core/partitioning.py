@@ -0,0 +1,143 @@
+"""Hash partitioning of the recipe tables on PostgreSQL.
+
+With ``RECIPE_PARTITIONS`` set, migration 0017 turns the Recipe, Tag and
+Ingredient tables into that many hash partitions on ``user_id``, and the
+recipe link tables into partitions on ``recipe_id``: they carry no user
+id, but all links of a recipe still land in one partition. Hash
+partitioning needs PostgreSQL 11.
+
+Each table is rebuilt once: renamed aside, recreated as a partitioned
+table ``LIKE`` it, its rows copied over and its indexes and constraints
+recreated. Unique constraints of a partitioned table have to contain the
+partition key, so primary keys become ``(id, <key>)``; ids stay unique
+through their sequence. Foreign keys cannot point at a partitioned table
+before PostgreSQL 12, so those referencing the partitioned tables are
+dropped; Django cascades deletes itself and ``core.deletion.purge`` clears
+links and ``copied_from`` explicitly.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+MIN_SERVER_VERSION = 110000
+
+
+def partitioned_tables(apps):
+    """``(table, partition key column)`` of each table to partition"""
+    tables = []
+    for name in ('Recipe', 'Tag', 'Ingredient'):
+        model = apps.get_model('core', name)
+        tables.append((model._meta.db_table,
+                       model._meta.get_field('user').column))
+    recipe = apps.get_model('core', 'Recipe')
+    for field in ('tags', 'ingredients'):
+        through = recipe._meta.get_field(field).remote_field.through
+        tables.append((through._meta.db_table,
+                       through._meta.get_field('recipe').column))
+    return tables
+
+
+def drop_references_sql(references, qn):
+    """Statements dropping the ``(table, constraint)`` foreign keys"""
+    return [
+        f'ALTER TABLE {qn(table)} DROP CONSTRAINT {qn(name)}'
+        for table, name in references
+    ]
+
+
+def partition_sql(table, key, partitions, sequence, constraints, indexes,
+                  qn):
+    """Statements turning ``table`` into ``partitions`` partitions on ``key``
+
+    ``sequence`` is the sequence behind its ids, ``constraints`` are the
+    ``(name, definition)`` of its unique and foreign key constraints and
+    ``indexes`` the definitions of its other indexes, all recreated on the
+    partitioned table once the rows are in.
+    """
+    old, new = qn(f'{table}_unpartitioned'), qn(table)
+    statements = [
+        f'ALTER TABLE {new} RENAME TO {old}',
+        f'CREATE TABLE {new} (LIKE {old} INCLUDING DEFAULTS '
+        f'INCLUDING CONSTRAINTS) PARTITION BY HASH ({qn(key)})',
+    ]
+    statements += [
+        f'CREATE TABLE {qn(f"{table}_p{n}")} PARTITION OF {new} '
+        f'FOR VALUES WITH (MODULUS {partitions}, REMAINDER {n})'
+        for n in range(partitions)
+    ]
+    statements += [
+        f'INSERT INTO {new} SELECT * FROM {old}',
+        f'ALTER SEQUENCE {sequence} OWNED BY {new}.{qn("id")}',
+        f'DROP TABLE {old}',
+        f'ALTER TABLE {new} ADD PRIMARY KEY ({qn("id")}, {qn(key)})',
+    ]
+    statements += [
+        f'ALTER TABLE {new} ADD CONSTRAINT {qn(name)} {definition}'
+        for name, definition in constraints
+    ]
+    return statements + list(indexes)
+
+
+def _is_partitioned(cursor, table):
+    cursor.execute('SELECT relkind FROM pg_class WHERE oid = %s::regclass',
+                   [table])
+    return cursor.fetchone()[0] == 'p'
+
+
+def _references(cursor, table):
+    cursor.execute(
+        "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+        "WHERE contype = 'f' AND confrelid = %s::regclass", [table],
+    )
+    return cursor.fetchall()
+
+
+def _describe(cursor, table):
+    """``sequence, constraints, indexes`` for ``partition_sql``"""
+    cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [table])
+    sequence = cursor.fetchone()[0]
+    cursor.execute(
+        "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE contype IN ('u', 'f') AND conrelid = %s::regclass", [table],
+    )
+    constraints = cursor.fetchall()
+    cursor.execute(
+        'SELECT indexdef FROM pg_indexes WHERE schemaname = current_schema()'
+        ' AND tablename = %s AND indexname NOT IN (SELECT conname FROM '
+        'pg_constraint WHERE conrelid = %s::regclass)', [table, table],
+    )
+    indexes = [row[0] for row in cursor.fetchall()]
+    return sequence, constraints, indexes
+
+
+def partition_tables(apps, schema_editor):
+    """Partition the recipe tables as ``RECIPE_PARTITIONS`` asks
+
+    A no-op without the setting and on other databases than PostgreSQL;
+    tables partitioned already are left alone.
+    """
+    connection = schema_editor.connection
+    partitions = settings.RECIPE_PARTITIONS
+    if not partitions or connection.vendor != 'postgresql':
+        return
+    if connection.pg_version < MIN_SERVER_VERSION:
+        raise ImproperlyConfigured(
+            'RECIPE_PARTITIONS needs PostgreSQL 11 or later'
+        )
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        tables = [
+            (table, key) for table, key in partitioned_tables(apps)
+            if not _is_partitioned(cursor, table)
+        ]
+        # Includes the keys between the tables, so none is left pointing
+        # at a partitioned one
+        for table, _ in tables:
+            for statement in drop_references_sql(
+                _references(cursor, table), qn
+            ):
+                cursor.execute(statement)
+        for table, key in tables:
+            for statement in partition_sql(
+                table, key, partitions, *_describe(cursor, table), qn=qn
+            ):
+                cursor.execute(statement)
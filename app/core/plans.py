@@ -0,0 +1,201 @@
+"""Query plan checks for the API endpoints.
+
+``capture_plans`` issues each benchmark scenario once, records the SQL it
+runs and asks the database how it would execute each statement:
+``EXPLAIN (FORMAT JSON)`` on PostgreSQL, ``EXPLAIN QUERY PLAN`` on SQLite
+for local runs. Every plan is reduced to its scans, which ``violations``
+checks: recipes, tags, ingredients and their link tables must never be
+read in full, and against stored expectations the scans (and index names)
+must not change and PostgreSQL's row estimates must not grow much.
+
+Sequential scans are disabled while explaining, so a seeded database
+small enough to scan is still planned the way a large one would be; a
+sequential scan only remains where no index can serve the query.
+"""
+import json
+import re
+from collections import OrderedDict
+
+from django.db import connection
+
+from core.models import Ingredient, Recipe, Tag
+
+# Leading keywords of the statements worth explaining
+EXPLAINED = ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+# Scans that read a whole table or index
+FULL_SCANS = ('Seq Scan', 'Full Index Scan')
+# A row estimate may grow this much over the expected one
+ROW_TOLERANCE = 10
+# ... and by this many rows regardless
+ROW_SLACK = 100
+
+SQLITE_SCAN = re.compile(
+    r'^(SCAN|SEARCH)(?: TABLE)? (\S+)(?: AS (\S+))?'
+    r'(?: USING (?:COVERING |AUTOMATIC (?:COVERING |PARTIAL )*)?INDEX (\S+)'
+    r'| USING (?:INTEGER )?PRIMARY KEY)?'
+)
+# SQLite names aliased tables by their alias only
+SQL_ALIAS = re.compile(r'(?:FROM|JOIN)\s+"?(\w+)"?\s+(?:AS\s+)?"?(\w+)"?',
+                       re.IGNORECASE)
+
+
+def large_tables():
+    """Tables that grow with the number of recipes"""
+    tables = {model._meta.db_table for model in (Recipe, Tag, Ingredient)}
+    for field in ('tags', 'ingredients'):
+        tables.add(Recipe._meta.get_field(field)
+                   .remote_field.through._meta.db_table)
+    return tables
+
+
+class Recorder:
+    """``execute_wrapper`` keeping the statements worth explaining"""
+
+    def __init__(self):
+        self.statements = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.lstrip().upper().startswith(EXPLAINED):
+            self.statements.append((sql, params))
+        return execute(sql, params, many, context)
+
+
+def _node(node, relation, index=None, rows=None):
+    return OrderedDict([
+        ('node', node), ('relation', relation), ('index', index),
+        ('rows', rows),
+    ])
+
+
+def postgres_scans(plan):
+    """The scans in a PostgreSQL JSON plan, depth first"""
+    scans = []
+    node_type = plan['Node Type']
+    if 'Relation Name' in plan or node_type == 'Bitmap Index Scan':
+        if node_type in ('Index Scan', 'Index Only Scan') \
+                and 'Index Cond' not in plan:
+            node_type = 'Full Index Scan'
+        scans.append(_node(
+            node_type, plan.get('Relation Name'), plan.get('Index Name'),
+            plan.get('Plan Rows'),
+        ))
+    for child in plan.get('Plans', ()):
+        scans.extend(postgres_scans(child))
+    return scans
+
+
+def sqlite_scans(details, aliases=None):
+    """The scans in the detail lines of SQLite's ``EXPLAIN QUERY PLAN``"""
+    aliases = aliases or {}
+    scans = []
+    for detail in details:
+        match = SQLITE_SCAN.match(detail)
+        if match is None or detail.startswith('SCAN CONSTANT ROW'):
+            continue
+        kind, table, alias, index = match.groups()
+        table = aliases.get(table, table)
+        if kind == 'SEARCH':
+            node = 'Index Scan'
+        else:
+            node = 'Full Index Scan' if index else 'Seq Scan'
+        if kind == 'SEARCH' and index is None:
+            index = 'PRIMARY KEY'
+        scans.append(_node(node, table, index))
+    return scans
+
+
+def explain(sql, params):
+    """The scans the database plans for ``sql``"""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET enable_seqscan = off')
+            try:
+                cursor.execute('EXPLAIN (FORMAT JSON) ' + sql, params)
+                plan = cursor.fetchone()[0]
+            finally:
+                cursor.execute('RESET enable_seqscan')
+            if isinstance(plan, str):
+                plan = json.loads(plan)
+            return postgres_scans(plan[0]['Plan'])
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            aliases = {
+                alias: table for table, alias in SQL_ALIAS.findall(sql)
+                if alias.upper() not in ('WHERE', 'ON', 'INNER', 'LEFT',
+                                         'ORDER', 'GROUP', 'LIMIT')
+            }
+            return sqlite_scans([row[-1] for row in cursor.fetchall()],
+                                aliases)
+    raise NotImplementedError(f'No plans for {connection.vendor}')
+
+
+def capture_plans(driver, scenarios):
+    """Plans of the statements each scenario runs, by scenario name
+
+    Each scenario is issued once through ``driver`` (see core.benchmark);
+    the value is a list with a ``{'sql', 'scans'}`` entry per statement.
+    """
+    plans = OrderedDict()
+    for scenario in scenarios:
+        recorder = Recorder()
+        with connection.execute_wrapper(recorder):
+            driver.request(scenario, 0)
+        plans[scenario.name] = [
+            {'sql': sql, 'scans': explain(sql, params)}
+            for sql, params in recorder.statements
+        ]
+    return plans
+
+
+def label(scan):
+    text = f'{scan["node"]} on {scan["relation"]}'
+    if scan['index']:
+        text += f' using {scan["index"]}'
+    return text
+
+
+def expectations(plans):
+    """The scans of ``plans`` to store as expected plans"""
+    return OrderedDict(
+        (name, [entry['scans'] for entry in statements])
+        for name, statements in plans.items()
+    )
+
+
+def violations(plans, expected=None):
+    """Human readable problems of ``plans``, optionally against ``expected``
+
+    ``expected`` is what ``expectations`` returned for an earlier run.
+    """
+    large = large_tables()
+    problems = []
+    for name, statements in plans.items():
+        for n, entry in enumerate(statements, 1):
+            for scan in entry['scans']:
+                if scan['node'] in FULL_SCANS and scan['relation'] in large:
+                    problems.append(
+                        f'{name} #{n}: {label(scan)}\n    {entry["sql"]}'
+                    )
+        if expected is None or name not in expected:
+            continue
+        before = [[label(scan) for scan in scans] for scans in expected[name]]
+        after = [[label(scan) for scan in entry['scans']]
+                 for entry in statements]
+        if before != after:
+            problems.append(f'{name}: plan changed\n    was {before}\n'
+                            f'    now {after}')
+            continue
+        for n, (scans, entry) in enumerate(
+            zip(expected[name], statements), 1
+        ):
+            for old, new in zip(scans, entry['scans']):
+                if old['rows'] is None or new['rows'] is None:
+                    continue
+                bound = max(old['rows'] * ROW_TOLERANCE,
+                            old['rows'] + ROW_SLACK)
+                if new['rows'] > bound:
+                    problems.append(
+                        f'{name} #{n}: {label(new)} estimates '
+                        f'{new["rows"]} rows, expected {old["rows"]}'
+                    )
+    return problems
@@ -0,0 +1,268 @@
+"""Vectorized recipe recommendations over ingredient and tag overlap.
+
+Each user's recipes are held as a sparse recipe x feature matrix, stored
+column-wise: for every ingredient (and tag) the sorted rows of the recipes
+using it. Scoring a query only gathers the posting lists of the query's
+features and counts rows with ``numpy.bincount``, so its cost depends on
+how popular those features are rather than on the size of the library.
+
+Indexes are cached per process. ``Recipe.updated_at`` moves whenever a
+recipe or its links change (see core.signals), so an index remembers the
+newest ``updated_at`` it has seen and refreshes itself by reloading only
+the recipes changed since, instead of rebuilding from scratch.
+"""
+import itertools
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from core import sync
+from core.models import Recipe
+
+FIELDS = ('ingredients', 'tags')
+# Rebuild instead of patching once this share of the recipes changed
+REBUILD_RATIO = 0.2
+
+_indexes = OrderedDict()
+_lock = threading.Lock()
+
+
+def _id_array(ids):
+    """Unique ``ids`` as int32
+
+    Ids int32 cannot hold are dropped: no row has them, and the cast would
+    wrap them around to another id.
+    """
+    if not isinstance(ids, np.ndarray):
+        limit = np.iinfo(np.int32).max
+        ids = [pk for pk in ids if 0 < pk <= limit]
+    return np.unique(np.asarray(ids, np.int32))
+
+
+class Postings:
+    """One sparse recipe x feature matrix, indexed both ways
+
+    ``features``/``starts``/``rows`` give the rows using each feature,
+    ``row_starts``/``row_features`` the features of each row.
+    """
+
+    __slots__ = ('features', 'starts', 'rows', 'row_starts', 'row_features')
+
+    def __init__(self, rows, features, size):
+        order = np.lexsort((features, rows))
+        self.row_features = features[order]
+        self.row_starts = np.zeros(size + 1, dtype=np.int64)
+        np.cumsum(np.bincount(rows, minlength=size), out=self.row_starts[1:])
+
+        order = np.lexsort((rows, features))
+        self.rows = rows[order]
+        self.features, starts = np.unique(features[order], return_index=True)
+        self.starts = np.append(starts, len(self.rows)).astype(np.int64)
+
+    def pairs(self):
+        """The ``(rows, features)`` entries of the matrix"""
+        rows = np.repeat(
+            np.arange(len(self.row_starts) - 1, dtype=np.int32),
+            np.diff(self.row_starts),
+        )
+        return rows, self.row_features
+
+    def features_of(self, row):
+        return self.row_features[self.row_starts[row]:self.row_starts[row + 1]]
+
+    def row_sizes(self):
+        return np.diff(self.row_starts)
+
+    def overlap(self, feature_ids, size):
+        """Number of ``feature_ids`` used by each of ``size`` rows"""
+        pos = np.searchsorted(self.features, feature_ids)
+        pos = pos[pos < len(self.features)]
+        pos = pos[np.isin(self.features[pos], feature_ids)]
+        if not len(pos):
+            return np.zeros(size, dtype=np.int64)
+        rows = np.concatenate([
+            self.rows[self.starts[p]:self.starts[p + 1]] for p in pos
+        ])
+        return np.bincount(rows, minlength=size)
+
+
+def _load_links(field, recipe_ids):
+    """``(recipe ids, feature ids)`` arrays of the links of ``recipe_ids``"""
+    rel = Recipe._meta.get_field(field)
+    column = f'{rel.m2m_reverse_field_name()}_id'
+    links = rel.remote_field.through.objects.filter(recipe_id__in=recipe_ids)\
+        .values_list('recipe_id', column)
+    flat = np.fromiter(
+        itertools.chain.from_iterable(links.iterator()), dtype=np.int32,
+    )
+    return flat[0::2], flat[1::2]
+
+
+class RecipeIndex:
+    """Ingredient and tag postings of one user's live recipes"""
+
+    def __init__(self, newest, recipe_ids, links):
+        """``newest`` is the pair returned by ``_newest`` before loading,
+        ``links`` maps each field to ``(recipe ids, feature ids)``
+        """
+        self.newest, self.watermark = newest
+        self.recipe_ids = recipe_ids
+        self.postings = {}
+        self.sizes = {}
+        for field, (recipes, features) in links.items():
+            rows = np.searchsorted(recipe_ids, recipes).astype(np.int32)
+            self.postings[field] = Postings(rows, features, len(self))
+            self.sizes[field] = self.postings[field].row_sizes()
+
+    def __len__(self):
+        return len(self.recipe_ids)
+
+    @classmethod
+    def build(cls, user):
+        newest = _newest(user)
+        recipes = Recipe.objects.filter(user=user)
+        recipe_ids = np.fromiter(
+            recipes.order_by('id').values_list('id', flat=True).iterator(),
+            dtype=np.int32,
+        )
+        return cls(newest, recipe_ids, {
+            field: _load_links(field, recipes.values('id'))
+            for field in FIELDS
+        })
+
+    def refresh(self, user):
+        """An index including the recipes changed since this one's build
+
+        Recipes changed within ``SYNC_SETTLE_SECONDS`` of the last load
+        are read once more after that window, as a transaction may still
+        have committed behind them.
+        """
+        newest = _newest(user)
+        if newest[0] == self.newest and (
+            self.watermark == self.newest or timezone.now()
+            < self.newest + timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+        ):
+            return self
+        if newest[0] is None or self.newest is None \
+                or newest[0] < self.newest:
+            return self.build(user)
+        changed = Recipe.all_objects.filter(
+            user=user, updated_at__gt=self.watermark,
+        ).values_list('id', 'deleted_at')
+        changed_ids, live_ids = [], []
+        for pk, deleted_at in changed:
+            changed_ids.append(pk)
+            if deleted_at is None:
+                live_ids.append(pk)
+        if not changed_ids:
+            self.newest, self.watermark = newest
+            return self
+        if len(changed_ids) > REBUILD_RATIO * max(len(self), 1):
+            return self.build(user)
+
+        changed_ids = np.array(changed_ids, dtype=np.int32)
+        live_ids = np.array(live_ids, dtype=np.int32)
+        recipe_ids = np.union1d(
+            np.setdiff1d(self.recipe_ids, changed_ids), live_ids
+        ).astype(np.int32)
+        links = {}
+        for field in FIELDS:
+            rows, features = self.postings[field].pairs()
+            recipes = self.recipe_ids[rows]
+            keep = ~np.isin(recipes, changed_ids)
+            new_recipes, new_features = _load_links(field, live_ids.tolist())
+            links[field] = (
+                np.concatenate([recipes[keep], new_recipes]),
+                np.concatenate([features[keep], new_features]),
+            )
+        return RecipeIndex(newest, recipe_ids, links)
+
+    def _overlap(self, features):
+        overlap = np.zeros(len(self), dtype=np.int64)
+        sizes = np.zeros(len(self), dtype=np.int64)
+        query_size = 0
+        for field in FIELDS:
+            ids = _id_array(features.get(field, ()))
+            overlap += self.postings[field].overlap(ids, len(self))
+            sizes += self.sizes[field]
+            query_size += len(ids)
+        return overlap, sizes, query_size
+
+    def similar(self, recipe_id, limit=10, metric='jaccard'):
+        """``[(recipe id, score)]`` of the recipes most like ``recipe_id``
+
+        Recipes are compared as sets of their ingredients and tags.
+        """
+        row = np.searchsorted(self.recipe_ids, recipe_id)
+        if row >= len(self) or self.recipe_ids[row] != recipe_id:
+            return []
+        overlap, sizes, query_size = self._overlap({
+            field: self.postings[field].features_of(row) for field in FIELDS
+        })
+        overlap[row] = 0
+        if metric == 'cosine':
+            denominator = np.sqrt(sizes * float(query_size))
+        else:
+            denominator = (sizes + query_size - overlap).astype(np.float64)
+        scores = np.divide(
+            overlap, denominator,
+            out=np.zeros(len(self)), where=denominator > 0,
+        )
+        return self._top(scores, scores > 0, limit)
+
+    def cookable(self, ingredient_ids, limit=10):
+        """``[(recipe id, missing, coverage)]`` using ``ingredient_ids``
+
+        Recipes missing the fewest ingredients come first, then those
+        using more of the given ones.
+        """
+        ids = _id_array(ingredient_ids)
+        overlap = self.postings['ingredients'].overlap(ids, len(self))
+        sizes = self.sizes['ingredients']
+        candidates = np.flatnonzero(overlap)
+        missing = sizes[candidates] - overlap[candidates]
+        order = np.lexsort((-overlap[candidates], missing))[:limit]
+        rows = candidates[order]
+        return [
+            (int(self.recipe_ids[r]), int(sizes[r] - overlap[r]),
+             float(overlap[r]) / sizes[r])
+            for r in rows
+        ]
+
+    def _top(self, scores, mask, limit):
+        candidates = np.flatnonzero(mask)
+        if len(candidates) > limit:
+            part = np.argpartition(-scores[candidates], limit - 1)[:limit]
+            candidates = candidates[part]
+        order = np.lexsort((self.recipe_ids[candidates], -scores[candidates]))
+        return [
+            (int(self.recipe_ids[r]), float(scores[r]))
+            for r in candidates[order]
+        ]
+
+
+def _newest(user):
+    return sync.newest_change(Recipe.all_objects.filter(user=user))
+
+
+def get_index(user):
+    """The up to date ``RecipeIndex`` of ``user``"""
+    with _lock:
+        index = _indexes.get(user.pk)
+    index = index.refresh(user) if index is not None \
+        else RecipeIndex.build(user)
+    with _lock:
+        _indexes[user.pk] = index
+        _indexes.move_to_end(user.pk)
+        while len(_indexes) > settings.RECOMMEND_INDEX_USERS:
+            _indexes.popitem(last=False)
+    return index
+
+
+def clear():
+    with _lock:
+        _indexes.clear()
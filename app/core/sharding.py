@@ -0,0 +1,148 @@
+"""Recipe data spread over several databases by user.
+
+With ``RECIPE_SHARDS`` naming database aliases, each user's recipes, tags,
+ingredients, their links, counters and sync tombstones live in the shard
+``shard_for`` picks from the user id; users, tokens, image blobs and the
+rest stay in the default database, and every user row is mirrored into
+its shard for the foreign keys there. ``UserShardRouter`` sends queries on
+recipe data to the shard of the row's user or, without a row to go by, to
+the shard pinned for the current thread: API requests pin their user's
+shard while they run (``ShardedTokenAuthentication``), code elsewhere uses
+``pinned(user)`` or ``using(alias)``. Transactions over recipe data take
+``atomic()`` so they open on the pinned shard.
+
+Without ``RECIPE_SHARDS`` everything routes to the default database and
+all of this is a no-op.
+"""
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DEFAULT_DB_ALIAS, transaction
+from rest_framework.authentication import TokenAuthentication
+
+# Models whose rows belong to one user
+SHARDED_MODELS = {'core.recipe', 'core.tag', 'core.ingredient',
+                  'core.recipetag', 'core.recipeingredient',
+                  'core.recipestats', 'core.tombstone',
+                  'core.outboxevent', 'core.webhook'}
+
+_local = threading.local()
+
+
+def shards():
+    return list(settings.RECIPE_SHARDS)
+
+
+def databases():
+    """Every database holding recipe data"""
+    return shards() or [DEFAULT_DB_ALIAS]
+
+
+def _user_id(user):
+    return getattr(user, 'pk', user)
+
+
+def shard_for(user):
+    """The database alias holding the recipe data of ``user`` (or an id)"""
+    aliases = shards()
+    if not aliases:
+        return DEFAULT_DB_ALIAS
+    return aliases[_user_id(user) % len(aliases)]
+
+
+def current():
+    """The alias pinned for this thread, if any"""
+    return getattr(_local, 'alias', None)
+
+
+def alias():
+    """The alias recipe data is read and written on in this thread"""
+    return current() or DEFAULT_DB_ALIAS
+
+
+def pin(user):
+    _local.alias = shard_for(user)
+
+
+def unpin():
+    _local.alias = None
+
+
+@contextmanager
+def using(db):
+    """Route recipe data without a row to go by to ``db`` meanwhile"""
+    previous = current()
+    _local.alias = db
+    try:
+        yield db
+    finally:
+        _local.alias = previous
+
+
+def pinned(user):
+    """Route recipe data without a row to go by to ``user``'s shard"""
+    return using(shard_for(user))
+
+
+def atomic(**kwargs):
+    """``transaction.atomic`` on the database of the pinned shard"""
+    return transaction.atomic(using=alias(), **kwargs)
+
+
+def is_sharded(model):
+    return model._meta.label_lower in SHARDED_MODELS
+
+
+class UserShardRouter:
+    """Routes recipe data to its user's shard, everything else to default"""
+
+    def _db(self, model, **hints):
+        if not is_sharded(model):
+            return DEFAULT_DB_ALIAS
+        instance = hints.get('instance')
+        if isinstance(instance, get_user_model()):
+            return shard_for(instance)
+        user_id = getattr(instance, 'user_id', None)
+        if user_id is not None:
+            return shard_for(user_id)
+        return current()
+
+    db_for_read = _db
+    db_for_write = _db
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Rows of a user and the mirror of the user share a database
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # Shards carry the whole schema, so their foreign keys resolve
+        return None
+
+
+class ShardedTokenAuthentication(TokenAuthentication):
+    """Token authentication pinning the user's shard for the request"""
+
+    def authenticate(self, request):
+        result = super().authenticate(request)
+        if result is not None:
+            pin(result[0])
+        return result
+
+
+def mirror_user(user):
+    """Copy ``user``'s row from the default database into its shard"""
+    model = type(user)
+    fields = {
+        field.attname: getattr(user, field.attname)
+        for field in model._meta.concrete_fields if not field.primary_key
+    }
+    model.objects.using(shard_for(user)).update_or_create(
+        pk=user.pk, defaults=fields,
+    )
+
+
+def remove_mirror(user):
+    """Delete ``user``'s mirror, and whatever they left, from their shard"""
+    type(user).objects.using(shard_for(user)).filter(pk=user.pk).delete()
@@ -0,0 +1,57 @@
+"""Shopping lists merging the ingredients of several recipes."""
+from django.db.models import Aggregate, CharField, F
+
+from core.models import Recipe
+
+
+class GroupConcat(Aggregate):
+    """Comma separated values of an expression within each group"""
+    function = 'GROUP_CONCAT'
+    output_field = CharField()
+
+    def as_postgresql(self, compiler, connection):
+        return self.as_sql(
+            compiler, connection, function='STRING_AGG',
+            template="%(function)s((%(expressions)s)::text, ',')",
+        )
+
+
+class UnknownRecipes(ValueError):
+    """Some of the requested recipes are not the user's"""
+
+    def __init__(self, ids):
+        super().__init__(f'Unknown recipes: {ids}')
+        self.ids = ids
+
+
+def shopping_list(user, ids):
+    """Ingredients and totals of ``user``'s recipes ``ids``
+
+    Every ingredient appears once, with the ids of the recipes needing it,
+    grouped by a single query over the through table.
+    """
+    ids = set(ids)
+    recipes = Recipe.objects.filter(user=user, id__in=ids)\
+        .values_list('id', 'price', 'time_minutes')
+    found = {pk: (price, minutes) for pk, price, minutes in recipes}
+    if set(found) != ids:
+        raise UnknownRecipes(sorted(ids - set(found)))
+
+    through = Recipe.ingredients.through
+    # Negated so the deleted_at index does not drive the join
+    rows = through.objects.filter(recipe_id__in=ids)\
+        .exclude(ingredient__deleted_at__isnull=False)\
+        .values('ingredient_id')\
+        .annotate(name=F('ingredient__name'),
+                  recipes=GroupConcat('recipe_id'))\
+        .order_by('name', 'ingredient_id')
+    return {
+        'recipes': sorted(found),
+        'price': sum(price for price, _ in found.values()),
+        'time_minutes': sum(minutes for _, minutes in found.values()),
+        'ingredients': [{
+            'id': row['ingredient_id'],
+            'name': row['name'],
+            'recipes': sorted(int(pk) for pk in row['recipes'].split(',')),
+        } for row in rows],
+    }
@@ -0,0 +1,200 @@
+from django.core.signals import request_finished, request_started
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models.signals import m2m_changed, post_delete, \
+    post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from core import names, sharding, snapshots, stats, storage, sync, webhooks
+from core.models import Ingredient, OutboxEvent, Recipe, Tag, User
+
+# Users being deleted. Their counters and tombstones cascade away with
+# them, so rows removed along with the user are not accounted for.
+_deleting_users = set()
+# Recipe columns recipe_saved diffs against their stored values
+_DIFFED = ('time_minutes', 'price', 'image')
+
+
+def _saved_fields(update_fields):
+    return [name for name in _DIFFED
+            if update_fields is None or name in update_fields]
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_saving(sender, instance, raw=False, update_fields=None,
+                  **kwargs):
+    """Read the stored values recipe_saved diffs, unless already loaded"""
+    if raw or instance._state.adding:
+        return
+    loaded = getattr(instance, '_loaded_values', None) or {}
+    missing = [name for name in _saved_fields(update_fields)
+               if name not in loaded]
+    if missing:
+        row = Recipe.all_objects.filter(pk=instance.pk)\
+            .values(*missing).first()
+        instance._loaded_values = dict(loaded, **(row or {}))
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance, created, raw=False, update_fields=None,
+                 **kwargs):
+    if raw:
+        return
+    snapshots.mark_stale(instance.user_id)
+    webhooks.record(OutboxEvent.CREATED if created else OutboxEvent.UPDATED,
+                    'recipe', instance.user_id, [instance.pk])
+    new = stats.recipe_values(instance)
+    loaded = getattr(instance, '_loaded_values', None) or {}
+    saved = _saved_fields(update_fields)
+    if created:
+        stats.recipe_added(instance.user_id, new)
+        storage.retain(instance.image.name)
+    else:
+        if 'time_minutes' in saved and 'price' in saved \
+                and 'time_minutes' in loaded and 'price' in loaded:
+            old = stats.recipe_values(Recipe(
+                time_minutes=loaded['time_minutes'], price=loaded['price'],
+            ))
+            stats.recipe_changed(instance.user_id, old, new)
+        if 'image' in saved and 'image' in loaded \
+                and loaded['image'] != instance.image.name:
+            storage.retain(instance.image.name)
+            storage.release(loaded['image'])
+    current = {
+        'time_minutes': instance.time_minutes,
+        'price': instance.price,
+        'image': instance.image.name,
+    }
+    instance._loaded_values = dict(
+        loaded, **{name: current[name] for name in saved}
+    )
+
+
+def _tracked(instance):
+    """False for rows a soft delete or user deletion already wrote off"""
+    return instance.deleted_at is None \
+        and instance.user_id not in _deleting_users
+
+
+@receiver(pre_delete, sender=User)
+def user_deleting(sender, instance, **kwargs):
+    _deleting_users.add(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, using, **kwargs):
+    _deleting_users.discard(instance.pk)
+    if sharding.shards() and using == DEFAULT_DB_ALIAS:
+        sharding.remove_mirror(instance)
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, using, raw=False, **kwargs):
+    if sharding.shards() and using == DEFAULT_DB_ALIAS:
+        sharding.mirror_user(instance)
+
+
+@receiver(request_started)
+@receiver(request_finished)
+def request_boundary(sender, **kwargs):
+    # Requests pin their user's shard, none carries over to the next
+    sharding.unpin()
+
+
+@receiver(pre_delete, sender=Recipe)
+def recipe_deleting(sender, instance, **kwargs):
+    if _tracked(instance):
+        stats.recipe_unlinked(instance)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance, **kwargs):
+    storage.release(instance.image.name)
+    snapshots.mark_stale(instance.user_id)
+    if _tracked(instance):
+        stats.recipe_removed(instance.user_id, stats.recipe_values(instance))
+        sync.record_deletion(instance)
+        webhooks.record(OutboxEvent.DELETED, 'recipe', instance.user_id,
+                        [instance.pk])
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+def recipe_attr_saved(sender, instance, created, raw=False, **kwargs):
+    if not raw:
+        names.bump(instance.user_id)
+        webhooks.record(
+            OutboxEvent.CREATED if created else OutboxEvent.UPDATED,
+            sender._meta.model_name, instance.user_id, [instance.pk],
+        )
+
+
+@receiver(pre_delete, sender=Tag)
+@receiver(pre_delete, sender=Ingredient)
+def recipe_attr_deleting(sender, instance, **kwargs):
+    # The cascade drops the links without sending m2m_changed
+    if _tracked(instance):
+        recipes = list(instance.recipe_set.values_list('pk', flat=True))
+        sync.touch_recipes(recipes)
+        webhooks.record(OutboxEvent.UPDATED, 'recipe', instance.user_id,
+                        recipes)
+
+
+@receiver(post_delete, sender=Tag)
+@receiver(post_delete, sender=Ingredient)
+def recipe_attr_deleted(sender, instance, **kwargs):
+    if _tracked(instance):
+        sync.record_deletion(instance)
+        names.bump(instance.user_id)
+        webhooks.record(OutboxEvent.DELETED, sender._meta.model_name,
+                        instance.user_id, [instance.pk])
+
+
+def links_changed(sender, instance, action, reverse, model, pk_set,
+                  **kwargs):
+    """Keep ``recipe_count`` in step with the Recipe.tags/ingredients links"""
+    target = Tag if sender is Recipe.tags.through else Ingredient
+    target_field = target._meta.model_name
+    links = sender.objects.filter(
+        **{target_field if reverse else 'recipe': instance}
+    )
+
+    if action == 'pre_remove' and kwargs.get('exact'):
+        # core.bulk.set_links only reports links that really exist
+        instance._unlinked = list(pk_set)
+    elif action in ('pre_clear', 'pre_remove'):
+        if action == 'pre_remove':
+            links = links.filter(
+                **{'recipe__in' if reverse else f'{target_field}__in': pk_set}
+            )
+        instance._unlinked = list(links.values_list(
+            'recipe_id' if reverse else f'{target_field}_id', flat=True
+        ))
+    elif action in ('post_clear', 'post_remove'):
+        unlinked = getattr(instance, '_unlinked', None) or []
+        if reverse:
+            stats.adjust_usage(target, [instance.pk], -len(unlinked))
+        else:
+            stats.adjust_usage(target, unlinked, -1)
+    elif action == 'post_add':
+        if reverse:
+            stats.adjust_usage(target, [instance.pk], len(pk_set))
+        else:
+            stats.adjust_usage(target, pk_set, 1)
+
+    # The sync feed serves links as part of the recipe. core.bulk.set_links
+    # saves the recipe itself, other link changes have to move it up.
+    if action.startswith('post_') and not kwargs.get('exact'):
+        snapshots.mark_stale(instance.user_id)
+        if not reverse:
+            touched = [instance.pk]
+        elif action == 'post_add':
+            touched = list(pk_set)
+        else:
+            touched = getattr(instance, '_unlinked', None) or []
+        sync.touch_recipes(touched)
+        webhooks.record(OutboxEvent.UPDATED, 'recipe', instance.user_id,
+                        touched)
+
+
+m2m_changed.connect(links_changed, sender=Recipe.tags.through)
+m2m_changed.connect(links_changed, sender=Recipe.ingredients.through)
@@ -0,0 +1,191 @@
+"""Precomputed recipe lists for users with large libraries.
+
+``RecipeViewSet.list`` serializes every recipe of the user on each request.
+For users flagged with ``recipe_list_snapshot`` the serialized recipes are
+kept in the ``RECIPE_SNAPSHOT_CACHE`` cache instead, compressed in segments
+of ``SEGMENT_SIZE`` ids, and the list is put together from them.
+
+A snapshot is served as is for ``RECIPE_SNAPSHOT_MAX_AGE`` seconds after
+it was last checked, unless a recipe of the user changed since: the recipe
+signals mark it stale once their transaction commits. Checking serializes
+just the recipes whose ``updated_at`` moved and recompresses the segments
+holding them. Stale marks only reach the processes sharing the cache, a
+local-memory cache leaves the others to the age bound.
+
+Each version of a snapshot has a random ``tag``, under which its
+compressed response bodies are cached as well.
+"""
+import pickle
+import time
+import uuid
+import zlib
+from operator import itemgetter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from core import compression, sharding, sync
+from core.models import Recipe
+
+# Recipes per cache entry; a change recompresses only its own segment
+SEGMENT_SIZE = 1000
+
+
+def _cache():
+    return caches[settings.RECIPE_SNAPSHOT_CACHE]
+
+
+def _key(user_id, part):
+    return f'recipe-snapshot:{user_id}:{part}'
+
+
+def mark_stale(user_id):
+    """Have the next read of ``user_id``'s snapshot look for changes"""
+    transaction.on_commit(lambda: _cache().set(
+        _key(user_id, 'stale'), time.time(), settings.RECIPE_SNAPSHOT_TIMEOUT,
+    ), using=sharding.shard_for(user_id))
+
+
+def _dump(rows):
+    return zlib.compress(pickle.dumps(rows, pickle.HIGHEST_PROTOCOL))
+
+
+def _load(data):
+    return pickle.loads(zlib.decompress(data))
+
+
+class Snapshot:
+    """Serialized recipes of one user, by segment, newest first"""
+
+    def __init__(self, newest, checked_at, segments, tag=None):
+        """``newest`` is the pair returned by ``sync.newest_change`` before
+        loading, ``segments`` maps numbers to ``[(id, json), ...]``
+        """
+        self.newest, self.watermark = newest
+        self.checked_at = checked_at
+        self.segments = segments
+        self.tag = tag or uuid.uuid4().hex
+
+    @classmethod
+    def build(cls, user, render, checked_at):
+        newest = sync.newest_change(Recipe.all_objects.filter(user=user))
+        recipes = Recipe.objects.filter(user=user).order_by('-id')
+        segments, last = {}, None
+        while True:
+            chunk = recipes if last is None else recipes.filter(id__lt=last)
+            chunk = list(chunk[:SEGMENT_SIZE])
+            for recipe, row in zip(chunk, render(chunk)):
+                segments.setdefault(recipe.pk // SEGMENT_SIZE, []).append(
+                    (recipe.pk, row)
+                )
+            if len(chunk) < SEGMENT_SIZE:
+                return cls(newest, checked_at, segments)
+            last = chunk[-1].pk
+
+    def refresh(self, user, render, checked_at):
+        """Patch in the recipes changed since the last check
+
+        Returns the numbers of the segments that changed, or None when
+        the snapshot has to be built again.
+        """
+        newest = sync.newest_change(Recipe.all_objects.filter(user=user))
+        self.checked_at = checked_at
+        if newest[0] == self.newest and self.watermark == self.newest:
+            return set()
+        if newest[0] is None or self.newest is None \
+                or newest[0] < self.newest:
+            return None
+        changed = list(Recipe.all_objects.filter(
+            user=user, updated_at__gt=self.watermark,
+        ))
+        live = [recipe for recipe in changed if recipe.deleted_at is None]
+        rows = dict(zip((recipe.pk for recipe in live), render(live)))
+        patches = {}
+        for recipe in changed:
+            patches.setdefault(recipe.pk // SEGMENT_SIZE, {})[recipe.pk] = \
+                rows.get(recipe.pk)
+        for number, patch in patches.items():
+            segment = dict(self.segments.get(number, ()))
+            segment.update(patch)
+            self.segments[number] = sorted(
+                ((pk, row) for pk, row in segment.items() if row is not None),
+                key=itemgetter(0), reverse=True,
+            )
+        self.newest, self.watermark = newest
+        if patches:
+            self.tag = uuid.uuid4().hex
+        return set(patches)
+
+    def body(self):
+        return b'[' + b','.join(
+            row
+            for number in sorted(self.segments, reverse=True)
+            for pk, row in self.segments[number]
+        ) + b']'
+
+    def response(self, request):
+        """The list as a response, compressed as ``request`` accepts"""
+        return compression.cached_response(
+            request, self.body, 'application/json', _cache(),
+            f'recipe-snapshot-body:{self.tag}',
+            settings.RECIPE_SNAPSHOT_TIMEOUT,
+        )
+
+    @classmethod
+    def load(cls, user_id):
+        """The stored snapshot and when it was last marked stale"""
+        cache = _cache()
+        stored = cache.get_many(
+            [_key(user_id, 'meta'), _key(user_id, 'stale')]
+        )
+        meta = stored.get(_key(user_id, 'meta'))
+        stale_at = stored.get(_key(user_id, 'stale'), 0)
+        if meta is None:
+            return None, stale_at
+        newest, checked_at, numbers, tag = meta
+        keys = [_key(user_id, number) for number in numbers]
+        segments = cache.get_many(keys)
+        if len(segments) < len(keys):
+            # Partly evicted
+            return None, stale_at
+        return cls(newest, checked_at, {
+            number: _load(segments[key]) for number, key in zip(numbers, keys)
+        }, tag), stale_at
+
+    def save(self, user_id, numbers):
+        """Store the meta data and segments ``numbers`` of the snapshot"""
+        cache = _cache()
+        timeout = settings.RECIPE_SNAPSHOT_TIMEOUT
+        empty = [number for number in numbers if not self.segments[number]]
+        for number in empty:
+            del self.segments[number]
+        cache.delete_many([_key(user_id, number) for number in empty])
+        cache.set_many({
+            _key(user_id, number): _dump(self.segments[number])
+            for number in numbers if number in self.segments
+        }, timeout)
+        cache.set(_key(user_id, 'meta'), (
+            (self.newest, self.watermark), self.checked_at,
+            list(self.segments), self.tag,
+        ), timeout)
+
+
+def recipe_list(user, render):
+    """The ``Snapshot`` of ``user``'s recipes, newest first
+
+    ``render`` maps a list of recipes to their JSON documents.
+    """
+    checked_at = time.time()
+    snapshot, stale_at = Snapshot.load(user.pk)
+    if snapshot is not None and stale_at < snapshot.checked_at \
+            and checked_at - snapshot.checked_at \
+            < settings.RECIPE_SNAPSHOT_MAX_AGE:
+        return snapshot
+    changed = snapshot.refresh(user, render, checked_at) \
+        if snapshot is not None else None
+    if changed is None:
+        snapshot = Snapshot.build(user, render, checked_at)
+        changed = set(snapshot.segments)
+    snapshot.save(user.pk, changed)
+    return snapshot
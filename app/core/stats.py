@@ -0,0 +1,222 @@
+"""Incrementally maintained recipe counters.
+
+Per-user ``RecipeStats`` rows and ``Tag``/``Ingredient.recipe_count`` are
+adjusted with F() expressions as recipes and their links change, so the
+stats endpoint never has to aggregate over a user's whole library.
+``recompute`` rebuilds everything from scratch to repair drift.
+"""
+from django.db.models import Count, F, IntegerField, Max, Min, OuterRef, \
+    Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from core import sharding
+from core.models import Ingredient, Recipe, RecipeStats, Tag
+
+
+def _stats_for(user_id):
+    return RecipeStats.objects.get_or_create(user_id=user_id)[0]
+
+
+def recipe_values(recipe):
+    """The ``(time_minutes, price)`` pair tracked for ``recipe``"""
+    price_field = Recipe._meta.get_field('price')
+    return int(recipe.time_minutes), price_field.to_python(recipe.price)
+
+
+def _extend_bounds(low, high=None):
+    """Update kwargs widening min/max bounds to cover ``low``..``high``"""
+    bounds = {}
+    for i, name in enumerate(('time_minutes', 'price')):
+        field = Recipe._meta.get_field(name)
+        value = Value(low[i], output_field=field)
+        bounds[f'{name}_min'] = Least(
+            Coalesce(F(f'{name}_min'), value), value
+        )
+        value = Value((high or low)[i], output_field=field)
+        bounds[f'{name}_max'] = Greatest(
+            Coalesce(F(f'{name}_max'), value), value
+        )
+    return bounds
+
+
+def _on_bound(stats, values):
+    """True when removing ``values`` may shrink the stored bounds"""
+    time_minutes, price = values
+    return time_minutes in (stats.time_minutes_min, stats.time_minutes_max) \
+        or price in (stats.price_min, stats.price_max)
+
+
+def refresh_bounds(user_id):
+    """Recompute min/max for one user from their recipes"""
+    bounds = Recipe.objects.filter(user_id=user_id).aggregate(
+        time_minutes_min=Min('time_minutes'),
+        time_minutes_max=Max('time_minutes'),
+        price_min=Min('price'),
+        price_max=Max('price'),
+    )
+    RecipeStats.objects.filter(user_id=user_id).update(**bounds)
+
+
+def recipe_added(user_id, values):
+    """Account for a new recipe with ``(time_minutes, price)`` values"""
+    with sharding.pinned(user_id), sharding.atomic():
+        _stats_for(user_id)
+        RecipeStats.objects.filter(user_id=user_id).update(
+            recipe_count=F('recipe_count') + 1,
+            time_minutes_total=F('time_minutes_total') + values[0],
+            price_total=F('price_total') + values[1],
+            **_extend_bounds(values)
+        )
+
+
+def recipes_added(user_id, recipes):
+    """Account for a batch of new ``recipes`` given as a queryset"""
+    totals = recipes.aggregate(
+        count=Count('id'),
+        time_minutes_total=Sum('time_minutes'),
+        time_minutes_min=Min('time_minutes'),
+        time_minutes_max=Max('time_minutes'),
+        price_total=Sum('price'),
+        price_min=Min('price'),
+        price_max=Max('price'),
+    )
+    if not totals['count']:
+        return
+    with sharding.pinned(user_id), sharding.atomic():
+        _stats_for(user_id)
+        RecipeStats.objects.filter(user_id=user_id).update(
+            recipe_count=F('recipe_count') + totals['count'],
+            time_minutes_total=F('time_minutes_total')
+            + totals['time_minutes_total'],
+            price_total=F('price_total') + totals['price_total'],
+            **_extend_bounds(
+                (totals['time_minutes_min'], totals['price_min']),
+                (totals['time_minutes_max'], totals['price_max']),
+            )
+        )
+
+
+def recipe_changed(user_id, old, new):
+    """Account for a recipe whose ``(time_minutes, price)`` changed"""
+    if old == new:
+        return
+    with sharding.pinned(user_id), sharding.atomic():
+        stats = _stats_for(user_id)
+        RecipeStats.objects.filter(user_id=user_id).update(
+            time_minutes_total=F('time_minutes_total') + new[0] - old[0],
+            price_total=F('price_total') + new[1] - old[1],
+            **_extend_bounds(new)
+        )
+        if _on_bound(stats, old):
+            refresh_bounds(user_id)
+
+
+def recipe_removed(user_id, values):
+    """Account for a deleted recipe with ``(time_minutes, price)`` values"""
+    with sharding.pinned(user_id), sharding.atomic():
+        stats = _stats_for(user_id)
+        RecipeStats.objects.filter(user_id=user_id).update(
+            recipe_count=F('recipe_count') - 1,
+            time_minutes_total=F('time_minutes_total') - values[0],
+            price_total=F('price_total') - values[1],
+        )
+        if _on_bound(stats, values):
+            refresh_bounds(user_id)
+
+
+def adjust_usage(model, pks, delta):
+    """Shift ``recipe_count`` of the given tags/ingredients by ``delta``"""
+    if not pks or not delta:
+        return
+    model.objects.filter(pk__in=pks).update(
+        recipe_count=F('recipe_count') + delta
+    )
+
+
+def recipe_unlinked(recipe):
+    """Account for all links of ``recipe`` about to be dropped"""
+    for model in (Tag, Ingredient):
+        adjust_usage(
+            model,
+            list(model.objects.filter(recipe=recipe)
+                 .values_list('pk', flat=True)),
+            -1,
+        )
+
+
+def links_added(recipe_ids):
+    """Account for every tag/ingredient link of the given new recipes"""
+    for field in ('tags', 'ingredients'):
+        rel = Recipe._meta.get_field(field)
+        column = rel.m2m_reverse_field_name()
+        links = rel.remote_field.through.objects.filter(
+            recipe_id__in=recipe_ids
+        )
+        counts = links.filter(**{column: OuterRef('pk')}).order_by()\
+            .values(column).annotate(n=Count('*')).values('n')
+        rel.related_model.objects.filter(pk__in=links.values(column)).update(
+            recipe_count=F('recipe_count')
+            + Subquery(counts, output_field=IntegerField())
+        )
+
+
+def _usage_subquery(field):
+    through = Recipe._meta.get_field(field).remote_field.through
+    column = Recipe._meta.get_field(field).m2m_reverse_field_name()
+    counts = through.objects.filter(
+        recipe__deleted_at__isnull=True, **{column: OuterRef('pk')}
+    ).order_by().values(column).annotate(n=Count('*')).values('n')
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def recompute(user=None):
+    """Rebuild all counters, optionally only for ``user``"""
+    if user is not None:
+        with sharding.pinned(user):
+            _recompute(user)
+        return
+    for db in sharding.databases():
+        with sharding.using(db):
+            _recompute()
+
+
+def _recompute(user=None):
+    recipes = Recipe.objects.all()
+    tags = Tag.objects.all()
+    ingredients = Ingredient.objects.all()
+    stats = RecipeStats.objects.all()
+    if user is not None:
+        recipes = recipes.filter(user=user)
+        tags = tags.filter(user=user)
+        ingredients = ingredients.filter(user=user)
+        stats = stats.filter(user=user)
+
+    with sharding.atomic():
+        tags.update(recipe_count=_usage_subquery('tags'))
+        ingredients.update(recipe_count=_usage_subquery('ingredients'))
+
+        rows = recipes.order_by().values('user').annotate(
+            recipe_count=Count('id'),
+            time_minutes_total=Sum('time_minutes'),
+            time_minutes_min=Min('time_minutes'),
+            time_minutes_max=Max('time_minutes'),
+            price_total=Sum('price'),
+            price_min=Min('price'),
+            price_max=Max('price'),
+        )
+        seen = set()
+        for row in rows:
+            user_id = row.pop('user')
+            seen.add(user_id)
+            RecipeStats.objects.update_or_create(
+                user_id=user_id, defaults=row,
+            )
+        stats.exclude(user_id__in=seen).update(
+            recipe_count=0,
+            time_minutes_total=0,
+            time_minutes_min=None,
+            time_minutes_max=None,
+            price_total=0,
+            price_min=None,
+            price_max=None,
+        )
@@ -0,0 +1,180 @@
+"""Content-addressed storage for uploaded files.
+
+Uploads are hashed while being streamed to disk and stored once under
+their SHA-256 digest, so identical images share a single file. Each
+stored file has an ``ImageBlob`` row counting the recipes that reference
+it; ``gc_recipe_images`` removes files nobody references any more.
+"""
+import hashlib
+import os
+import tempfile
+import uuid
+from collections import Counter
+
+from django.core.files.storage import FileSystemStorage
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.deconstruct import deconstructible
+
+from core import sharding
+from core.models import RECIPE_IMAGE_DIR, ImageBlob, Recipe
+
+# Uploads waiting for core.tasks.store_recipe_image
+STAGING_DIR = 'uploads/staging/'
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+
+    def get_available_name(self, name, max_length=None):
+        """Names are derived from content in _save, so never mangle them"""
+        return name
+
+    def _save(self, name, content):
+        directory = os.path.dirname(name)
+        ext = os.path.splitext(name)[1].lower()
+        os.makedirs(self.path(directory), exist_ok=True)
+
+        digest = hashlib.sha256()
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.path(directory), suffix='.upload'
+        )
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    fh.write(chunk)
+            name = os.path.join(directory, digest.hexdigest() + ext)
+            if self.exists(name):
+                os.remove(tmp_path)
+                # Keep the reused blob clear of the garbage collector
+                os.utime(self.path(name))
+            else:
+                os.replace(tmp_path, self.path(name))
+                if self.file_permissions_mode is not None:
+                    os.chmod(self.path(name), self.file_permissions_mode)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name.replace('\\', '/')
+
+    def stage(self, content):
+        """Save ``content`` under STAGING_DIR as is and return its name
+
+        Nothing is hashed, a temporary upload file is only moved, so this
+        is cheap enough for a request; storing it for real is deferred.
+        """
+        ext = os.path.splitext(content.name or '')[1].lower()
+        name = os.path.join(STAGING_DIR, uuid.uuid4().hex + ext)
+        return super()._save(name, content)
+
+    def delete(self, name):
+        """Only remove a blob once no recipe references it"""
+        if ImageBlob.objects.filter(name=name, ref_count__gt=0).exists():
+            return
+        super().delete(name)
+
+
+def _adjust(name, delta):
+    if not name:
+        return
+    ImageBlob.objects.get_or_create(name=name)
+    ImageBlob.objects.filter(name=name).update(
+        ref_count=F('ref_count') + delta,
+        updated_at=timezone.now(),
+    )
+
+
+def retain(name, count=1):
+    """Record ``count`` more references to the stored file ``name``"""
+    _adjust(name, count)
+
+
+def release(name, count=1):
+    """Drop ``count`` references to the stored file ``name``"""
+    _adjust(name, -count)
+
+
+def recount():
+    """Rebuild every ``ImageBlob.ref_count`` from the recipes table
+
+    Soft-deleted recipes keep their references until they are purged.
+    """
+    if sharding.shards():
+        return _recount_shards()
+    names = set(
+        Recipe.all_objects.exclude(image='').exclude(image__isnull=True)
+        .values_list('image', flat=True).distinct()
+    )
+    known = set(ImageBlob.objects.values_list('name', flat=True))
+    ImageBlob.objects.bulk_create(
+        [ImageBlob(name=name) for name in names - known]
+    )
+    counts = Recipe.all_objects.filter(image=OuterRef('name')).order_by()\
+        .values('image').annotate(n=Count('*')).values('n')
+    ImageBlob.objects.update(ref_count=Coalesce(
+        Subquery(counts, output_field=IntegerField()), 0
+    ))
+
+
+def _recount_shards():
+    # Recipes on other databases cannot be counted in a subquery
+    counts = Counter()
+    for db in sharding.shards():
+        counts.update(dict(
+            Recipe.all_objects.using(db).exclude(image='')
+            .exclude(image__isnull=True).order_by().values('image')
+            .annotate(n=Count('*')).values_list('image', 'n')
+        ))
+    known = set(ImageBlob.objects.values_list('name', flat=True))
+    ImageBlob.objects.bulk_create(
+        [ImageBlob(name=name) for name in set(counts) - known]
+    )
+    ImageBlob.objects.exclude(name__in=list(counts)).update(ref_count=0)
+    for name, count in counts.items():
+        ImageBlob.objects.filter(name=name).update(ref_count=count)
+
+
+def collect_garbage(grace, dry_run=False):
+    """Delete blobs unreferenced and untouched for at least ``grace``
+
+    Returns the names of the removed files. Files in the upload and
+    staging directories without an ``ImageBlob`` row (abandoned uploads,
+    pre-dedup files) are swept as well.
+    """
+    storage = Recipe._meta.get_field('image').storage
+    cutoff = timezone.now() - grace
+
+    def is_stale(name):
+        return storage.exists(name) and \
+            storage.get_modified_time(name) < cutoff
+
+    removed = []
+    candidates = list(ImageBlob.objects.filter(
+        ref_count__lte=0, updated_at__lt=cutoff,
+    ).values_list('name', flat=True))
+    for name in candidates:
+        if storage.exists(name) and not is_stale(name):
+            continue
+        if not dry_run:
+            deleted, _ = ImageBlob.objects\
+                .filter(name=name, ref_count__lte=0).delete()
+            if not deleted:
+                continue
+            storage.delete(name)
+        removed.append(name)
+
+    known = set(ImageBlob.objects.values_list('name', flat=True))
+    for directory in (RECIPE_IMAGE_DIR, STAGING_DIR):
+        if not storage.exists(directory):
+            continue
+        for filename in storage.listdir(directory)[1]:
+            name = os.path.join(directory, filename)
+            if name in known or not is_stale(name):
+                continue
+            if not dry_run:
+                storage.delete(name)
+            removed.append(name)
+    return removed
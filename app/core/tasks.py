@@ -0,0 +1,41 @@
+"""Tasks for core.jobs, queued by the views and run by ``run_worker``."""
+import os
+from datetime import timedelta
+
+from django.core.files import File
+
+from core import deletion, jobs, sharding
+from core.models import Recipe
+
+
+@jobs.task
+def store_recipe_image(recipe_id, user_id, staged):
+    """Store the staged upload ``staged`` as the image of a recipe
+
+    Hashing and deduplication happen here instead of in the request. A
+    version conflict with a concurrent edit fails the attempt, the retry
+    reloads the recipe. The staged file goes once it is stored, or right
+    away if the recipe was deleted meanwhile.
+    """
+    storage = Recipe._meta.get_field('image').storage
+    with sharding.pinned(user_id):
+        recipe = Recipe.objects.filter(pk=recipe_id).first()
+        if recipe is not None:
+            with storage.open(staged) as fh:
+                recipe.image.save(os.path.basename(staged), File(fh),
+                                  save=False)
+            with sharding.atomic():
+                recipe.save(update_fields=['image', 'updated_at'])
+    storage.delete(staged)
+
+
+@jobs.task
+def purge_user(user_id, grace_minutes):
+    """Purge the deleted account ``user_id`` and everything it owned
+
+    Only this account's rows are looked at, so the jobs of several
+    deletions never contend for the same rows.
+    """
+    for _ in deletion.purge(timedelta(minutes=grace_minutes),
+                            user=user_id):
+        pass
@@ -0,0 +1,18 @@
+from decimal import Decimal
+
+from core import bulk
+from core.models import Recipe
+
+
+def sample_recipe(user, ingredients=None, **params):
+    """Create a recipe of ``user``, linked to ``ingredients`` if given"""
+    defaults = {
+        'title': 'Sample',
+        'time_minutes': 10,
+        'price': Decimal('5.00'),
+    }
+    defaults.update(params)
+    recipe = Recipe.objects.create(user=user, **defaults)
+    if ingredients is not None:
+        bulk.set_links(recipe, 'ingredients', ingredients)
+    return recipe
@@ -1,7 +1,16 @@
+from unittest import mock
+
+from django.db import connection
 from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from django.contrib.auth import get_user_model
 
+from core import bulk, webhooks
+from core.admin import EstimatedCountPaginator, RecipeAdmin
+from core.models import Ingredient, OutboxEvent, Recipe, Tag
+from core.tests.helpers import sample_recipe
+
 
 class AdminSiteTests(TestCase):
 
@@ -39,3 +48,141 @@ class AdminSiteTests(TestCase):
         res = self.client.get(url)
 
         self.assertEquals(res.status_code, 200)
+
+
+class LargeTableAdminTests(TestCase):
+
+    def setUp(self):
+        self.client = Client()
+        self.admin_user = get_user_model().objects.create_superuser(
+            email='admin@asdf', password='asdf',
+        )
+        self.client.force_login(self.admin_user)
+
+    def sample_recipes(self, count):
+        user = get_user_model().objects.create_user(
+            email=f'cook{count}@asdf', password='asdf',
+        )
+        return [sample_recipe(user, title=f'Recipe {i}')
+                for i in range(count)]
+
+    def test_changelist_queries_constant(self):
+        """Test listing recipes takes no query per row"""
+        url = reverse('admin:core_recipe_changelist')
+        self.sample_recipes(2)
+        with CaptureQueriesContext(connection) as few:
+            self.client.get(url)
+        self.sample_recipes(20)
+
+        with self.assertNumQueries(len(few)):
+            res = self.client.get(url)
+
+        self.assertEqual(res.status_code, 200)
+
+    def test_changelist_keyset_pages(self):
+        """Test pages continue below the last id shown"""
+        oldest, middle, newest = self.sample_recipes(3)
+        url = reverse('admin:core_recipe_changelist')
+
+        with mock.patch.object(RecipeAdmin, 'list_per_page', 2):
+            res = self.client.get(url)
+            self.assertContains(res, f'?id__lt={middle.id}')
+            self.assertNotContains(res, 'Recipe 0<')
+
+            res = self.client.get(url, {'id__lt': middle.id})
+            self.assertContains(res, 'Recipe 0<')
+            self.assertNotContains(res, 'Recipe 2<')
+
+    def test_estimated_count_for_large_tables(self):
+        """Test unfiltered changelists use the table estimate"""
+        queryset = Recipe.objects.order_by('-id')
+        with mock.patch('core.admin.estimated_count', return_value=10 ** 6):
+            self.assertEqual(
+                EstimatedCountPaginator(queryset, 10, estimate=True).count,
+                10 ** 6
+            )
+            self.assertEqual(EstimatedCountPaginator(queryset, 10).count, 0)
+        with mock.patch('core.admin.estimated_count', return_value=10):
+            self.assertEqual(
+                EstimatedCountPaginator(queryset, 10, estimate=True).count, 0
+            )
+
+    def test_recipe_form_does_not_list_all_tags(self):
+        """Test the recipe form only renders the linked tags"""
+        recipe = self.sample_recipes(1)[0]
+        linked = Tag.objects.create(user=recipe.user, name='linked')
+        Tag.objects.create(user=recipe.user, name='unlinked')
+        bulk.add_links(recipe, 'tags', [linked])
+
+        res = self.client.get(
+            reverse('admin:core_recipe_change', args=[recipe.id])
+        )
+
+        self.assertContains(res, 'linked')
+        self.assertNotContains(res, 'unlinked')
+
+    def test_inline_links_counted(self):
+        """Test inline link edits reach the counters, feed and webhooks"""
+        recipe = self.sample_recipes(1)[0]
+        webhooks.subscribe(recipe.user, 'https://partner.example/h')
+        # The form requires one
+        Recipe.objects.filter(pk=recipe.pk).update(image='uploads/a.jpg')
+        old, new, kept = [Tag.objects.create(user=recipe.user, name=name)
+                          for name in ('old', 'new', 'kept')]
+        salt = Ingredient.objects.create(user=recipe.user, name='salt')
+        bulk.add_links(recipe, 'tags', [old, kept])
+        links = list(recipe.recipetag_set.order_by('id'))
+        Tag.objects.filter(pk=kept.pk).update(recipe_count=7)
+
+        res = self.client.post(
+            reverse('admin:core_recipe_change', args=[recipe.id]), {
+                'title': recipe.title, 'time_minutes': 5, 'price': 1,
+                'user': recipe.user_id,
+                'recipetag_set-TOTAL_FORMS': 2,
+                'recipetag_set-INITIAL_FORMS': 2,
+                'recipetag_set-0-id': links[0].id,
+                'recipetag_set-0-recipe': recipe.id,
+                'recipetag_set-0-tag': new.id,
+                'recipetag_set-0-position': 0,
+                'recipetag_set-1-id': links[1].id,
+                'recipetag_set-1-recipe': recipe.id,
+                'recipetag_set-1-tag': kept.id,
+                'recipetag_set-1-position': 1,
+                'recipeingredient_set-TOTAL_FORMS': 1,
+                'recipeingredient_set-INITIAL_FORMS': 0,
+                'recipeingredient_set-0-recipe': recipe.id,
+                'recipeingredient_set-0-ingredient': salt.id,
+                'recipeingredient_set-0-position': 0,
+                'recipeingredient_set-0-quantity': '1 tsp',
+            },
+        )
+
+        self.assertEqual(res.status_code, 302)
+        counts = dict(Tag.objects.values_list('name', 'recipe_count'))
+        # A full recompute would have reset the kept tag to 1
+        self.assertEqual(counts, {'old': 0, 'new': 1, 'kept': 7})
+        salt.refresh_from_db()
+        self.assertEqual(salt.recipe_count, 1)
+        self.assertEqual(
+            list(recipe.recipetag_set.order_by('position')
+                 .values_list('tag', flat=True)),
+            [new.id, kept.id],
+        )
+        self.assertEqual(recipe.recipeingredient_set.get().quantity, '1 tsp')
+        self.assertGreater(Recipe.objects.get(pk=recipe.pk).updated_at,
+                           recipe.updated_at)
+        self.assertTrue(OutboxEvent.objects.filter(
+            model='recipe', object_id=recipe.id, action=OutboxEvent.UPDATED,
+        ).exists())
+
+    def test_delete_recipe_soft_deletes(self):
+        """Test deleting from the admin marks the recipe"""
+        recipe = self.sample_recipes(1)[0]
+        url = reverse('admin:core_recipe_delete', args=[recipe.id])
+
+        res = self.client.post(url, {'post': 'yes'})
+
+        self.assertEqual(res.status_code, 302)
+        self.assertIsNotNone(
+            Recipe.all_objects.get(pk=recipe.pk).deleted_at
+        )
@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.test import TestCase
+
+from core import benchmark
+from core.models import Recipe
+
+
+class BenchmarkHelperTests(TestCase):
+
+    def test_percentile_nearest_rank(self):
+        """Test percentiles use the nearest-rank method"""
+        values = list(range(1, 101))
+        self.assertEqual(benchmark.percentile(values, 50), 50)
+        self.assertEqual(benchmark.percentile(values, 99), 99)
+        self.assertEqual(benchmark.percentile([7], 99), 7)
+        self.assertIsNone(benchmark.percentile([], 50))
+
+    def test_compare_flags_query_regressions(self):
+        """Test that any growth in queries per request is a regression"""
+        baseline = {'client:recipe-list[10]': {
+            'queries': 2, 'p99_ms': 10, 'throughput': 100,
+        }}
+        results = {'client:recipe-list[10]': {
+            'queries': 3, 'p99_ms': 10, 'throughput': 100,
+        }}
+        regressions = benchmark.compare(results, baseline)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('queries 2 -> 3', regressions[0])
+
+    def test_compare_timings_within_tolerance(self):
+        """Test that timings only regress beyond the tolerance"""
+        baseline = {'a': {'queries': 2, 'p99_ms': 10, 'throughput': 100}}
+        ok = {'a': {'queries': 2, 'p99_ms': 14, 'throughput': 70}}
+        slow = {'a': {'queries': 2, 'p99_ms': 16, 'throughput': 60}}
+
+        self.assertEqual(benchmark.compare(ok, baseline, 0.5), [])
+        self.assertEqual(len(benchmark.compare(slow, baseline, 0.5)), 2)
+        self.assertEqual(
+            benchmark.compare(slow, baseline, 0.5, check_timings=False), []
+        )
+
+    def test_seed_user_fan_out(self):
+        """Test seeding creates recipes linked to many tags/ingredients"""
+        user = benchmark.seed_user(4)
+        recipes = Recipe.objects.filter(user=user)
+        self.assertEqual(recipes.count(), 4)
+        for recipe in recipes:
+            self.assertEqual(recipe.tags.count(), benchmark.TAGS_PER_RECIPE)
+            self.assertEqual(recipe.ingredients.count(),
+                             benchmark.INGREDIENTS_PER_RECIPE)
+
+    def test_run_scenario_reports_stats(self):
+        """Test a scenario run reports latency, throughput and queries"""
+        user = benchmark.seed_user(2)
+        driver = benchmark.ClientDriver(user)
+        scenario = [s for s in benchmark.recipe_scenarios(user)
+                    if s.name == 'recipe-detail'][0]
+
+        result = benchmark.run_scenario(driver, scenario, 5, warmup=1)
+
+        self.assertEqual(result['status'], [200])
+        self.assertEqual(result['iterations'], 5)
+        self.assertGreater(result['queries'], 0)
+        self.assertLessEqual(result['p50_ms'], result['p99_ms'])
+
+    def test_import_summary_groups_packages(self):
+        """Test import times are summed per top-level package"""
+        stderr = (
+            'import time: self [us] | cumulative | imported package\n'
+            'import time:      1500 |       1500 |     django.utils\n'
+            'import time:       700 |       2200 |   django\n'
+            'import time:      3000 |       3000 | numpy\n'
+            'Unauthorized: /api/user/me/\n'
+        )
+
+        summary = benchmark.import_summary(stderr, top=1)
+
+        self.assertEqual(list(summary.items()), [('numpy', 3.0)])
+        self.assertEqual(benchmark.import_summary(stderr)['django'], 2.2)
+
+    def test_measure_startup_boots_worker(self):
+        """Test a fresh process boots and answers its first request"""
+        boot, first_response, imports = benchmark.measure_startup(
+            settings.SETTINGS_MODULE, runs=1
+        )
+
+        self.assertEqual(first_response['status'], [401])
+        self.assertLess(boot['p50_ms'], first_response['p50_ms'])
+        self.assertGreater(boot['modules'], 0)
+        self.assertIn('django', imports)
+
+    def test_middleware_overhead_compares_stacks(self):
+        """Test both middleware stacks serve the probe request"""
+        results = benchmark.middleware_overhead(requests=3)
+
+        self.assertEqual(list(results), [
+            'middleware:user-me-anonymous[scoped]',
+            'middleware:user-me-anonymous[unscoped]',
+        ])
+        for row in results.values():
+            self.assertEqual(row['status'], [401])
@@ -0,0 +1,152 @@
+import gzip
+import json
+import unittest
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core import compression
+from core.models import Recipe
+
+
+def request(accept_encoding=None):
+    headers = {}
+    if accept_encoding is not None:
+        headers['HTTP_ACCEPT_ENCODING'] = accept_encoding
+    return RequestFactory().get('/api/recipe/recipe/', **headers)
+
+
+def json_response(size=4000):
+    return HttpResponse(json.dumps(['x' * 10] * (size // 10)),
+                        content_type='application/json')
+
+
+class CompressionTests(TestCase):
+
+    def setUp(self):
+        # Brotli is optional, tests opt into it
+        available = patch.object(compression, 'available',
+                                 lambda: ('gzip',))
+        available.start()
+        self.addCleanup(available.stop)
+
+    def test_negotiate(self):
+        """Test encodings are picked by the client's q-values"""
+        self.assertEqual(compression.negotiate(request('gzip, deflate')),
+                         'gzip')
+        self.assertEqual(compression.negotiate(request('*')), 'gzip')
+        self.assertIsNone(compression.negotiate(request('gzip;q=0')))
+        self.assertIsNone(compression.negotiate(request('identity')))
+        self.assertIsNone(compression.negotiate(request()))
+
+    @patch.object(compression, 'available', lambda: ('br', 'gzip'))
+    def test_negotiate_prefers_brotli(self):
+        """Test Brotli wins unless the client ranks gzip higher"""
+        self.assertEqual(compression.negotiate(request('gzip, br')), 'br')
+        self.assertEqual(
+            compression.negotiate(request('gzip, br;q=0.5')), 'gzip'
+        )
+
+    def test_large_json_compressed(self):
+        """Test JSON above the threshold is sent gzip encoded"""
+        response = json_response()
+        body = response.content
+
+        response = compression.compress_response(request('gzip'), response)
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(gzip.decompress(response.content), body)
+        self.assertEqual(int(response['Content-Length']),
+                         len(response.content))
+
+    def test_small_or_other_responses_untouched(self):
+        """Test small bodies and non-JSON content go out as they are"""
+        with override_settings(COMPRESS_MIN_BYTES=10 ** 6):
+            small = compression.compress_response(
+                request('gzip'), json_response()
+            )
+        html = compression.compress_response(request('gzip'), HttpResponse(
+            '<p>' * 1000, content_type='text/html',
+        ))
+
+        self.assertFalse(small.has_header('Content-Encoding'))
+        self.assertFalse(html.has_header('Content-Encoding'))
+        self.assertFalse(html.has_header('Vary'))
+
+    def test_streaming_compressed(self):
+        """Test streaming responses are compressed chunk by chunk"""
+        chunks = [b'[', b'{"id":1}', b',', b'{"id":2}', b']']
+        response = compression.compress_response(
+            request('gzip'), StreamingHttpResponse(
+                iter(chunks), content_type='application/json',
+            )
+        )
+
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(
+            gzip.decompress(b''.join(response.streaming_content)),
+            b''.join(chunks),
+        )
+
+    @unittest.skipUnless(compression.brotli(), 'brotli is not installed')
+    @patch.object(compression, 'available', lambda: ('br', 'gzip'))
+    def test_brotli(self):
+        """Test Brotli responses decode to the original body"""
+        response = json_response()
+        body = response.content
+
+        response = compression.compress_response(request('br'), response)
+
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(compression.brotli().decompress(response.content),
+                         body)
+
+
+@override_settings(COMPRESS_MIN_BYTES=100)
+class CachedCompressionTests(TestCase):
+
+    def setUp(self):
+        available = patch.object(compression, 'available',
+                                 lambda: ('gzip',))
+        available.start()
+        self.addCleanup(available.stop)
+        caches['snapshots'].clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'asdf@asdf', 'asdf', recipe_list_snapshot=True,
+        )
+        self.client.force_authenticate(self.user)
+        for n in range(10):
+            Recipe.objects.create(user=self.user, title=f'Recipe {n}',
+                                  time_minutes=10, price=5)
+
+    def test_list_compressed_by_middleware(self):
+        """Test the recipe list is compressed on its way out"""
+        self.user.recipe_list_snapshot = False
+        self.user.save()
+        url = reverse('recipe:recipe-list')
+
+        res = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(res['Content-Encoding'], 'gzip')
+        self.assertEqual(len(json.loads(gzip.decompress(res.content))), 10)
+
+    def test_snapshot_compressed_once(self):
+        """Test a snapshot's compressed body is reused from the cache"""
+        url = reverse('recipe:recipe-list')
+        plain = self.client.get(url).content
+
+        with patch.object(compression, 'compress',
+                          wraps=compression.compress) as compress:
+            first = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+            second = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip')
+
+        self.assertEqual(compress.call_count, 1)
+        self.assertEqual(first['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(second.content), plain)
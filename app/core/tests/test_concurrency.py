@@ -0,0 +1,76 @@
+import threading
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, \
+    override_settings
+from django.test.utils import CaptureQueriesContext
+
+from core import concurrency, sync
+from core.models import Tag
+from core.tests.helpers import sample_recipe
+
+
+def current_thread():
+    return threading.current_thread().name
+
+
+class ParallelTests(SimpleTestCase):
+
+    def tearDown(self):
+        concurrency.shutdown()
+
+    def test_results_keep_call_order(self):
+        """Test results come back in the order the callables were given"""
+        results = concurrency.parallel(lambda: 1, lambda: 2, lambda: 3)
+        self.assertEqual(results, [1, 2, 3])
+
+    def test_runs_on_worker_threads(self):
+        """Test all but the first callable run on the executor"""
+        names = concurrency.parallel(current_thread, current_thread)
+
+        self.assertEqual(names[0], current_thread())
+        self.assertTrue(names[1].startswith('orm'))
+
+    @override_settings(ORM_EXECUTOR_WORKERS=0)
+    def test_disabled_pool_runs_inline(self):
+        """Test a zero sized pool runs everything on the caller thread"""
+        names = concurrency.parallel(current_thread, current_thread)
+        self.assertEqual(names, [current_thread()] * 2)
+
+    def test_captured_queries_run_inline(self):
+        """Test counted queries all stay on the counted connection"""
+        with CaptureQueriesContext(connection):
+            names = concurrency.parallel(current_thread, current_thread)
+        self.assertEqual(names, [current_thread()] * 2)
+
+
+class ParallelTransactionTests(TestCase):
+
+    def test_atomic_block_runs_inline(self):
+        """Test callables stay on the caller's connection in a transaction"""
+        names = concurrency.parallel(current_thread, current_thread)
+        self.assertEqual(names, [current_thread()] * 2)
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class ParallelQueryTests(TransactionTestCase):
+
+    def tearDown(self):
+        concurrency.shutdown()
+
+    def test_sync_streams_read_concurrently(self):
+        """Test the sync feed reads its streams on worker connections"""
+        user = get_user_model().objects.create_user('asdf@asdf', 'asdf')
+        tag = Tag.objects.create(user=user, name='vegan')
+        recipe = sample_recipe(user)
+
+        with mock.patch.object(concurrency, '_run',
+                               wraps=concurrency._run) as run:
+            batch, _, _ = sync.changes(user)
+
+        self.assertEqual(batch['recipes'], [recipe])
+        self.assertEqual(batch['tags'], [tag])
+        # All but the first stream went to the executor
+        self.assertEqual(run.call_count, 3)
@@ -0,0 +1,155 @@
+import threading
+import unittest
+from datetime import timedelta
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from core import bulk, deletion, jobs
+from core.models import ImageBlob, Ingredient, Job, OutboxEvent, Recipe, \
+    RecipeStats, Tag, Tombstone
+from core.tests.helpers import sample_recipe
+
+
+class SoftDeleteTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('asdf@asdf', 'asdf')
+        self.tag = Tag.objects.create(user=self.user, name='tag')
+
+    def test_delete_recipe_hides_and_accounts(self):
+        """Test a soft-deleted recipe is hidden and no longer counted"""
+        recipe = sample_recipe(self.user, image='uploads/recipe/a.jpg')
+        bulk.add_links(recipe, 'tags', [self.tag])
+        sample_recipe(self.user, time_minutes=20)
+
+        deletion.delete_recipe(recipe)
+
+        self.assertFalse(Recipe.objects.filter(pk=recipe.pk).exists())
+        self.assertTrue(Recipe.all_objects.filter(pk=recipe.pk).exists())
+        stats = RecipeStats.objects.get(user=self.user)
+        self.assertEqual(stats.recipe_count, 1)
+        self.assertEqual(stats.time_minutes_min, 20)
+        self.tag.refresh_from_db()
+        self.assertEqual(self.tag.recipe_count, 0)
+        self.assertTrue(Tombstone.objects.filter(
+            model='recipe', object_id=recipe.pk
+        ).exists())
+        self.assertEqual(
+            ImageBlob.objects.get(name='uploads/recipe/a.jpg').ref_count, 1
+        )
+
+    def test_purge_removes_recipe_once(self):
+        """Test purging does not account for a soft-deleted recipe again"""
+        recipe = sample_recipe(self.user, image='uploads/recipe/a.jpg')
+        bulk.add_links(recipe, 'tags', [self.tag])
+        copy = sample_recipe(self.user, copied_from=recipe)
+        deletion.delete_recipe(recipe)
+
+        removed = list(deletion.purge(timedelta(0)))
+
+        self.assertEqual(removed, [('recipe', 1)])
+        self.assertFalse(Recipe.all_objects.filter(pk=recipe.pk).exists())
+        self.assertFalse(Recipe.tags.through.objects.exists())
+        self.assertEqual(
+            ImageBlob.objects.get(name='uploads/recipe/a.jpg').ref_count, 0
+        )
+        self.assertEqual(RecipeStats.objects.get(user=self.user).recipe_count,
+                         1)
+        self.assertEqual(Tombstone.objects.count(), 1)
+        copy.refresh_from_db()
+        self.assertIsNone(copy.copied_from)
+
+    def test_purge_waits_for_grace(self):
+        """Test recently deleted rows are kept"""
+        deletion.delete_recipe(sample_recipe(self.user))
+
+        self.assertEqual(list(deletion.purge(timedelta(hours=1))), [])
+        self.assertEqual(Recipe.all_objects.count(), 1)
+
+    @unittest.skipUnless(connection.features.has_select_for_update_skip_locked,
+                         'the database cannot skip locked rows')
+    def test_purge_locks_its_batch(self):
+        """Test concurrent purges skip each other's batches"""
+        deletion.delete_recipe(sample_recipe(self.user))
+
+        with CaptureQueriesContext(connection) as ctx:
+            list(deletion.purge(timedelta(0)))
+
+        self.assertTrue(any('SKIP LOCKED' in query['sql']
+                            for query in ctx.captured_queries))
+
+    def test_delete_user_then_purge_in_batches(self):
+        """Test a deleted account is hidden, then purged batch by batch"""
+        ingredient = Ingredient.objects.create(user=self.user, name='salt')
+        for i in range(5):
+            recipe = sample_recipe(self.user)
+            bulk.add_links(recipe, 'tags', [self.tag])
+            bulk.add_links(recipe, 'ingredients', [ingredient])
+        Token.objects.create(user=self.user)
+        Tombstone.objects.create(user=self.user, model='recipe', object_id=1)
+        for _ in range(3):
+            OutboxEvent.objects.create(user=self.user, model='recipe',
+                                       object_id=1,
+                                       action=OutboxEvent.CREATED)
+        other = get_user_model().objects.create_user('other@asdf', 'asdf')
+        kept = sample_recipe(other)
+
+        deletion.delete_user(self.user)
+
+        self.assertFalse(self.user.is_active)
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+        self.assertEqual(list(Recipe.objects.all()), [kept])
+        self.assertFalse(Tag.objects.exists())
+        job = Job.objects.get()
+        self.assertEqual(job.name, 'core.tasks.purge_user')
+        self.assertGreater(job.run_at, timezone.now())
+
+        removed = list(deletion.purge(timedelta(0), batch_size=2))
+
+        self.assertEqual(removed[:6], [
+            ('recipe', 2), ('recipe', 2), ('recipe', 1),
+            ('tag', 1), ('ingredient', 1), ('tombstone', 1),
+        ])
+        # The outbox events go in batches too, before the user row
+        self.assertEqual({row for row in removed[6:-1]},
+                         {('outboxevent', 2), ('outboxevent', 1)})
+        self.assertEqual(removed[-1], ('user', 1))
+        self.assertFalse(OutboxEvent.objects.filter(user=self.user).exists())
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
+        self.assertEqual(list(Recipe.all_objects.all()), [kept])
+        self.assertFalse(Recipe.ingredients.through.objects.exists())
+
+    def test_purge_user_job(self):
+        """Test the job of a deleted account purges only that account"""
+        other = get_user_model().objects.create_user('other@asdf', 'asdf')
+        deletion.delete_recipe(sample_recipe(other))
+        sample_recipe(self.user)
+
+        with self.settings(PURGE_GRACE_MINUTES=0):
+            deletion.delete_user(self.user)
+        jobs.work('test', threading.Event(), drain=True)
+
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+        self.assertFalse(
+            get_user_model().objects.filter(pk=self.user.pk).exists()
+        )
+        self.assertEqual(Recipe.all_objects.get().user, other)
+
+    def test_purge_deleted_command(self):
+        """Test the command reports what it purged"""
+        deletion.delete_recipe(sample_recipe(self.user))
+        out = StringIO()
+
+        call_command('purge_deleted', '--grace-minutes=0', stdout=out)
+
+        self.assertIn('Purged 1 recipes', out.getvalue())
+        self.assertFalse(Recipe.all_objects.exists())
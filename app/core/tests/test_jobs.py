@@ -0,0 +1,185 @@
+import threading
+import unittest
+from datetime import timedelta
+from io import StringIO
+
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core import jobs
+from core.models import Job
+
+calls = []
+
+
+@jobs.task
+def record(*args, **kwargs):
+    calls.append((args, kwargs))
+
+
+@jobs.task(max_attempts=2)
+def explode():
+    raise ValueError('boom')
+
+
+def drain(worker='test'):
+    return jobs.work(worker, threading.Event(), drain=True)
+
+
+class JobTests(TestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_enqueue_and_run(self):
+        """Test a queued call runs once with its arguments"""
+        job = jobs.enqueue(record, args=(1, 'a'), kwargs={'b': [2]})
+
+        self.assertEqual(job.name, 'core.tests.test_jobs.record')
+        self.assertEqual(drain(), 1)
+        self.assertEqual(drain(), 0)
+
+        self.assertEqual(calls, [((1, 'a'), {'b': [2]})])
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.DONE)
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.finished_at)
+
+    def test_enqueue_unknown_task(self):
+        with self.assertRaises(LookupError):
+            jobs.enqueue('core.tests.test_jobs.missing')
+
+    def test_delayed_job_waits(self):
+        job = jobs.enqueue(record, delay=60)
+
+        self.assertEqual(drain(), 0)
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        self.assertEqual(drain(), 1)
+
+    def test_claimed_job_not_handed_out_again(self):
+        job = jobs.enqueue(record)
+
+        self.assertEqual(jobs.claim('a'), [job])
+        self.assertEqual(jobs.claim('b'), [])
+        self.assertEqual(Job.objects.get(pk=job.pk).worker, 'a')
+
+    @unittest.skipUnless(connection.features.has_select_for_update_skip_locked,
+                         'the database cannot skip locked rows')
+    def test_claim_skips_locked_rows(self):
+        jobs.enqueue(record)
+
+        with CaptureQueriesContext(connection) as ctx:
+            jobs.claim('a')
+
+        self.assertTrue(any('SKIP LOCKED' in query['sql']
+                            for query in ctx.captured_queries))
+
+    @override_settings(JOB_RETRY_DELAY=10, JOB_RETRY_MAX_DELAY=30)
+    def test_failed_job_retried_with_backoff(self):
+        """Test failures are retried later, then given up on"""
+        job = jobs.enqueue(explode)
+        self.assertEqual(job.max_attempts, 2)
+
+        before = timezone.now()
+        drain()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.QUEUED)
+        self.assertGreaterEqual(job.run_at, before + timedelta(seconds=10))
+        self.assertIn('ValueError: boom', job.last_error)
+
+        self.assertEqual(drain(), 0)
+        Job.objects.filter(pk=job.pk).update(run_at=timezone.now())
+        drain()
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.attempts, 2)
+        self.assertEqual([jobs.backoff(n) for n in (1, 2, 3)], [10, 20, 30])
+
+    def test_requeue_stale(self):
+        """Test jobs of a vanished worker are queued again or failed"""
+        retry, used_up = jobs.enqueue(record), jobs.enqueue(explode)
+        jobs.claim('gone', limit=2)
+        Job.objects.filter(pk=used_up.pk).update(attempts=2)
+
+        self.assertEqual(jobs.requeue_stale(lease=60), 0)
+        self.assertEqual(jobs.requeue_stale(lease=-1), 2)
+
+        self.assertEqual(Job.objects.get(pk=retry.pk).status, Job.QUEUED)
+        self.assertEqual(Job.objects.get(pk=used_up.pk).status, Job.FAILED)
+
+    def test_heartbeat_keeps_long_job(self):
+        """Test a job running past the lease is kept while renewed"""
+        job = jobs.enqueue(record)
+        jobs.claim('busy')
+        long_ago = timezone.now() - timedelta(hours=1)
+        Job.objects.filter(pk=job.pk).update(started_at=long_ago,
+                                             heartbeat_at=long_ago)
+
+        self.assertEqual(jobs.heartbeat(['busy', 'other']), 1)
+        self.assertEqual(jobs.requeue_stale(lease=60), 0)
+        self.assertEqual(Job.objects.get(pk=job.pk).status, Job.RUNNING)
+
+        Job.objects.filter(pk=job.pk).update(heartbeat_at=long_ago)
+        self.assertEqual(jobs.requeue_stale(lease=60), 1)
+
+    def test_prune(self):
+        jobs.enqueue(record)
+        drain()
+
+        self.assertEqual(jobs.prune(keep=60), 0)
+        self.assertEqual(jobs.prune(keep=-1), 1)
+        self.assertFalse(Job.objects.exists())
+
+    def test_metrics(self):
+        for _ in range(2):
+            jobs.enqueue(record)
+        jobs.enqueue(explode)
+        drain()
+        jobs.enqueue(record, delay=60)
+
+        stats = jobs.metrics()
+
+        self.assertEqual(stats['core.tests.test_jobs.record']['done'], 2)
+        self.assertEqual(stats['core.tests.test_jobs.record']['queued'], 1)
+        self.assertGreaterEqual(
+            stats['core.tests.test_jobs.record']['runtime'], 0
+        )
+        self.assertEqual(stats['core.tests.test_jobs.explode']['queued'], 1)
+        self.assertEqual(stats['core.tests.test_jobs.explode']['retries'], 0)
+
+        out = StringIO()
+        call_command('run_worker', metrics=True, stdout=out)
+        self.assertIn('core.tests.test_jobs.explode\t1\t0\t0\t0',
+                      out.getvalue())
+
+
+class WorkerTests(TransactionTestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def run_worker(self, threads):
+        for n in range(10):
+            jobs.enqueue(record, args=(n,))
+
+        out = StringIO()
+        call_command('run_worker', threads=threads, drain=True, poll=0.01,
+                     stdout=out)
+
+        self.assertIn('Ran 10 jobs', out.getvalue())
+        self.assertEqual(sorted(args[0] for args, _ in calls),
+                         list(range(10)))
+        self.assertEqual(Job.objects.filter(status=Job.DONE).count(), 10)
+
+    def test_run_worker_drains_queue(self):
+        """Test the worker runs every due job once"""
+        self.run_worker(threads=1)
+
+    @unittest.skipIf(connection.vendor == 'sqlite',
+                     'SQLite locks the table against concurrent writers')
+    def test_run_worker_threads(self):
+        """Test worker threads split the jobs without running any twice"""
+        self.run_worker(threads=4)
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.test import Client, TestCase
+from django.urls import reverse
+
+from core import middleware
+
+
+class PathScopedMiddlewareTests(TestCase):
+
+    def test_api_skips_scoped_middleware(self):
+        """Test API requests get no session or messages"""
+        res = self.client.get(reverse('user:me'))
+
+        self.assertEqual(res.status_code, 401)
+        for attr in ('session', '_messages'):
+            self.assertFalse(hasattr(res.wsgi_request, attr))
+
+    def test_admin_keeps_scoped_middleware(self):
+        """Test the admin still gets sessions and a user"""
+        res = self.client.get(reverse('admin:login'))
+
+        self.assertEqual(res.status_code, 200)
+        self.assertTrue(hasattr(res.wsgi_request, 'session'))
+        self.assertTrue(res.wsgi_request.user.is_anonymous)
+
+    def test_admin_checks_csrf(self):
+        """Test process_view hooks of the scoped chain still run"""
+        client = Client(enforce_csrf_checks=True)
+
+        res = client.post(reverse('admin:login'), {'username': 'x'})
+
+        self.assertEqual(res.status_code, 403)
+
+    def test_unscoped_inlines_chain(self):
+        """Test the scoped chain can be spelled out for comparison"""
+        stack = middleware.unscoped(settings.MIDDLEWARE)
+
+        self.assertNotIn('core.middleware.PathScopedMiddleware', stack)
+        for path in settings.SCOPED_MIDDLEWARE:
+            self.assertIn(path, stack)
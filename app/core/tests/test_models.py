@@ -64,6 +64,29 @@ class ModelTests(TestCase):
         )
         self.assertEqual(str(recipe), recipe.title)
 
+    def test_recipe_link_manager(self):
+        """Test add/remove/set work on the links despite the through model"""
+        user = sample_user()
+        recipe = models.Recipe.objects.create(
+            user=user, title='asdf', price=5.00, time_minutes=5,
+        )
+        vegan, quick, cheap = [
+            models.Tag.objects.create(user=user, name=name)
+            for name in ('vegan', 'quick', 'cheap')
+        ]
+
+        recipe.tags.add(vegan, quick.pk)
+        recipe.tags.remove(vegan)
+        recipe.tags.set([quick, cheap])
+
+        self.assertEqual(
+            list(recipe.recipetag_set.order_by('position')
+                 .values_list('tag', flat=True)),
+            [quick.id, cheap.id],
+        )
+        counts = dict(models.Tag.objects.values_list('name', 'recipe_count'))
+        self.assertEqual(counts, {'vegan': 0, 'quick': 1, 'cheap': 1})
+
     @patch('uuid.uuid4')
     def test_recipe_filename_uuid(self, mock_uuid):
         uuid = 'test'
@@ -0,0 +1,80 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+
+from core import names
+from core.models import Ingredient, Tag
+
+
+class NameDictionaryTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('asdf@asdf', 'asdf')
+        names.clear()
+
+    def test_lookup(self):
+        """Test names are found by id and unknown ids are not"""
+        dictionary = names.NameDictionary(0, [(2, 'salt'), (7, 'pepper')])
+
+        self.assertEqual(len(dictionary), 2)
+        self.assertEqual(dictionary.get(2), 'salt')
+        self.assertEqual(dictionary.get(7), 'pepper')
+        self.assertIsNone(dictionary.get(5))
+        self.assertIsNone(dictionary.get(8))
+
+    def test_cached_until_version_changes(self):
+        """Test dictionaries are reused until a tag changes"""
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        self.user.refresh_from_db()
+        first = names.get(Tag, self.user)
+
+        with self.assertNumQueries(0):
+            self.assertIs(names.get(Tag, self.user), first)
+
+        tag.name = 'vegetarian'
+        tag.save()
+        self.user.refresh_from_db()
+        self.assertEqual(names.get(Tag, self.user).get(tag.id), 'vegetarian')
+
+    def test_delete_bumps_version(self):
+        """Test deleting an ingredient invalidates the dictionaries"""
+        ingredient = Ingredient.objects.create(user=self.user, name='salt')
+        self.user.refresh_from_db()
+        version = self.user.names_version
+
+        ingredient.delete()
+
+        self.user.refresh_from_db()
+        self.assertGreater(self.user.names_version, version)
+
+    def test_expand_reads_unknown_ids(self):
+        """Test ids created after the dictionary was built still expand"""
+        old = Tag.objects.create(user=self.user, name='old')
+        self.user.refresh_from_db()
+        names.get(Tag, self.user)
+        new = Tag.objects.create(user=self.user, name='new')
+
+        self.assertEqual(names.expand(Tag, self.user, [new.id, old.id]), [
+            {'id': new.id, 'name': 'new'},
+            {'id': old.id, 'name': 'old'},
+        ])
+
+    def test_expand_skips_other_users(self):
+        other = get_user_model().objects.create_user('other@asdf', 'asdf')
+        theirs = Tag.objects.create(user=other, name='secret')
+        mine = Tag.objects.create(user=self.user, name='mine')
+        self.user.refresh_from_db()
+
+        self.assertEqual(
+            names.expand(Tag, self.user, [theirs.id, mine.id]),
+            [{'id': mine.id, 'name': 'mine'}],
+        )
+
+    def test_smaller_than_separate_strings(self):
+        """Test a dictionary is far smaller than a list of names"""
+        rows = [(i, f'ingredient {i}') for i in range(10000)]
+        dictionary = names.NameDictionary(0, rows)
+
+        plain = sum(sys.getsizeof(name) for _, name in rows)
+        self.assertLess(dictionary.nbytes, plain / 2)
@@ -0,0 +1,77 @@
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from django.apps import apps
+from django.db import connection
+from django.test import TestCase, override_settings
+
+from core import partitioning
+
+
+def qn(name):
+    return f'"{name}"'
+
+
+class PartitioningTests(TestCase):
+
+    def test_partitioned_tables(self):
+        """Test recipe tables are keyed on the user, link tables on recipes"""
+        tables = dict(partitioning.partitioned_tables(apps))
+
+        self.assertEqual(tables['core_recipe'], 'user_id')
+        self.assertEqual(tables['core_tag'], 'user_id')
+        self.assertEqual(tables['core_recipe_tags'], 'recipe_id')
+        self.assertEqual(tables['core_recipe_ingredients'], 'recipe_id')
+
+    def test_partition_sql(self):
+        """Test a table is rebuilt as hash partitions with its constraints"""
+        statements = partitioning.partition_sql(
+            'core_tag', 'user_id', 2, 'public.core_tag_id_seq',
+            [('core_tag_user_fk', 'FOREIGN KEY (user_id) '
+              'REFERENCES core_user(id) DEFERRABLE INITIALLY DEFERRED')],
+            ['CREATE INDEX core_tag_user_idx ON public.core_tag '
+             'USING btree (user_id)'],
+            qn,
+        )
+
+        self.assertEqual(statements, [
+            'ALTER TABLE "core_tag" RENAME TO "core_tag_unpartitioned"',
+            'CREATE TABLE "core_tag" (LIKE "core_tag_unpartitioned" '
+            'INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+            'PARTITION BY HASH ("user_id")',
+            'CREATE TABLE "core_tag_p0" PARTITION OF "core_tag" '
+            'FOR VALUES WITH (MODULUS 2, REMAINDER 0)',
+            'CREATE TABLE "core_tag_p1" PARTITION OF "core_tag" '
+            'FOR VALUES WITH (MODULUS 2, REMAINDER 1)',
+            'INSERT INTO "core_tag" SELECT * FROM "core_tag_unpartitioned"',
+            'ALTER SEQUENCE public.core_tag_id_seq OWNED BY "core_tag"."id"',
+            'DROP TABLE "core_tag_unpartitioned"',
+            'ALTER TABLE "core_tag" ADD PRIMARY KEY ("id", "user_id")',
+            'ALTER TABLE "core_tag" ADD CONSTRAINT "core_tag_user_fk" '
+            'FOREIGN KEY (user_id) REFERENCES core_user(id) '
+            'DEFERRABLE INITIALLY DEFERRED',
+            'CREATE INDEX core_tag_user_idx ON public.core_tag '
+            'USING btree (user_id)',
+        ])
+
+    def test_drop_references_sql(self):
+        """Test foreign keys into partitioned tables are dropped"""
+        self.assertEqual(
+            partitioning.drop_references_sql(
+                [('core_recipe_tags', 'core_recipe_tags_recipe_fk')], qn,
+            ),
+            ['ALTER TABLE "core_recipe_tags" '
+             'DROP CONSTRAINT "core_recipe_tags_recipe_fk"'],
+        )
+
+    @override_settings(RECIPE_PARTITIONS=4)
+    def test_other_databases_untouched(self):
+        """Test the migration leaves databases other than PostgreSQL alone"""
+        editor = SimpleNamespace(connection=SimpleNamespace(
+            vendor='sqlite', cursor=connection.cursor,
+        ))
+
+        with patch.object(partitioning, 'partitioned_tables') as tables:
+            partitioning.partition_tables(apps, editor)
+
+        tables.assert_not_called()
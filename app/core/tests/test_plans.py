@@ -0,0 +1,111 @@
+from django.test import TestCase
+
+from core import benchmark, plans
+
+
+def scan(node, relation, index=None, rows=None):
+    return plans._node(node, relation, index, rows)
+
+
+class PlanParsingTests(TestCase):
+
+    def test_postgres_scans(self):
+        """Test scans are collected from a PostgreSQL JSON plan"""
+        plan = {'Node Type': 'Nested Loop', 'Plans': [
+            {'Node Type': 'Index Scan', 'Relation Name': 'core_recipe',
+             'Index Name': 'core_recipe_user_sync_idx', 'Plan Rows': 12,
+             'Index Cond': '(user_id = 1)'},
+            {'Node Type': 'Index Scan', 'Relation Name': 'core_tag',
+             'Index Name': 'core_tag_pkey', 'Plan Rows': 3000},
+            {'Node Type': 'Seq Scan', 'Relation Name': 'core_user',
+             'Plan Rows': 1},
+        ]}
+
+        self.assertEqual(plans.postgres_scans(plan), [
+            scan('Index Scan', 'core_recipe', 'core_recipe_user_sync_idx', 12),
+            scan('Full Index Scan', 'core_tag', 'core_tag_pkey', 3000),
+            scan('Seq Scan', 'core_user', None, 1),
+        ])
+
+    def test_sqlite_scans(self):
+        """Test scans are read from SQLite's plan details"""
+        details = [
+            'SEARCH core_recipe USING INDEX core_recipe_user_sync_idx '
+            '(user_id=? AND updated_at>?)',
+            'SEARCH U0 USING INTEGER PRIMARY KEY (rowid=?)',
+            'SCAN core_tag',
+            'SCAN core_ingredient USING COVERING INDEX core_ingr_user_idx',
+            'USE TEMP B-TREE FOR ORDER BY',
+        ]
+
+        self.assertEqual(plans.sqlite_scans(details, {'U0': 'core_recipe'}), [
+            scan('Index Scan', 'core_recipe', 'core_recipe_user_sync_idx'),
+            scan('Index Scan', 'core_recipe', 'PRIMARY KEY'),
+            scan('Seq Scan', 'core_tag'),
+            scan('Full Index Scan', 'core_ingredient', 'core_ingr_user_idx'),
+        ])
+
+
+class PlanViolationTests(TestCase):
+
+    def plans(self, *scans):
+        return {'recipe-list': [{'sql': 'SELECT 1', 'scans': list(scans)}]}
+
+    def test_full_scans_of_large_tables(self):
+        """Test only large tables must not be read in full"""
+        problems = plans.violations(self.plans(
+            scan('Seq Scan', 'core_recipe'),
+            scan('Seq Scan', 'core_user'),
+        ))
+
+        self.assertEqual(len(problems), 1)
+        self.assertIn('Seq Scan on core_recipe', problems[0])
+
+    def test_changed_plan(self):
+        """Test a different index than expected is a regression"""
+        expected = plans.expectations(self.plans(
+            scan('Index Scan', 'core_recipe', 'core_recipe_user_sync_idx'),
+        ))
+
+        problems = plans.violations(self.plans(
+            scan('Index Scan', 'core_recipe', 'core_recipe_user_id_idx'),
+        ), expected)
+
+        self.assertEqual(len(problems), 1)
+        self.assertIn('plan changed', problems[0])
+
+    def test_row_estimates(self):
+        """Test row estimates may only grow within the tolerance"""
+        expected = plans.expectations(self.plans(
+            scan('Index Scan', 'core_recipe', 'core_recipe_pkey', 50),
+        ))
+
+        within = plans.violations(self.plans(
+            scan('Index Scan', 'core_recipe', 'core_recipe_pkey', 400),
+        ), expected)
+        beyond = plans.violations(self.plans(
+            scan('Index Scan', 'core_recipe', 'core_recipe_pkey', 600),
+        ), expected)
+
+        self.assertEqual(within, [])
+        self.assertEqual(len(beyond), 1)
+
+
+class EndpointPlanTests(TestCase):
+
+    def test_recipe_reads_use_indexes(self):
+        """Test the recipe read endpoints read no large table in full"""
+        user = benchmark.seed_user(20)
+        scenarios = [
+            scenario for scenario in benchmark.recipe_scenarios(user)
+            if scenario.name in ('tag-list', 'recipe-list', 'recipe-sync',
+                                 'recipe-similar', 'recipe-shopping-list')
+        ]
+
+        captured = plans.capture_plans(
+            benchmark.ClientDriver(user), scenarios
+        )
+
+        self.assertEqual(len(captured), 5)
+        self.assertTrue(all(captured.values()))
+        self.assertEqual(plans.violations(captured), [])
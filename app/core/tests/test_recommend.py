@@ -0,0 +1,93 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from core import bulk, deletion, recommend
+from core.models import Ingredient, Recipe, Tag
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class RecipeIndexTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('asdf@asdf', 'asdf')
+        self.ingredients = [
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('egg', 'flour', 'milk', 'sugar', 'salt')
+        ]
+        recommend.clear()
+
+    def recipe(self, *ingredients, tags=()):
+        recipe = Recipe.objects.create(
+            user=self.user, title='Sample', time_minutes=10, price=5
+        )
+        bulk.set_links(recipe, 'ingredients',
+                       [self.ingredients[i] for i in ingredients])
+        bulk.set_links(recipe, 'tags', tags)
+        return recipe
+
+    def test_similar_ranks_by_overlap(self):
+        """Test recipes sharing more ingredients and tags rank higher"""
+        vegan = Tag.objects.create(user=self.user, name='vegan')
+        pancake = self.recipe(0, 1, 2, tags=[vegan])
+        crepe = self.recipe(0, 1, 2, 3)
+        bread = self.recipe(1, 4, tags=[vegan])
+        self.recipe(3)
+
+        index = recommend.get_index(self.user)
+
+        self.assertEqual(index.similar(pancake.id), [
+            (crepe.id, 3 / 5), (bread.id, 2 / 5),
+        ])
+        self.assertEqual(index.similar(pancake.id, limit=1),
+                         [(crepe.id, 3 / 5)])
+        self.assertAlmostEqual(
+            index.similar(pancake.id, metric='cosine')[0][1], 3 / 4
+        )
+
+    def test_cookable_prefers_fewest_missing(self):
+        """Test recipes missing fewer ingredients come first"""
+        omelette = self.recipe(0, 4)
+        pancake = self.recipe(0, 1, 2)
+        cake = self.recipe(0, 1, 2, 3)
+        self.recipe(3)
+
+        ranked = recommend.get_index(self.user).cookable(
+            [self.ingredients[i].id for i in (0, 1, 2)]
+        )
+
+        self.assertEqual(ranked, [
+            (pancake.id, 0, 1.0), (cake.id, 1, 0.75), (omelette.id, 1, 0.5),
+        ])
+
+    def test_cookable_ignores_ids_out_of_range(self):
+        """Test ids int32 cannot hold do not wrap around to real ones"""
+        self.recipe(0)
+        egg = self.ingredients[0].id
+
+        self.assertEqual(recommend.get_index(self.user).cookable(
+            [2 ** 32 + egg, -(2 ** 32) + egg, 2 ** 70]
+        ), [])
+
+    def test_cached_until_recipes_change(self):
+        """Test the index is reused and patched with changed recipes only"""
+        recipes = [self.recipe(i % 5, (i + 1) % 5) for i in range(20)]
+        index = recommend.get_index(self.user)
+        with self.assertNumQueries(1):
+            self.assertIs(recommend.get_index(self.user), index)
+
+        bulk.set_links(recipes[0], 'ingredients', [self.ingredients[4]])
+        recipes[0].save()
+        deletion.delete_recipe(recipes[1])
+        fresh = self.recipe(0, 1)
+        with mock.patch.object(recommend.RecipeIndex, 'build') as build:
+            index = recommend.get_index(self.user)
+            build.assert_not_called()
+
+        cookable = [row[0] for row in index.cookable(
+            [self.ingredients[4].id], limit=100
+        )]
+        self.assertIn(recipes[0].id, cookable)
+        self.assertNotIn(recipes[1].id, index.recipe_ids)
+        self.assertEqual(index.similar(fresh.id)[0], (recipes[5].id, 1.0))
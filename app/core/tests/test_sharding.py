@@ -0,0 +1,187 @@
+import unittest
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from core import deletion, sharding
+from core.models import Ingredient, Recipe, RecipeStats, Tag, User
+
+RECIPES_URL = reverse('recipe:recipe-list')
+TAGS_URL = reverse('recipe:tag-list')
+STATS_URL = reverse('recipe:stats')
+
+
+@override_settings(RECIPE_SHARDS=['shard_a', 'shard_b', 'shard_c'])
+class RouterTests(TestCase):
+
+    def setUp(self):
+        self.router = sharding.UserShardRouter()
+
+    def test_shard_for(self):
+        """Test users map to shards by their id"""
+        self.assertEqual(sharding.shard_for(3), 'shard_a')
+        self.assertEqual(sharding.shard_for(User(pk=5)), 'shard_c')
+        with override_settings(RECIPE_SHARDS=[]):
+            self.assertEqual(sharding.shard_for(5), 'default')
+
+    def test_is_sharded(self):
+        """Test recipe data and its link tables are sharded, users are not"""
+        self.assertTrue(sharding.is_sharded(Recipe))
+        self.assertTrue(sharding.is_sharded(Recipe.tags.through))
+        self.assertTrue(sharding.is_sharded(RecipeStats))
+        self.assertFalse(sharding.is_sharded(User))
+        self.assertFalse(sharding.is_sharded(Token))
+
+    def test_routes_by_instance(self):
+        """Test rows go to the shard of their user"""
+        self.assertEqual(
+            self.router.db_for_write(Recipe, instance=Recipe(user_id=4)),
+            'shard_b',
+        )
+        self.assertEqual(
+            self.router.db_for_read(Tag, instance=User(pk=6)), 'shard_a',
+        )
+        self.assertEqual(
+            self.router.db_for_read(User, instance=Recipe(user_id=4)),
+            'default',
+        )
+
+    def test_routes_by_pin(self):
+        """Test queries without a row go to the pinned shard"""
+        self.assertIsNone(self.router.db_for_read(Ingredient))
+
+        with sharding.pinned(5):
+            with sharding.using('shard_a'):
+                self.assertEqual(self.router.db_for_read(Recipe), 'shard_a')
+            self.assertEqual(self.router.db_for_read(Recipe), 'shard_c')
+            self.assertEqual(self.router.db_for_read(User), 'default')
+
+        self.assertIsNone(sharding.current())
+
+
+@unittest.skipUnless(len(settings.RECIPE_SHARDS) >= 2,
+                     'run with --settings app.settings_shards')
+class ShardedApiTests(TestCase):
+    multi_db = True
+
+    def setUp(self):
+        self.users = [
+            get_user_model().objects.create_user(f'user{n}@asdf', 'asdf')
+            for n in range(2)
+        ]
+        if sharding.shard_for(self.users[0]) == \
+                sharding.shard_for(self.users[1]):
+            self.users[1] = get_user_model().objects.create_user(
+                'user2@asdf', 'asdf',
+            )
+
+    def client_for(self, user):
+        client = APIClient()
+        token = Token.objects.create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def create_recipe(self, client, title):
+        tag = client.post(TAGS_URL, {'name': f'{title} tag'}).json()
+        res = client.post(RECIPES_URL, {
+            'title': title, 'time_minutes': 10, 'price': '5.00',
+            'tags': [tag['id']],
+        })
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.json()
+
+    def test_user_mirrored(self):
+        """Test user rows are copied into their shard"""
+        user = self.users[0]
+        user.name = 'Renamed'
+        user.save()
+
+        mirror = User.objects.using(sharding.shard_for(user)).get(pk=user.pk)
+
+        self.assertEqual(mirror.email, user.email)
+        self.assertEqual(mirror.name, 'Renamed')
+
+    def test_recipes_stored_in_users_shard(self):
+        """Test recipe data is written to and read from the user's shard"""
+        for n, user in enumerate(self.users):
+            self.create_recipe(self.client_for(user), f'Recipe {n}')
+
+        for n, user in enumerate(self.users):
+            db = sharding.shard_for(user)
+            self.assertEqual(
+                list(Recipe.objects.using(db).values_list('title', flat=True)),
+                [f'Recipe {n}'],
+            )
+            self.assertEqual(Recipe.tags.through.objects.using(db).count(), 1)
+            self.assertTrue(
+                RecipeStats.objects.using(db).filter(user=user).exists()
+            )
+        self.assertFalse(Recipe.objects.using('default').exists())
+
+    def test_lists_and_stats(self):
+        """Test each user reads their own recipes and counters"""
+        client = self.client_for(self.users[0])
+        recipe = self.create_recipe(client, 'Mine')
+        self.create_recipe(self.client_for(self.users[1]), 'Theirs')
+
+        recipes = client.get(RECIPES_URL).json()
+        detail = client.get(
+            reverse('recipe:recipe-detail', args=[recipe['id']])
+        ).json()
+        stats = client.get(STATS_URL).json()
+
+        self.assertEqual([row['title'] for row in recipes], ['Mine'])
+        self.assertEqual([tag['id'] for tag in detail['tags']],
+                         recipe['tags'])
+        self.assertEqual(stats['recipe_count'], 1)
+
+    def test_copy(self):
+        """Test copies are inserted with their links in the user's shard"""
+        user = self.users[1]
+        client = self.client_for(user)
+        recipe = self.create_recipe(client, 'Original')
+
+        res = client.post(reverse('recipe:recipe-copy', args=[recipe['id']]))
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        db = sharding.shard_for(user)
+        self.assertEqual(Recipe.objects.using(db).count(), 2)
+        self.assertEqual(Recipe.tags.through.objects.using(db).count(), 2)
+
+    def test_batch_tags(self):
+        """Test tags created in a batch land in the user's shard"""
+        user = self.users[1]
+
+        res = self.client_for(user).post(
+            TAGS_URL, [{'name': 'Vegan'}, {'name': 'Dessert'}], format='json',
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            Tag.objects.using(sharding.shard_for(user)).count(), 2
+        )
+
+    def test_delete_and_purge(self):
+        """Test deleted accounts are purged from their shard"""
+        user = self.users[0]
+        db = sharding.shard_for(user)
+        client = self.client_for(user)
+        self.create_recipe(client, 'Gone')
+        deletion.delete_user(user)
+
+        mirror = User.objects.using(db).get(pk=user.pk)
+        self.assertFalse(mirror.is_active)
+        self.assertIsNotNone(mirror.deleted_at)
+
+        list(deletion.purge(timedelta(0)))
+
+        self.assertFalse(User.objects.filter(pk=user.pk).exists())
+        self.assertFalse(User.objects.using(db).filter(pk=user.pk).exists())
+        self.assertFalse(Recipe.all_objects.using(db).exists())
+        self.assertFalse(Tag.all_objects.using(db).exists())
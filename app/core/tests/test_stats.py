@@ -0,0 +1,175 @@
+from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from core import bulk, stats
+from core.models import Ingredient, Recipe, RecipeStats, Tag, Tombstone
+from core.tests.helpers import sample_recipe
+
+
+class RecipeStatsTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('asdf@asdf', 'asdf')
+
+    def stats(self):
+        return RecipeStats.objects.get(user=self.user)
+
+    def test_recipe_create_updates_stats(self):
+        """Test creating recipes maintains count, totals and bounds"""
+        sample_recipe(self.user, time_minutes=10, price=Decimal('5.00'))
+        sample_recipe(self.user, time_minutes=30, price=Decimal('7.00'))
+
+        stats = self.stats()
+        self.assertEqual(stats.recipe_count, 2)
+        self.assertEqual(stats.time_minutes_avg, 20)
+        self.assertEqual(stats.time_minutes_min, 10)
+        self.assertEqual(stats.time_minutes_max, 30)
+        self.assertEqual(stats.price_avg, Decimal('6.00'))
+        self.assertEqual(stats.price_max, Decimal('7.00'))
+
+    def test_recipe_update_shrinks_bounds(self):
+        """Test editing the recipe holding a bound recomputes it"""
+        sample_recipe(self.user, time_minutes=10)
+        recipe = sample_recipe(self.user, time_minutes=90)
+        recipe = Recipe.objects.get(pk=recipe.pk)
+
+        recipe.time_minutes = 20
+        recipe.save()
+
+        stats = self.stats()
+        self.assertEqual(stats.time_minutes_max, 20)
+        self.assertEqual(stats.time_minutes_total, 30)
+
+    def test_recipe_update_without_loaded_values(self):
+        """Test a save of an instance not loaded from the database diffs"""
+        sample_recipe(self.user, time_minutes=10)
+        recipe = sample_recipe(self.user, time_minutes=30)
+        del recipe._loaded_values
+
+        recipe.time_minutes = 20
+        with mock.patch.object(stats, 'recompute') as recompute:
+            recipe.save()
+
+        recompute.assert_not_called()
+        self.assertEqual(self.stats().time_minutes_total, 30)
+        self.assertEqual(self.stats().time_minutes_max, 20)
+
+    def test_recipe_update_fields_skip_stats(self):
+        """Test saving columns the stats do not cover leaves them alone"""
+        recipe = sample_recipe(self.user, time_minutes=30)
+        del recipe._loaded_values
+        recipe.title = 'Renamed'
+
+        # The UPDATE and the webhook lookup, no read of the old values
+        with mock.patch.object(stats, 'recipe_changed') as changed, \
+                self.assertNumQueries(2):
+            recipe.save(update_fields=['title', 'updated_at'])
+
+        changed.assert_not_called()
+
+    def test_recipe_delete_updates_stats(self):
+        """Test deleting recipes reverses their contribution"""
+        sample_recipe(self.user, time_minutes=10, price=Decimal('1.00'))
+        recipe = sample_recipe(self.user, time_minutes=50,
+                               price=Decimal('9.00'))
+
+        recipe.delete()
+
+        stats = self.stats()
+        self.assertEqual(stats.recipe_count, 1)
+        self.assertEqual(stats.time_minutes_max, 10)
+        self.assertEqual(stats.price_total, Decimal('1.00'))
+
+    def test_link_changes_update_usage(self):
+        """Test adding, removing and clearing links maintains usage"""
+        tag1 = Tag.objects.create(user=self.user, name='tag1')
+        tag2 = Tag.objects.create(user=self.user, name='tag2')
+        ingredient = Ingredient.objects.create(user=self.user, name='ing')
+        recipe1 = sample_recipe(self.user)
+        recipe2 = sample_recipe(self.user)
+
+        bulk.add_links(recipe1, 'tags', [tag1, tag2])
+        bulk.add_links(recipe2, 'tags', [tag1])
+        bulk.add_links(recipe1, 'ingredients', [ingredient])
+        bulk.add_links(recipe2, 'ingredients', [ingredient])
+        tag1.refresh_from_db()
+        ingredient.refresh_from_db()
+        self.assertEqual(tag1.recipe_count, 2)
+        self.assertEqual(ingredient.recipe_count, 2)
+
+        bulk.remove_links(recipe1, 'tags', [tag1, tag1])
+        bulk.remove_links(recipe1, 'tags', [tag1])
+        tag1.refresh_from_db()
+        self.assertEqual(tag1.recipe_count, 1)
+
+        recipe1.tags.clear()
+        ingredient.recipe_set.clear()
+        tag2.refresh_from_db()
+        ingredient.refresh_from_db()
+        self.assertEqual(tag2.recipe_count, 0)
+        self.assertEqual(ingredient.recipe_count, 0)
+
+    def test_stale_tag_save_keeps_usage(self):
+        """Test saving an outdated Tag instance does not reset its count"""
+        tag = Tag.objects.create(user=self.user, name='tag')
+        stale = Tag.objects.get(pk=tag.pk)
+        bulk.add_links(sample_recipe(self.user), 'tags', [tag])
+
+        stale.name = 'renamed'
+        stale.save()
+
+        tag.refresh_from_db()
+        self.assertEqual(tag.name, 'renamed')
+        self.assertEqual(tag.recipe_count, 1)
+
+    def test_recipe_delete_updates_usage(self):
+        """Test deleting a recipe releases its tags"""
+        tag = Tag.objects.create(user=self.user, name='tag')
+        recipe = sample_recipe(self.user)
+        bulk.add_links(recipe, 'tags', [tag])
+
+        recipe.delete()
+
+        tag.refresh_from_db()
+        self.assertEqual(tag.recipe_count, 0)
+
+    def test_user_delete_cascades_counters(self):
+        """Test deleting a user does not recreate their counters"""
+        tag = Tag.objects.create(user=self.user, name='tag')
+        bulk.add_links(sample_recipe(self.user), 'tags', [tag])
+
+        self.user.delete()
+
+        self.assertFalse(RecipeStats.objects.exists())
+        self.assertFalse(Tombstone.objects.exists())
+
+    def test_recompute_repairs_drift(self):
+        """Test the recompute command rebuilds counters from scratch"""
+        tag = Tag.objects.create(user=self.user, name='tag')
+        recipe = sample_recipe(self.user, time_minutes=15)
+        bulk.add_links(recipe, 'tags', [tag])
+        Tag.objects.update(recipe_count=42)
+        RecipeStats.objects.update(recipe_count=7, time_minutes_max=1)
+
+        call_command('recompute_recipe_stats', stdout=StringIO())
+
+        tag.refresh_from_db()
+        stats = self.stats()
+        self.assertEqual(tag.recipe_count, 1)
+        self.assertEqual(stats.recipe_count, 1)
+        self.assertEqual(stats.time_minutes_max, 15)
+
+    def test_recompute_resets_users_without_recipes(self):
+        """Test users whose recipes are gone end up with empty stats"""
+        RecipeStats.objects.create(user=self.user, recipe_count=3,
+                                   time_minutes_min=4)
+
+        stats.recompute(user=self.user)
+
+        self.assertEqual(self.stats().recipe_count, 0)
+        self.assertIsNone(self.stats().time_minutes_min)
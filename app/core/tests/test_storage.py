@@ -0,0 +1,99 @@
+import os
+import shutil
+import tempfile
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.test import TestCase, override_settings
+
+from core import storage
+from core.models import ImageBlob, Recipe
+from core.tests.helpers import sample_recipe
+
+
+class ContentAddressedStorageTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_settings.enable()
+        self.user = get_user_model().objects.create_user('asdf@asdf', 'asdf')
+
+    def tearDown(self):
+        self.media_settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def sample_recipe(self, content=None):
+        recipe = sample_recipe(self.user)
+        if content is not None:
+            recipe.image.save('photo.JPG', ContentFile(content))
+        return recipe
+
+    def refs(self, name):
+        return ImageBlob.objects.get(name=name).ref_count
+
+    def test_identical_uploads_share_one_file(self):
+        """Test the same content uploaded twice is stored once"""
+        recipe1 = self.sample_recipe(b'image bytes')
+        recipe2 = self.sample_recipe(b'image bytes')
+
+        self.assertEqual(recipe1.image.name, recipe2.image.name)
+        self.assertRegex(recipe1.image.name,
+                         r'^uploads/recipe/[0-9a-f]{64}\.jpg$')
+        files = os.listdir(os.path.dirname(recipe1.image.path))
+        self.assertEqual(files, [os.path.basename(recipe1.image.name)])
+        self.assertEqual(self.refs(recipe1.image.name), 2)
+
+    def test_replacing_image_releases_old_blob(self):
+        """Test replacing or deleting images drops their references"""
+        recipe = self.sample_recipe(b'old')
+        old_name = recipe.image.name
+        recipe = Recipe.objects.get(pk=recipe.pk)
+
+        recipe.image.save('new.jpg', ContentFile(b'new'))
+
+        self.assertEqual(self.refs(old_name), 0)
+        self.assertEqual(self.refs(recipe.image.name), 1)
+        new_name = recipe.image.name
+        recipe.delete()
+        self.assertEqual(self.refs(new_name), 0)
+
+    def test_collect_garbage_removes_unreferenced(self):
+        """Test GC removes only unreferenced blobs past the grace period"""
+        kept = self.sample_recipe(b'kept')
+        dropped = self.sample_recipe(b'dropped')
+        dropped_name = dropped.image.name
+        dropped.delete()
+
+        self.assertEqual(storage.collect_garbage(timedelta(hours=1)), [])
+
+        removed = storage.collect_garbage(timedelta(seconds=-1))
+
+        self.assertEqual(removed, [dropped_name])
+        self.assertFalse(ImageBlob.objects.filter(name=dropped_name).exists())
+        self.assertFalse(os.path.exists(os.path.join(
+            self.media_root, dropped_name
+        )))
+        self.assertTrue(os.path.exists(kept.image.path))
+
+    def test_collect_garbage_sweeps_untracked_files(self):
+        """Test files without a blob row are swept"""
+        recipe = self.sample_recipe(b'tracked')
+        orphan = os.path.join(os.path.dirname(recipe.image.path), 'old.jpg')
+        with open(orphan, 'wb') as fh:
+            fh.write(b'orphan')
+
+        removed = storage.collect_garbage(timedelta(seconds=-1))
+
+        self.assertEqual(removed, ['uploads/recipe/old.jpg'])
+        self.assertTrue(os.path.exists(recipe.image.path))
+
+    def test_recount_repairs_references(self):
+        """Test recount rebuilds reference counts from recipes"""
+        recipe = self.sample_recipe(b'content')
+        ImageBlob.objects.all().delete()
+
+        storage.recount()
+
+        self.assertEqual(self.refs(recipe.image.name), 1)
@@ -0,0 +1,378 @@
+import json
+import threading
+import time
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import StringIO
+from socketserver import ThreadingMixIn
+from types import SimpleNamespace
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from core import bulk, deletion, webhooks
+from core.models import OutboxEvent, Tag, Webhook
+from core.tests.helpers import sample_recipe
+
+
+class Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class StandIn:
+    """A local HTTP endpoint recording what is posted to it
+
+    Answers with ``statuses`` in turn, then 200, each after ``delay``
+    seconds.
+    """
+
+    def __init__(self, statuses=(), delay=0):
+        self.requests = []
+        self.statuses = list(statuses)
+        self.in_flight = self.most_in_flight = 0
+        lock = threading.Lock()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def do_POST(self):
+                with lock:
+                    stand_in.in_flight += 1
+                    stand_in.most_in_flight = max(stand_in.most_in_flight,
+                                                  stand_in.in_flight)
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                time.sleep(delay)
+                with lock:
+                    stand_in.in_flight -= 1
+                    stand_in.requests.append(
+                        (self.path, dict(self.headers), body)
+                    )
+                    status = stand_in.statuses.pop(0) \
+                        if stand_in.statuses else 200
+                self.send_response(status)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        self.server = Server(('127.0.0.1', 0), Handler)
+
+    def url(self, path='/hook'):
+        return f'http://127.0.0.1:{self.server.server_port}{path}'
+
+    def payloads(self):
+        return [json.loads(body) for _, _, body in self.requests]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, args=(0.01,),
+                         daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def events(user):
+    return list(OutboxEvent.objects.filter(user=user).order_by('id')
+                .values_list('model', 'object_id', 'action'))
+
+
+class OutboxTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('asdf@asdf', 'asdf')
+        self.hook = webhooks.subscribe(self.user, 'https://partner.example/h')
+
+    def test_changes_recorded(self):
+        """Test recipe, tag and link changes each leave an event"""
+        recipe = sample_recipe(self.user)
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        tag_id = tag.id
+        bulk.add_links(recipe, 'tags', [tag])
+        recipe.title = 'Changed'
+        recipe.save()
+        tag.delete()
+        deletion.delete_recipe(recipe)
+
+        self.assertEqual(events(self.user), [
+            ('recipe', recipe.id, 'created'),
+            ('tag', tag_id, 'created'),
+            ('recipe', recipe.id, 'updated'),
+            ('recipe', recipe.id, 'updated'),
+            ('recipe', recipe.id, 'updated'),
+            ('tag', tag_id, 'deleted'),
+            ('recipe', recipe.id, 'deleted'),
+        ])
+
+    def test_bulk_changes_recorded(self):
+        recipe = sample_recipe(self.user)
+        copy = bulk.copy_recipes(self.user, [recipe.id]).get()
+        rows = bulk.get_or_create_named(Tag, self.user, ['a', 'b'])
+
+        self.assertEqual(events(self.user)[1:], [
+            ('recipe', copy.id, 'created'),
+            ('tag', rows[0][0].id, 'created'),
+            ('tag', rows[1][0].id, 'created'),
+        ])
+
+    def test_no_events_without_active_webhook(self):
+        """Test changes of users nobody listens to write no events"""
+        other = get_user_model().objects.create_user('other@asdf', 'asdf')
+        sample_recipe(other)
+        Webhook.objects.filter(pk=self.hook.pk).update(is_active=False)
+        sample_recipe(self.user)
+
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_coalesce(self):
+        """Test each row is reported once, with its net change"""
+        def event(model, pk, action):
+            return SimpleNamespace(model=model, object_id=pk, action=action)
+
+        self.assertEqual(webhooks.coalesce([
+            event('recipe', 1, 'created'),
+            event('recipe', 2, 'updated'),
+            event('recipe', 1, 'updated'),
+            event('tag', 1, 'created'),
+            event('recipe', 3, 'created'),
+            event('recipe', 2, 'deleted'),
+            event('recipe', 3, 'deleted'),
+        ]), [
+            {'type': 'recipe.created', 'id': 1},
+            {'type': 'tag.created', 'id': 1},
+            {'type': 'recipe.deleted', 'id': 2},
+        ])
+
+    def test_verify(self):
+        body = b'{"events": []}'
+        now = int(time.time())
+        header = f't={now},v1={webhooks.signature("key", now, body)}'
+
+        self.assertTrue(webhooks.verify('key', header, body))
+        self.assertFalse(webhooks.verify('other', header, body))
+        self.assertFalse(webhooks.verify('key', header, body + b' '))
+        self.assertFalse(webhooks.verify('key', header, body, now=now + 600))
+        self.assertFalse(webhooks.verify('key', 'garbage', body))
+
+
+@override_settings(WEBHOOK_RETRY_DELAY=30, WEBHOOK_MAX_FAILURES=3,
+                   SYNC_SETTLE_SECONDS=0, WEBHOOK_ALLOW_PRIVATE_HOSTS=True)
+class DispatchTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user('asdf@asdf', 'asdf')
+
+    def test_delivers_signed_batch(self):
+        """Test pending events arrive as one signed, coalesced POST"""
+        sample_recipe(self.user, title='Before')
+        with StandIn() as stand_in:
+            hook = webhooks.subscribe(self.user, stand_in.url())
+            recipe = sample_recipe(self.user)
+            recipe.save()
+            tag = Tag.objects.create(user=self.user, name='vegan')
+
+            self.assertEqual(webhooks.dispatch(), (1, 0))
+            self.assertEqual(webhooks.dispatch(), (0, 0))
+
+        (path, headers, body), = stand_in.requests
+        self.assertEqual(path, '/hook')
+        self.assertEqual(headers['Content-Type'], 'application/json')
+        self.assertTrue(webhooks.verify(
+            hook.secret, headers[webhooks.SIGNATURE_HEADER], body,
+        ))
+        last = OutboxEvent.objects.latest('id').id
+        self.assertEqual(json.loads(body), {
+            'events': [
+                {'type': 'recipe.created', 'id': recipe.id},
+                {'type': 'tag.created', 'id': tag.id},
+            ],
+            'cursor': last,
+        })
+        hook.refresh_from_db()
+        self.assertEqual(hook.last_event_id, last)
+        self.assertIsNone(hook.next_delivery_at)
+
+    @override_settings(WEBHOOK_BATCH_EVENTS=2)
+    def test_batches_in_order(self):
+        with StandIn() as stand_in:
+            webhooks.subscribe(self.user, stand_in.url())
+            recipes = [sample_recipe(self.user) for _ in range(3)]
+            while webhooks.dispatch()[0]:
+                pass
+
+        self.assertEqual(
+            [[e['id'] for e in p['events']] for p in stand_in.payloads()],
+            [[recipes[0].id, recipes[1].id], [recipes[2].id]],
+        )
+
+    @override_settings(SYNC_SETTLE_SECONDS=60)
+    def test_unsettled_events_held_back(self):
+        """Test delivery stops before events that may still be committing"""
+        with StandIn() as stand_in:
+            webhooks.subscribe(self.user, stand_in.url())
+            settled = sample_recipe(self.user)
+            OutboxEvent.objects.update(
+                created_at=timezone.now() - timedelta(minutes=5),
+            )
+            first = OutboxEvent.objects.get()
+            sample_recipe(self.user)
+            late = OutboxEvent.objects.latest('id')
+            sample_recipe(self.user)
+            # Committed in the meantime under a higher id, but older
+            OutboxEvent.objects.exclude(pk__lte=late.pk).update(
+                created_at=timezone.now() - timedelta(minutes=5),
+            )
+
+            self.assertEqual(webhooks.dispatch(), (1, 0))
+            self.assertEqual(webhooks.dispatch(), (0, 0))
+
+        self.assertEqual(stand_in.payloads(), [{
+            'events': [{'type': 'recipe.created', 'id': settled.id}],
+            'cursor': first.id,
+        }])
+
+    def test_failure_backs_off_and_retries(self):
+        """Test a failed batch is sent again, unchanged, after the backoff"""
+        with StandIn(statuses=[500]) as stand_in:
+            hook = webhooks.subscribe(self.user, stand_in.url())
+            sample_recipe(self.user)
+
+            before = timezone.now()
+            self.assertEqual(webhooks.dispatch(), (0, 1))
+            hook.refresh_from_db()
+            self.assertEqual(hook.failures, 1)
+            self.assertEqual(hook.last_error, 'HTTP 500')
+            self.assertGreaterEqual(hook.next_delivery_at,
+                                    before + timedelta(seconds=30))
+            self.assertEqual(webhooks.dispatch(), (0, 0))
+
+            Webhook.objects.update(next_delivery_at=timezone.now())
+            self.assertEqual(webhooks.dispatch(), (1, 0))
+
+        first, second = [body for _, _, body in stand_in.requests]
+        self.assertEqual(json.loads(first), json.loads(second))
+        hook.refresh_from_db()
+        self.assertEqual(hook.failures, 0)
+
+    def test_disabled_after_repeated_failures(self):
+        with StandIn(statuses=[503] * 3) as stand_in:
+            hook = webhooks.subscribe(self.user, stand_in.url())
+            sample_recipe(self.user)
+            for _ in range(3):
+                Webhook.objects.update(next_delivery_at=None)
+                webhooks.dispatch()
+
+        hook.refresh_from_db()
+        self.assertFalse(hook.is_active)
+        self.assertEqual(hook.failures, 3)
+
+    def test_unreachable_url(self):
+        with StandIn() as stand_in:
+            url = stand_in.url()
+        webhooks.subscribe(self.user, url)
+        sample_recipe(self.user)
+
+        self.assertEqual(webhooks.dispatch(), (0, 1))
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE_HOSTS=False)
+    def test_private_address_refused(self):
+        """Test nothing is sent to a host that resolves to a private address"""
+        with StandIn() as stand_in:
+            hook = webhooks.subscribe(self.user, stand_in.url())
+            sample_recipe(self.user)
+
+            self.assertEqual(webhooks.dispatch(), (0, 1))
+
+        self.assertEqual(stand_in.requests, [])
+        hook.refresh_from_db()
+        self.assertEqual(hook.last_error, '127.0.0.1 is not a public address')
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE_HOSTS=False)
+    def test_check_url(self):
+        for url in ('http://127.0.0.1/', 'http://10.1.2.3:8080/hook',
+                    'http://169.254.169.254/latest/meta-data/',
+                    'http://[::1]/', 'http://[::ffff:10.0.0.1]/',
+                    'http://localhost/'):
+            with self.subTest(url=url), self.assertRaises(ValueError):
+                webhooks.check_url(url)
+        webhooks.check_url('https://93.184.216.34/hook')
+
+    @override_settings(WEBHOOK_CONCURRENCY=2)
+    def test_concurrency_limited(self):
+        """Test no more than WEBHOOK_CONCURRENCY deliveries run at once"""
+        users = [
+            get_user_model().objects.create_user(f'user{n}@asdf', 'asdf')
+            for n in range(5)
+        ]
+        with StandIn(delay=0.05) as stand_in:
+            for user in users:
+                webhooks.subscribe(user, stand_in.url())
+                sample_recipe(user)
+
+            self.assertEqual(webhooks.dispatch(), (5, 0))
+
+        self.assertEqual(stand_in.most_in_flight, 2)
+
+    @override_settings(WEBHOOK_CONCURRENCY=1)
+    def test_claimed_when_sent(self):
+        """Test a webhook is leased only once a thread is free to send"""
+        other = get_user_model().objects.create_user('other@asdf', 'asdf')
+        claim, requests_seen = webhooks._claim, []
+
+        def claiming(hook, lease):
+            requests_seen.append(len(stand_in.requests))
+            return claim(hook, lease)
+
+        with StandIn() as stand_in:
+            for user in (self.user, other):
+                webhooks.subscribe(user, stand_in.url())
+                sample_recipe(user)
+            with mock.patch.object(webhooks, '_claim', claiming):
+                self.assertEqual(webhooks.dispatch(), (2, 0))
+
+        self.assertEqual(requests_seen, [0, 1])
+
+    def test_prune(self):
+        """Test events are dropped once every active webhook has them"""
+        other = get_user_model().objects.create_user('other@asdf', 'asdf')
+        OutboxEvent.objects.create(user=other, model='recipe', object_id=1,
+                                   action=OutboxEvent.CREATED)
+        with StandIn() as stand_in:
+            webhooks.subscribe(self.user, stand_in.url())
+            sample_recipe(self.user)
+
+            self.assertEqual(webhooks.prune(), 1)
+            self.assertEqual(len(events(self.user)), 1)
+
+            webhooks.dispatch()
+
+        self.assertEqual(webhooks.prune(), 1)
+        self.assertFalse(OutboxEvent.objects.exists())
+
+    def test_prune_passes_waiting_events_once(self):
+        """Test pruning goes on past events still waited for"""
+        other = get_user_model().objects.create_user('other@asdf', 'asdf')
+        webhooks.subscribe(self.user, 'https://partner.example/h')
+        for user in (self.user, self.user, other, other):
+            OutboxEvent.objects.create(user=user, model='recipe',
+                                       object_id=1,
+                                       action=OutboxEvent.CREATED)
+
+        self.assertEqual(webhooks.prune(batch_size=1), 2)
+        self.assertEqual(len(events(self.user)), 2)
+        self.assertFalse(OutboxEvent.objects.filter(user=other).exists())
+
+    def test_dispatch_command(self):
+        with StandIn() as stand_in:
+            webhooks.subscribe(self.user, stand_in.url())
+            sample_recipe(self.user)
+            out = StringIO()
+            call_command('dispatch_webhooks', once=True, stdout=out)
+
+        self.assertIn('Delivered 1 batches, 0 failed', out.getvalue())
+        self.assertEqual(len(stand_in.requests), 1)
@@ -0,0 +1,365 @@
+"""Push recipe, tag and ingredient changes to partner webhooks.
+
+Every change of a user with an active webhook appends an ``OutboxEvent``
+from its signal handler. The views, jobs and admin make their changes in
+one transaction, so a change and its event commit or roll back together.
+Users without an active webhook get no events; a new or reactivated
+webhook starts from the latest event anyway. ``dispatch`` (run by
+``manage.py dispatch_webhooks``) sends each due ``Webhook`` the events
+past its ``last_event_id`` as one signed JSON POST. Events about the same
+row are coalesced: a partner learns that recipe 5 was updated once, not
+how often. Deliveries run concurrently up to ``WEBHOOK_CONCURRENCY``,
+never more than one per webhook, so each receives its events in order.
+Failed deliveries back off exponentially and are retried from the same
+event.
+
+Event ids come from a sequence but commit in any order, so a webhook
+moving past id 10 could miss an id 9 that was still being committed.
+Like the sync feed, delivery holds back events younger than
+``SYNC_SETTLE_SECONDS``, which transactions are assumed to finish in.
+
+Events only carry ids; partners fetch the rows through the API as
+before. Events no active webhook waits for are pruned.
+
+Webhook URLs must resolve to public addresses only, checked when the
+webhook is saved and again on every connection, so they cannot be used
+to probe the internal network.
+"""
+import hashlib
+import hmac
+import ipaddress
+import json
+import secrets
+import socket
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from urllib.parse import urlsplit
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Exists, Max, OuterRef, Q
+from django.utils import timezone
+
+from core import jobs, sharding
+from core.models import OutboxEvent, Webhook
+
+SIGNATURE_HEADER = 'X-Recipe-Signature'
+# Seconds a signature stays valid for ``verify``
+SIGNATURE_TOLERANCE = 300
+
+
+def record(action, model, user_id, ids):
+    """Append ``action`` events for rows ``ids`` of ``model``'s name
+
+    Nothing is written unless the user has an active webhook.
+    """
+    if not ids:
+        return
+    db = sharding.shard_for(user_id)
+    if Webhook.objects.using(db).filter(user_id=user_id,
+                                        is_active=True).exists():
+        OutboxEvent.objects.using(db).bulk_create([
+            OutboxEvent(user_id=user_id, model=model, object_id=pk,
+                        action=action)
+            for pk in ids
+        ])
+
+
+def latest_event_id(user):
+    """The id of the last event recorded for ``user``, or 0"""
+    with sharding.pinned(user):
+        last = OutboxEvent.objects.filter(user=user)\
+            .aggregate(last=Max('id'))['last']
+    return last or 0
+
+
+def subscribe(user, url):
+    """A new webhook of ``user``, receiving changes from now on"""
+    with sharding.pinned(user):
+        return Webhook.objects.create(
+            user=user, url=url, secret=secrets.token_hex(32),
+            last_event_id=latest_event_id(user),
+        )
+
+
+def coalesce(events):
+    """One ``{"type", "id"}`` per row changed by ``events``, in id order
+
+    A row created and then changed is still reported as created, one
+    created and deleted again is left out.
+    """
+    rows = OrderedDict()
+    for event in events:
+        key = (event.model, event.object_id)
+        first = rows.pop(key, (event.action,))[0]
+        rows[key] = (first, event.action)
+    return [
+        {'type': f'{model}.{first if first == OutboxEvent.CREATED else last}',
+         'id': pk}
+        for (model, pk), (first, last) in rows.items()
+        if not (first == OutboxEvent.CREATED and last == OutboxEvent.DELETED)
+    ]
+
+
+def signature(secret, timestamp, body):
+    message = f'{timestamp}.'.encode() + body
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def verify(secret, header, body, now=None):
+    """Whether ``header`` is a current signature of ``body``
+
+    The header reads ``t=<unix time>,v1=<hex HMAC-SHA256>`` where the MAC
+    covers ``"<unix time>." + body`` under the webhook's secret.
+    """
+    try:
+        parts = dict(part.split('=', 1) for part in header.split(','))
+        timestamp = int(parts['t'])
+    except (KeyError, ValueError):
+        return False
+    now = time.time() if now is None else now
+    return abs(now - timestamp) <= SIGNATURE_TOLERANCE and \
+        hmac.compare_digest(signature(secret, timestamp, body),
+                            parts.get('v1', ''))
+
+
+def _is_public(address):
+    address = ipaddress.ip_address(address.split('%', 1)[0])
+    return address.is_global and not address.is_multicast
+
+
+def _resolve(host, port):
+    """The addresses of ``host``; ``ValueError`` unless all are public
+
+    ``settings.WEBHOOK_ALLOW_PRIVATE_HOSTS`` lifts the restriction, for
+    development.
+    """
+    try:
+        infos = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    except (socket.gaierror, UnicodeError):
+        raise ValueError(f'{host} cannot be resolved')
+    addresses = [info[4][0] for info in infos]
+    if not settings.WEBHOOK_ALLOW_PRIVATE_HOSTS and \
+            not all(_is_public(address) for address in addresses):
+        raise ValueError(f'{host} is not a public address')
+    return addresses
+
+
+def check_url(url):
+    """Raise ``ValueError`` unless the host of ``url`` is public"""
+    parts = urlsplit(url)
+    _resolve(parts.hostname, parts.port or
+             (443 if parts.scheme == 'https' else 80))
+
+
+def _connect(address, *args, **kwargs):
+    # http.client's socket.create_connection, restricted to the addresses
+    # _resolve allows; connecting to them avoids a second lookup
+    host, port = address
+    error = None
+    for ip in _resolve(host, port):
+        try:
+            return socket.create_connection((ip, port), *args, **kwargs)
+        except OSError as exc:
+            error = exc
+    raise error
+
+
+class _PublicOnly:
+
+    def do_open(self, http_class, request, **kwargs):
+        def connection(*args, **kwargs):
+            conn = http_class(*args, **kwargs)
+            conn._create_connection = _connect
+            return conn
+        return super().do_open(connection, request, **kwargs)
+
+
+class _PublicHTTPHandler(_PublicOnly, urllib.request.HTTPHandler):
+    pass
+
+
+class _PublicHTTPSHandler(_PublicOnly, urllib.request.HTTPSHandler):
+    pass
+
+
+class _NoRedirects(urllib.request.HTTPRedirectHandler):
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+# No proxies either, the connection goes straight to the checked address
+_opener = urllib.request.build_opener(
+    urllib.request.ProxyHandler({}), _PublicHTTPHandler,
+    _PublicHTTPSHandler, _NoRedirects,
+)
+
+
+def send(url, secret, body):
+    """POST ``body`` to ``url`` signed with ``secret``; raises on failure"""
+    timestamp = int(time.time())
+    request = urllib.request.Request(url, data=body, method='POST', headers={
+        'Content-Type': 'application/json',
+        'User-Agent': 'recipe-app-webhooks',
+        SIGNATURE_HEADER:
+            f't={timestamp},v1={signature(secret, timestamp, body)}',
+    })
+    with _opener.open(request, timeout=settings.WEBHOOK_TIMEOUT) as response:
+        return response.status
+
+
+def _claim(hook, lease):
+    """Lease ``hook`` for one delivery unless another dispatcher has it"""
+    claimed = Webhook.objects.filter(
+        pk=hook.pk, next_delivery_at=hook.next_delivery_at,
+    ) if hook.next_delivery_at else Webhook.objects.filter(
+        pk=hook.pk, next_delivery_at__isnull=True,
+    )
+    return claimed.update(next_delivery_at=lease)
+
+
+def _settled(now):
+    return now - timedelta(seconds=settings.SYNC_SETTLE_SECONDS)
+
+
+def _due(now):
+    pending = OutboxEvent.objects.filter(
+        user=OuterRef('user_id'), id__gt=OuterRef('last_event_id'),
+        created_at__lte=_settled(now),
+    )
+    return Webhook.objects.filter(is_active=True).filter(
+        Q(next_delivery_at__isnull=True) | Q(next_delivery_at__lte=now)
+    ).annotate(pending=Exists(pending)).filter(pending=True).order_by('id')
+
+
+def _prepare(hook):
+    """Claim ``hook`` and build its next body, or ``None``
+
+    The lease starts now, as the send is about to start, and outlasts
+    it: after ``WEBHOOK_TIMEOUT`` the send gives up.
+    """
+    now = timezone.now()
+    lease = now + timedelta(seconds=settings.WEBHOOK_TIMEOUT * 3)
+    if not _claim(hook, lease):
+        return None
+    events = list(OutboxEvent.objects.filter(
+        user_id=hook.user_id, id__gt=hook.last_event_id,
+    ).order_by('id')[:settings.WEBHOOK_BATCH_EVENTS])
+    # Stop at the first unsettled event; ids between it and later
+    # events may still be committing
+    for n, event in enumerate(events):
+        if event.created_at > _settled(now):
+            del events[n:]
+            break
+    if not events:
+        # Pruned or unsettled since
+        Webhook.objects.filter(pk=hook.pk).update(next_delivery_at=None)
+        return None
+    cursor = events[-1].id
+    body = json.dumps({'events': coalesce(events), 'cursor': cursor}).encode()
+    return hook, cursor, body
+
+
+def _record(hook, cursor, error):
+    if error is None:
+        Webhook.objects.filter(pk=hook.pk).update(
+            last_event_id=cursor, next_delivery_at=None, failures=0,
+            last_error='',
+        )
+        return
+    failures = hook.failures + 1
+    Webhook.objects.filter(pk=hook.pk).update(
+        failures=failures, last_error=error,
+        is_active=failures < settings.WEBHOOK_MAX_FAILURES,
+        next_delivery_at=timezone.now() + timedelta(seconds=jobs.backoff(
+            failures, settings.WEBHOOK_RETRY_DELAY,
+            settings.WEBHOOK_RETRY_MAX_DELAY,
+        )),
+    )
+
+
+def _deliver(delivery):
+    """``None`` once the webhook accepted the body, else what went wrong"""
+    hook, _, body = delivery
+    try:
+        send(hook.url, hook.secret, body)
+    except urllib.error.HTTPError as exc:
+        return f'HTTP {exc.code}'
+    except (OSError, ValueError) as exc:
+        return str(exc) or exc.__class__.__name__
+    return None
+
+
+def dispatch():
+    """Send one batch to every due webhook
+
+    Only the HTTP requests run on the pool; the database is read and
+    updated by the calling thread. A webhook is claimed only when a
+    thread is free to send to it, so no lease runs out while its
+    delivery waits in the queue. Returns ``(delivered, failed)``.
+    """
+    now = timezone.now()
+    due = []
+    for db in sharding.databases():
+        with sharding.using(db):
+            due.extend((db, hook) for hook in _due(now))
+    due.reverse()
+    delivered = failed = 0
+    in_flight = {}
+    with ThreadPoolExecutor(max_workers=settings.WEBHOOK_CONCURRENCY,
+                            thread_name_prefix='webhook') as pool:
+        while due or in_flight:
+            while due and len(in_flight) < settings.WEBHOOK_CONCURRENCY:
+                db, hook = due.pop()
+                with sharding.using(db):
+                    delivery = _prepare(hook)
+                if delivery:
+                    in_flight[pool.submit(_deliver, delivery)] = \
+                        (db,) + delivery
+            if not in_flight:
+                continue
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                db, hook, cursor, _ = in_flight.pop(future)
+                error = future.result()
+                with sharding.using(db):
+                    _record(hook, cursor, error)
+                if error is None:
+                    delivered += 1
+                else:
+                    failed += 1
+    return delivered, failed
+
+
+def prune(batch_size=1000):
+    """Delete events every active webhook of their user already has
+
+    Inactive webhooks keep nothing; switched back on they resume from
+    the latest event.
+    """
+    removed = 0
+    for db in sharding.databases():
+        with sharding.using(db):
+            waiting = Webhook.objects.filter(
+                user=OuterRef('user_id'), is_active=True,
+                last_event_id__lt=OuterRef('id'),
+            )
+            # One pass over the table in id order; events still waited
+            # for are not looked at again
+            last_id = 0
+            while True:
+                batch = list(OutboxEvent.objects.filter(id__gt=last_id)
+                             .order_by('id').annotate(waiting=Exists(waiting))
+                             .values_list('id', 'waiting')[:batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1][0]
+                ids = [pk for pk, is_waiting in batch if not is_waiting]
+                if ids:
+                    rows = OutboxEvent.objects.filter(id__in=ids)
+                    removed += rows._raw_delete(rows.db)
+    return removed
@@ -0,0 +1,108 @@
+"""Responses for serving recipe images after an ownership check.
+
+The bytes are handed off to the front-end server when ``MEDIA_ACCEL`` is
+configured, otherwise they are streamed from Django with Range support.
+"""
+import mimetypes
+import os
+import re
+
+from django.conf import settings
+from django.http import FileResponse, Http404, HttpResponse, \
+    HttpResponseNotModified, StreamingHttpResponse
+
+# Upload names never change content, so clients may cache them for a year.
+CACHE_CONTROL = 'private, max-age=31536000, immutable'
+CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def parse_range(header, size):
+    """Return the inclusive ``(start, end)`` of a single byte range
+
+    ``None`` means the header should be ignored; ``ValueError`` means the
+    range can not be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return None
+    start, end = match.groups()
+    if not start and not end:
+        return None
+    if not start:
+        length = int(end)
+        if not length:
+            raise ValueError(header)
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError(header)
+    return start, end
+
+
+def _read_range(path, start, end):
+    with open(path, 'rb') as fh:
+        fh.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = fh.read(min(CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
+def _stream(request, path, content_type):
+    try:
+        size = os.path.getsize(path)
+    except OSError:
+        # The blob is gone, e.g. collected after the recipe changed image
+        raise Http404
+    header = request.META.get('HTTP_RANGE')
+    try:
+        byte_range = parse_range(header, size) if header else None
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+
+    if byte_range is None:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+        response['Content-Length'] = size
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _read_range(path, start, end),
+            status=206,
+            content_type=content_type,
+        )
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = end - start + 1
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def serve(request, name):
+    """Build the response delivering the media file ``name``"""
+    etag = '"{}"'.format(os.path.splitext(os.path.basename(name))[0])
+    if etag in request.META.get('HTTP_IF_NONE_MATCH', ''):
+        response = HttpResponseNotModified()
+    else:
+        content_type = mimetypes.guess_type(name)[0] \
+            or 'application/octet-stream'
+        accel = getattr(settings, 'MEDIA_ACCEL', '')
+        if accel == 'x-accel':
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = settings.MEDIA_ACCEL_PREFIX + name
+        elif accel == 'x-sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = os.path.join(settings.MEDIA_ROOT, name)
+        else:
+            response = _stream(
+                request, os.path.join(settings.MEDIA_ROOT, name),
+                content_type,
+            )
+    response['ETag'] = etag
+    response['Cache-Control'] = CACHE_CONTROL
+    return response
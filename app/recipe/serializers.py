@@ -1,6 +1,134 @@
+from django.core.exceptions import ValidationError
+from django.db.models import CharField, F, Value
 from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS, PKOnlyObject
 
-from core.models import Tag, Ingredient, Recipe
+from core import bulk, names, sharding, sync, webhooks
+from core.models import Tag, Ingredient, Recipe, RecipeIngredient, \
+    RecipeStats, RecipeTag, Webhook
+
+
+def load_links(recipes):
+    """Load the tags and ingredients of ``recipes`` with a single query
+
+    Both link tables are read with one ``UNION ALL``, in position order;
+    ``link_ids`` and ``quantities`` then serve from what is loaded.
+    """
+    ids = [recipe.pk for recipe in recipes]
+    if not ids:
+        return recipes
+    columns = ('recipe_id', 'position', 'id', 'field', 'target', 'amount')
+    tags = RecipeTag.objects.filter(recipe_id__in=ids).annotate(
+        field=Value('tags', CharField()), target=F('tag_id'),
+        amount=Value('', CharField()),
+    ).values_list(*columns)
+    ingredients = RecipeIngredient.objects.filter(recipe_id__in=ids).annotate(
+        field=Value('ingredients', CharField()), target=F('ingredient_id'),
+        amount=F('quantity'),
+    ).values_list(*columns)
+    related = {recipe_id: ({'tags': [], 'ingredients': []}, {})
+               for recipe_id in ids}
+    for recipe_id, _, _, field, target, amount in tags.union(
+        ingredients, all=True,
+    ).order_by('position', 'id'):
+        link_ids, quantities = related[recipe_id]
+        link_ids[field].append(target)
+        if amount:
+            quantities[target] = amount
+    for recipe in recipes:
+        recipe._link_ids, recipe._quantities = related[recipe.pk]
+    return recipes
+
+
+def link_ids(recipe, field):
+    """Ids linked to ``recipe`` through ``field`` in position order
+
+    Uses the ids loaded by ``load_links`` or ``core.bulk.set_links`` when
+    present.
+    """
+    if field not in getattr(recipe, '_link_ids', {}):
+        load_links([recipe])
+    return recipe._link_ids[field]
+
+
+def quantities(recipe):
+    """``{ingredient id: quantity}`` of ``recipe``'s quantified ingredients"""
+    if not hasattr(recipe, '_quantities'):
+        load_links([recipe])
+    return recipe._quantities
+
+
+QUANTITY_LENGTH = RecipeIngredient._meta.get_field('quantity').max_length
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    """Resolves every submitted primary key with a single query
+
+    With ``quantified`` an item may also be ``{"id", "quantity"}``; the
+    quantity is left on the resolved object as ``link_quantity`` for
+    ``core.bulk.set_links``.
+    """
+
+    def __init__(self, quantified=False, **kwargs):
+        self.quantified = quantified
+        super().__init__(**kwargs)
+
+    def get_attribute(self, instance):
+        if instance.pk is None:
+            return []
+        return [PKOnlyObject(pk) for pk in link_ids(instance, self.source)]
+
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+
+        child = self.child_relation
+        queryset = child.get_queryset()
+        pks = {}
+        for item in data:
+            quantity = ''
+            if self.quantified and isinstance(item, dict):
+                item, quantity = item.get('id'), item.get('quantity', '')
+                if not isinstance(quantity, str) \
+                        or len(quantity) > QUANTITY_LENGTH:
+                    raise serializers.ValidationError(
+                        f'Quantities are text of at most {QUANTITY_LENGTH} '
+                        'characters.'
+                    )
+            try:
+                pks[queryset.model._meta.pk.to_python(item)] = quantity
+            except ValidationError:
+                child.fail('incorrect_type', data_type=type(item).__name__)
+
+        found = queryset.in_bulk(pks)
+        for pk, quantity in pks.items():
+            if pk not in found:
+                child.fail('does_not_exist', pk_value=pk)
+            if quantity:
+                found[pk].link_quantity = quantity
+        return [found[pk] for pk in pks]
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Primary keys of the requesting user's rows only"""
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        request = self.context.get('request')
+        if request is not None:
+            queryset = queryset.filter(user=request.user)
+        return queryset
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'quantified': kwargs.pop('quantified', False)}
+        list_kwargs['child_relation'] = cls(*args, **kwargs)
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
 
 
 class TagSerializer(serializers.ModelSerializer):
@@ -19,26 +147,159 @@ class IngredientSerializer(serializers.ModelSerializer):
         read_only_fields = ('id',)
 
 
+class BatchCreatedSerializer(serializers.Serializer):
+    """One name of a batch create and the tag/ingredient it resolved to"""
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    created = serializers.BooleanField()
+
+
 class RecipeSerializer(serializers.ModelSerializer):
-    ingredients = serializers.PrimaryKeyRelatedField(
+    ingredients = BulkPrimaryKeyRelatedField(
         many=True,
+        quantified=True,
         queryset=Ingredient.objects.all()
     )
-    tags = serializers.PrimaryKeyRelatedField(
+    tags = BulkPrimaryKeyRelatedField(
         many=True,
         queryset=Tag.objects.all()
     )
+    quantities = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
-        fields = ('id', 'title', 'ingredients', 'tags',
-                  'time_minutes', 'price', 'link')
-        read_only_fields = ('id',)
+        fields = ('id', 'title', 'ingredients', 'quantities', 'tags',
+                  'time_minutes', 'price', 'link', 'copied_from',
+                  'version')
+        read_only_fields = ('id', 'copied_from', 'version')
+
+    LINK_FIELDS = ('tags', 'ingredients')
+
+    def get_quantities(self, recipe):
+        if recipe.pk is None:
+            return {}
+        return {
+            str(pk): quantity for pk, quantity in quantities(recipe).items()
+        }
+
+    def pop_links(self, validated_data):
+        return {
+            field: validated_data.pop(field)
+            for field in self.LINK_FIELDS if field in validated_data
+        }
+
+    def create(self, validated_data):
+        links = self.pop_links(validated_data)
+        with sharding.pinned(validated_data['user']), sharding.atomic():
+            recipe = super().create(validated_data)
+            for field, targets in links.items():
+                bulk.set_links(recipe, field, targets, current={})
+        return recipe
+
+    def update(self, instance, validated_data):
+        links = self.pop_links(validated_data)
+        with sharding.pinned(instance.user_id), sharding.atomic():
+            recipe = super().update(instance, validated_data)
+            for field, targets in links.items():
+                bulk.set_links(recipe, field, targets)
+        return recipe
+
+
+class NamedLinksField(serializers.Field):
+    """Linked tags/ingredients as ``{'id', 'name'}`` from core.names"""
+
+    def __init__(self, model, **kwargs):
+        self.model = model
+        kwargs.update(source='*', read_only=True)
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        request = self.context.get('request')
+        user = request.user if request is not None \
+            and request.user.pk == recipe.user_id else recipe.user
+        return names.expand(
+            self.model, user, link_ids(recipe, self.field_name)
+        )
 
 
 class RecipeDetailSerializer(RecipeSerializer):
-    ingredients = IngredientSerializer(many=True, read_only=True)
-    tags = TagSerializer(many=True, read_only=True)
+    ingredients = NamedLinksField(Ingredient)
+    tags = NamedLinksField(Tag)
+
+
+class RecipeCopySerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        min_length=1,
+        max_length=1000,
+    )
+
+
+class SyncQuerySerializer(serializers.Serializer):
+    cursor = serializers.CharField(required=False, allow_blank=True)
+    limit = serializers.IntegerField(
+        min_value=1, max_value=1000, default=500
+    )
+
+    def validate_cursor(self, value):
+        try:
+            sync.decode_cursor(value)
+        except sync.InvalidCursor:
+            raise serializers.ValidationError('Invalid cursor.')
+        return value
+
+
+class SimilarQuerySerializer(serializers.Serializer):
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+    metric = serializers.ChoiceField(
+        choices=('jaccard', 'cosine'), default='jaccard'
+    )
+
+
+class IdListField(serializers.CharField):
+    """Comma separated ids, as used in query strings"""
+    default_error_messages = {
+        'invalid_ids': 'Expected comma separated ids.',
+    }
+    # The largest primary key an AutoField holds
+    MAX_ID = 2 ** 31 - 1
+
+    def __init__(self, max_ids=1000, **kwargs):
+        self.max_ids = max_ids
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        try:
+            ids = [int(pk) for pk in value.split(',') if pk.strip()]
+        except ValueError:
+            self.fail('invalid_ids')
+        if not ids or len(ids) > self.max_ids or \
+                not all(0 < pk <= self.MAX_ID for pk in ids):
+            self.fail('invalid_ids')
+        return ids
+
+
+class CookableQuerySerializer(serializers.Serializer):
+    ingredients = IdListField()
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+
+class ShoppingListQuerySerializer(serializers.Serializer):
+    ids = IdListField()
+
+
+class ShoppingIngredientSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    name = serializers.CharField()
+    recipes = serializers.ListField(child=serializers.IntegerField())
+
+
+class ShoppingListSerializer(serializers.Serializer):
+    recipes = serializers.ListField(child=serializers.IntegerField())
+    price = serializers.DecimalField(max_digits=15, decimal_places=2)
+    time_minutes = serializers.IntegerField()
+    ingredients = ShoppingIngredientSerializer(many=True)
 
 
 class RecipeImageSerializer(serializers.ModelSerializer):
@@ -46,3 +307,81 @@ class RecipeImageSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = ('id', 'image')
         read_only_fields = ('id',)
+
+    def update(self, instance, validated_data):
+        with sharding.pinned(instance.user_id), sharding.atomic():
+            return super().update(instance, validated_data)
+
+
+class TagUsageSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Tag
+        fields = ('id', 'name', 'recipe_count')
+        read_only_fields = fields
+
+
+class IngredientUsageSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Ingredient
+        fields = ('id', 'name', 'recipe_count')
+        read_only_fields = fields
+
+
+class RecipeStatsSerializer(serializers.ModelSerializer):
+    time_minutes_avg = serializers.FloatField(read_only=True)
+    price_avg = serializers.DecimalField(
+        max_digits=15, decimal_places=2, read_only=True
+    )
+    tags = serializers.SerializerMethodField()
+    ingredients = serializers.SerializerMethodField()
+
+    class Meta:
+        model = RecipeStats
+        fields = ('recipe_count',
+                  'time_minutes_avg', 'time_minutes_min', 'time_minutes_max',
+                  'price_avg', 'price_min', 'price_max',
+                  'tags', 'ingredients')
+        read_only_fields = fields
+
+    def _usage(self, model, serializer_class, stats):
+        queryset = model.objects\
+            .filter(user_id=stats.user_id, recipe_count__gt=0)\
+            .order_by('-recipe_count', 'name')
+        return serializer_class(queryset, many=True).data
+
+    def get_tags(self, stats):
+        return self._usage(Tag, TagUsageSerializer, stats)
+
+    def get_ingredients(self, stats):
+        return self._usage(Ingredient, IngredientUsageSerializer, stats)
+
+
+class WebhookSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Webhook
+        fields = ('id', 'url', 'secret', 'is_active', 'last_event_id',
+                  'failures', 'last_error', 'created_at')
+        read_only_fields = ('id', 'secret', 'last_event_id', 'failures',
+                            'last_error', 'created_at')
+
+    def validate_url(self, value):
+        try:
+            webhooks.check_url(value)
+        except ValueError as exc:
+            raise serializers.ValidationError(str(exc))
+        return value
+
+    def create(self, validated_data):
+        return webhooks.subscribe(validated_data['user'],
+                                  validated_data['url'])
+
+    def update(self, instance, validated_data):
+        if validated_data.get('is_active') and not instance.is_active:
+            # Switched back on by hand: deliver right away, from the latest
+            # event on. Those in between were pruned while it was inactive.
+            instance.failures, instance.next_delivery_at = 0, None
+            instance.last_event_id = webhooks.latest_event_id(instance.user)
+        return super().update(instance, validated_data)
@@ -1,8 +1,13 @@
+from unittest.mock import patch
+
 from core.models import Ingredient, Recipe
 from django.contrib.auth import get_user_model
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 from recipe.serializers import IngredientSerializer
+from recipe.views import IngredientViewSet
 from rest_framework import status
 from rest_framework.test import APIClient
 
@@ -105,3 +110,55 @@ class PrivateIngredientsApiTests(TestCase):
         recipe2.ingredients.add(ingredient1)
         res = self.client.get(INGREDIENTS_URL, {'assigned_only': 1})
         self.assertEqual(len(res.data), 1)
+
+    def test_create_ingredients_batch(self):
+        """Test a list of names is created in one go, skipping known ones"""
+        salt = Ingredient.objects.create(user=self.user, name='salt')
+        other = get_user_model().objects.create_user('asdf@asdf2', 'asdf')
+        Ingredient.objects.create(user=other, name='flour')
+        version = self.user.names_version
+
+        res = self.client.post(INGREDIENTS_URL, [
+            {'name': 'flour'}, {'name': 'salt'}, {'name': 'flour'},
+        ], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        flour = Ingredient.objects.get(user=self.user, name='flour')
+        self.assertEqual(res.data, [
+            {'id': flour.id, 'name': 'flour', 'created': True},
+            {'id': salt.id, 'name': 'salt', 'created': False},
+            {'id': flour.id, 'name': 'flour', 'created': True},
+        ])
+        self.user.refresh_from_db()
+        self.assertGreater(self.user.names_version, version)
+
+    def test_create_ingredients_batch_constant_queries(self):
+        """Test the queries of a batch do not grow with its size"""
+        def post(count, offset):
+            with CaptureQueriesContext(connection) as ctx:
+                res = self.client.post(INGREDIENTS_URL, [
+                    {'name': f'pantry {n}'}
+                    for n in range(offset, offset + count)
+                ], format='json')
+            self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+            return len(ctx.captured_queries)
+
+        self.assertEqual(post(2, 0), post(100, 10))
+
+    def test_create_ingredients_batch_invalid(self):
+        """Test one invalid item rejects the whole batch"""
+        res = self.client.post(INGREDIENTS_URL, [
+            {'name': 'salt'}, {'name': ''},
+        ], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Ingredient.objects.filter(user=self.user).exists())
+
+    def test_create_ingredients_batch_limit(self):
+        """Test batches are capped"""
+        with patch.object(IngredientViewSet, 'max_batch', 2):
+            res = self.client.post(INGREDIENTS_URL, [
+                {'name': 'a'}, {'name': 'b'}, {'name': 'c'},
+            ], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
@@ -1,17 +1,27 @@
+import json
+import shutil
 import tempfile
+import threading
 import os
+from unittest.mock import patch
 
 from PIL import Image
 from django.contrib.auth import get_user_model
-from core.models import Recipe, Tag, Ingredient
-from django.test import TestCase
+from core import bulk, jobs, names
+from core.models import ImageBlob, Job, Recipe, RecipeStats, Tag, \
+    Ingredient, VersionConflict
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
 from recipe.serializers import RecipeSerializer, RecipeDetailSerializer
+from recipe.views import RecipeViewSet
 from rest_framework import status
 from rest_framework.test import APIClient
 
 RECIPES_URL = reverse('recipe:recipe-list')
+COPY_URL = reverse('recipe:recipe-copy-many')
 
 
 def detail_url(recipe_id):
@@ -26,6 +36,14 @@ def image_upload_url(recipe_id):
     return reverse('recipe:recipe-upload-image', args=[recipe_id])
 
 
+def copy_url(recipe_id):
+    return reverse('recipe:recipe-copy', args=[recipe_id])
+
+
+def image_url(name):
+    return reverse('recipe-image', args=[os.path.basename(name)])
+
+
 def sample_ingredient(user, name='Main Ing'):
     return Ingredient.objects.create(user=user, name=name)
 
@@ -59,6 +77,7 @@ class PrivateRecipeApiTests(TestCase):
             'asdf@asdf',
         )
         self.client.force_authenticate(self.user)
+        names.clear()
 
     def test_retrieve_recipes(self):
 
@@ -72,6 +91,22 @@ class PrivateRecipeApiTests(TestCase):
 
         self.assertEqual(res.data, serializer.data)
 
+    def test_retrieve_recipes_constant_queries(self):
+        for i in range(5):
+            recipe = sample_recipe(user=self.user)
+            bulk.add_links(recipe, 'tags',
+                           [sample_tag(self.user, f'tag{i}')])
+            bulk.add_links(recipe, 'ingredients',
+                           [sample_ingredient(self.user, f'ing{i}')])
+
+        # The recipes, then all their links at once
+        with self.assertNumQueries(2):
+            res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(len(res.data), 5)
+        self.assertEqual(len(res.data[0]['tags']), 1)
+        self.assertEqual(len(res.data[0]['ingredients']), 1)
+
     def test_recipes_limited_to_user(self):
         user2 = get_user_model().objects.create_user(
             'asdf2@asdf',
@@ -92,6 +127,24 @@ class PrivateRecipeApiTests(TestCase):
         serializer = RecipeDetailSerializer(recipe)
         self.assertEqual(res.data, serializer.data)
 
+    def test_view_recipe_detail_names_cached(self):
+        recipe = sample_recipe(self.user)
+        tag = sample_tag(self.user)
+        bulk.add_links(recipe, 'tags', [tag])
+        bulk.add_links(recipe, 'ingredients', [sample_ingredient(self.user)])
+        url = detail_url(recipe.id)
+        self.client.get(url)
+
+        with self.assertNumQueries(2):
+            res = self.client.get(url)
+        self.assertEqual(res.data['tags'], [{'id': tag.id, 'name': tag.name}])
+
+        tag.name = 'Renamed'
+        tag.save()
+        self.user.refresh_from_db()
+        res = self.client.get(url)
+        self.assertEqual(res.data['tags'][0]['name'], 'Renamed')
+
     def test_create_basic_recipe(self):
         payload = {
             'title': 'asdf',
@@ -125,6 +178,26 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(tag1, tags)
         self.assertIn(tag2, tags)
 
+    def test_create_recipe_with_other_users_tag(self):
+        """Test recipes cannot link tags or ingredients of other users"""
+        other = get_user_model().objects.create_user('other@asdf', 'asdf')
+        tag = sample_tag(other, 'theirs')
+        ingredient = sample_ingredient(other, 'theirs')
+
+        for field, row in (('tags', tag), ('ingredients', ingredient)):
+            with self.subTest(field=field):
+                res = self.client.post(RECIPES_URL, {
+                    'title': 'qwer', 'time_minutes': 30, 'price': 30.00,
+                    'tags': [], field: [row.id],
+                })
+
+                self.assertEqual(res.status_code,
+                                 status.HTTP_400_BAD_REQUEST)
+                self.assertIn(field, res.data)
+                row.refresh_from_db()
+                self.assertEqual(row.recipe_count, 0)
+        self.assertFalse(Recipe.objects.exists())
+
     def test_create_recipe_with_ingredients(self):
         ingredient1 = sample_ingredient(self.user, '1')
         ingredient2 = sample_ingredient(self.user, '2')
@@ -145,6 +218,52 @@ class PrivateRecipeApiTests(TestCase):
         self.assertIn(ingredient1, ingredients)
         self.assertIn(ingredient2, ingredients)
 
+    def test_links_keep_order_and_quantities(self):
+        """Test links come back in the given order with their quantities"""
+        egg, flour, milk = (
+            sample_ingredient(self.user, name)
+            for name in ('egg', 'flour', 'milk')
+        )
+        res = self.client.post(RECIPES_URL, {
+            'title': 'Pancakes',
+            'time_minutes': 10,
+            'price': 2.00,
+            'tags': [],
+            'ingredients': [
+                {'id': milk.id, 'quantity': '1 cup'},
+                flour.id,
+                {'id': egg.id, 'quantity': '2'},
+            ],
+        }, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['ingredients'], [milk.id, flour.id, egg.id])
+        self.assertEqual(res.data['quantities'], {
+            str(milk.id): '1 cup', str(egg.id): '2',
+        })
+
+        url = detail_url(res.data['id'])
+        res = self.client.patch(url, {'ingredients': [
+            egg.id, {'id': milk.id, 'quantity': '2 cups'},
+        ]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        res = self.client.get(url)
+        self.assertEqual([i['id'] for i in res.data['ingredients']],
+                         [egg.id, milk.id])
+        self.assertEqual(res.data['quantities'], {str(milk.id): '2 cups'})
+
+    def test_quantity_too_long(self):
+        ingredient = sample_ingredient(self.user)
+        recipe = sample_recipe(self.user)
+
+        res = self.client.patch(detail_url(recipe.id), {'ingredients': [
+            {'id': ingredient.id, 'quantity': 'x' * 65},
+        ]}, format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ingredients', res.data)
+
 
     def test_partial_update_recipe(self):
         recipe = sample_recipe(self.user)
@@ -166,6 +285,47 @@ class PrivateRecipeApiTests(TestCase):
         self.assertEqual(len(tags), 1)
         self.assertIn(new_tag, tags)
 
+    def test_partial_update_links_constant_queries(self):
+        recipe = sample_recipe(self.user)
+        ingredients = [
+            sample_ingredient(self.user, f'ing{i}') for i in range(60)
+        ]
+        bulk.add_links(recipe, 'ingredients', ingredients[:50])
+        url = detail_url(recipe.id)
+
+        def patch(count):
+            ids = [i.id for i in ingredients[count:50 + count]]
+            with CaptureQueriesContext(connection) as ctx:
+                res = self.client.patch(url, {'ingredients': ids},
+                                        format='json')
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(set(res.data['ingredients']), set(ids))
+            return len(ctx)
+
+        self.assertEqual(patch(1), patch(5))
+        # One of them moves the kept ingredients up, one looks for an
+        # active webhook
+        with self.assertNumQueries(13):
+            self.client.patch(url, {'ingredients': [
+                i.id for i in ingredients[10:60]
+            ]}, format='json')
+
+        for ingredient in ingredients:
+            ingredient.refresh_from_db()
+        self.assertEqual(
+            [i.recipe_count for i in ingredients], [0] * 10 + [1] * 50
+        )
+
+    def test_update_unknown_ingredient(self):
+        recipe = sample_recipe(self.user)
+
+        res = self.client.patch(
+            detail_url(recipe.id), {'ingredients': [9999]}, format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('ingredients', res.data)
+
     def test_full_update_recipe(self):
 
         recipe = sample_recipe(self.user)
@@ -183,6 +343,185 @@ class PrivateRecipeApiTests(TestCase):
         self.assertEqual(recipe.price, payload['price'])
         self.assertEqual(recipe.tags.count(), 0)
 
+    def test_delete_recipe_soft_deletes(self):
+        recipe = sample_recipe(self.user)
+        url = detail_url(recipe.id)
+
+        res = self.client.delete(url)
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.client.get(url).status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(RECIPES_URL).data, [])
+        self.assertIsNotNone(Recipe.all_objects.get(id=recipe.id).deleted_at)
+
+
+class RecipeVersionApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'version@asdf',
+            'asdf@asdf',
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(self.user)
+        self.url = detail_url(self.recipe.id)
+        names.clear()
+
+    def test_update_bumps_version(self):
+        res = self.client.get(self.url)
+        self.assertEqual(res['ETag'], '"1"')
+
+        res = self.client.patch(self.url, {'title': 'New'},
+                                HTTP_IF_MATCH='"1"')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['ETag'], '"2"')
+        self.assertEqual(res.data['version'], 2)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.version, 2)
+
+    def test_stale_if_match_rejected(self):
+        self.client.patch(self.url, {'title': 'First'})
+
+        res = self.client.patch(self.url, {'title': 'Second'},
+                                HTTP_IF_MATCH='"1"')
+
+        self.assertEqual(res.status_code,
+                         status.HTTP_412_PRECONDITION_FAILED)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title, 'First')
+
+    def test_concurrent_save_conflicts(self):
+        stale = Recipe.objects.get(id=self.recipe.id)
+        self.recipe.title = 'Elsewhere'
+        self.recipe.save()
+
+        stale.title = 'Lost'
+        with self.assertRaises(VersionConflict), transaction.atomic():
+            stale.save()
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.title, 'Elsewhere')
+        self.assertEqual(self.recipe.version, 2)
+
+    def test_conflict_rolls_back_links(self):
+        tag = sample_tag(self.user)
+        stale = Recipe.objects.get(id=self.recipe.id)
+        Recipe.objects.get(id=self.recipe.id).save()
+
+        with patch.object(RecipeViewSet, 'get_object', return_value=stale):
+            res = self.client.patch(self.url, {'tags': [tag.id]})
+
+        self.assertEqual(res.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(self.recipe.tags.count(), 0)
+        tag.refresh_from_db()
+        self.assertEqual(tag.recipe_count, 0)
+
+    def test_update_takes_no_row_lock(self):
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.patch(self.url, {'title': 'New'})
+
+        self.assertFalse(
+            [q for q in ctx if 'FOR UPDATE' in q['sql'].upper()]
+        )
+        self.assertTrue([
+            q for q in ctx if q['sql'].startswith('UPDATE "core_recipe"')
+            and '"version" = 1' in q['sql']
+        ])
+
+
+class RecipeCopyApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'asdf@asdf',
+            'asdf@asdf',
+        )
+        self.client.force_authenticate(self.user)
+
+    def sample_linked_recipe(self, title='Sample'):
+        recipe = sample_recipe(self.user, title=title, time_minutes=40)
+        bulk.add_links(recipe, 'tags',
+                       [sample_tag(self.user, f'{title} tag')])
+        bulk.add_links(recipe, 'ingredients', [
+            sample_ingredient(self.user, f'{title} ing 1'),
+            sample_ingredient(self.user, f'{title} ing 2'),
+        ])
+        return recipe
+
+    def test_copy_recipe(self):
+        recipe = self.sample_linked_recipe()
+        recipe.image = 'uploads/recipe/shared.jpg'
+        recipe.save()
+
+        res = self.client.post(copy_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        copy = Recipe.objects.get(id=res.data['id'])
+        self.assertNotEqual(copy.id, recipe.id)
+        self.assertEqual(copy.copied_from, recipe)
+        self.assertEqual(copy.title, recipe.title)
+        self.assertEqual(copy.image.name, recipe.image.name)
+        self.assertEqual(set(copy.tags.all()), set(recipe.tags.all()))
+        self.assertEqual(
+            list(copy.ingredients.order_by('recipeingredient__position')),
+            list(recipe.ingredients.order_by('recipeingredient__position')),
+        )
+        self.assertEqual(
+            ImageBlob.objects.get(name=recipe.image.name).ref_count, 2
+        )
+
+    def test_copy_recipe_updates_counters(self):
+        recipe = self.sample_linked_recipe()
+
+        self.client.post(copy_url(recipe.id))
+
+        self.assertEqual(recipe.tags.get().recipe_count, 2)
+        stats = RecipeStats.objects.get(user=self.user)
+        self.assertEqual(stats.recipe_count, 2)
+        self.assertEqual(stats.time_minutes_total, 80)
+
+    def test_copy_other_users_recipe_not_found(self):
+        user2 = get_user_model().objects.create_user('qwer@asdf', 'asdf')
+        recipe = sample_recipe(user2)
+
+        res = self.client.post(copy_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_bulk_copy_constant_queries(self):
+        recipes = [self.sample_linked_recipe(f'r{i}') for i in range(2)]
+        res = self.client.post(
+            COPY_URL, {'ids': [r.id for r in recipes]}, format='json'
+        )
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(
+            [copy['copied_from'] for copy in res.data],
+            [r.id for r in recipes],
+        )
+
+        recipes += [self.sample_linked_recipe(f'r{i}') for i in range(2, 6)]
+        ids = [r.id for r in recipes]
+        with CaptureQueriesContext(connection) as few:
+            self.client.post(COPY_URL, {'ids': ids[:2]}, format='json')
+        with CaptureQueriesContext(connection) as many:
+            self.client.post(COPY_URL, {'ids': ids}, format='json')
+
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(Recipe.objects.count(), 16)
+
+    def test_bulk_copy_unknown_ids(self):
+        recipe = sample_recipe(self.user)
+
+        res = self.client.post(
+            COPY_URL, {'ids': [recipe.id, recipe.id + 100]}, format='json'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(Recipe.objects.count(), 1)
+
 
 class RecipeImageUploadTests(TestCase):
 
@@ -209,6 +548,32 @@ class RecipeImageUploadTests(TestCase):
         self.assertIn('image', res.data)
         self.assertTrue(os.path.exists(self.recipe.image.path))
 
+    def test_upload_image_deferred(self):
+        """Test Prefer: respond-async leaves storing the image to a job"""
+        url = image_upload_url(self.recipe.id)
+        with tempfile.NamedTemporaryFile(suffix='.jpg') as ntf:
+            Image.new('RGB', (10, 10)).save(ntf, format='JPEG')
+            ntf.seek(0)
+            res = self.client.post(url, {'image': ntf}, format='multipart',
+                                   HTTP_PREFER='respond-async')
+
+        self.assertEqual(res.status_code, status.HTTP_202_ACCEPTED)
+        self.assertEqual(res['Preference-Applied'], 'respond-async')
+        job = Job.objects.get(pk=res.data['job'])
+        staged = json.loads(job.payload)['args'][2]
+        self.recipe.refresh_from_db()
+        self.assertFalse(self.recipe.image)
+
+        jobs.work('test', threading.Event(), drain=True)
+
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.version, 2)
+        self.assertTrue(os.path.exists(self.recipe.image.path))
+        self.assertFalse(self.recipe.image.storage.exists(staged))
+        self.assertEqual(
+            ImageBlob.objects.get(name=self.recipe.image.name).ref_count, 1
+        )
+
     def test_upload_image_bad_request(self):
         url = image_upload_url(self.recipe.id)
         res = self.client.post(url, {'image': 'not'}, format='multipart')
@@ -263,3 +628,101 @@ class RecipeImageUploadTests(TestCase):
     #     self.assertIn(serializer1.data, res.data)
     #     self.assertIn(serializer2.data, res.data)
     #     self.assertNotIn(serializer3.data, res.data)
+
+
+class RecipeImageServeTests(TestCase):
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.media_settings = override_settings(MEDIA_ROOT=self.media_root)
+        self.media_settings.enable()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'asdf@asdf',
+            'asdf@asdf',
+        )
+        self.client.force_authenticate(self.user)
+        self.recipe = sample_recipe(self.user)
+        self.recipe.image = 'uploads/recipe/0d9b5a2c.jpg'
+        self.recipe.save()
+        os.makedirs(os.path.dirname(self.recipe.image.path))
+        with open(self.recipe.image.path, 'wb') as fh:
+            fh.write(b'0123456789')
+
+    def tearDown(self):
+        self.media_settings.disable()
+        shutil.rmtree(self.media_root)
+
+    def test_serve_image_to_owner(self):
+        res = self.client.get(image_url(self.recipe.image.name))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(res.streaming_content), b'0123456789')
+        self.assertEqual(res['Content-Type'], 'image/jpeg')
+        self.assertIn('immutable', res['Cache-Control'])
+        self.assertEqual(res['ETag'], '"0d9b5a2c"')
+
+    def test_image_hidden_from_other_users(self):
+        user2 = get_user_model().objects.create_user('qwer@asdf', 'asdf')
+        self.client.force_authenticate(user2)
+
+        res = self.client.get(image_url(self.recipe.image.name))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_image_requires_auth(self):
+        res = APIClient().get(image_url(self.recipe.image.name))
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_serve_image_range(self):
+        res = self.client.get(
+            image_url(self.recipe.image.name), HTTP_RANGE='bytes=2-5'
+        )
+
+        self.assertEqual(res.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(res.streaming_content), b'2345')
+        self.assertEqual(res['Content-Range'], 'bytes 2-5/10')
+
+    def test_serve_image_suffix_range(self):
+        res = self.client.get(
+            image_url(self.recipe.image.name), HTTP_RANGE='bytes=-3'
+        )
+        self.assertEqual(b''.join(res.streaming_content), b'789')
+
+    def test_missing_image_file(self):
+        """Test a blob missing from storage returns a 404"""
+        os.remove(self.recipe.image.path)
+
+        res = self.client.get(image_url(self.recipe.image.name))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_unsatisfiable_range(self):
+        res = self.client.get(
+            image_url(self.recipe.image.name), HTTP_RANGE='bytes=20-'
+        )
+        self.assertEqual(
+            res.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE
+        )
+
+    def test_not_modified(self):
+        res = self.client.get(
+            image_url(self.recipe.image.name), HTTP_IF_NONE_MATCH='"0d9b5a2c"'
+        )
+        self.assertEqual(res.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    @override_settings(MEDIA_ACCEL='x-accel')
+    def test_x_accel_redirect(self):
+        res = self.client.get(image_url(self.recipe.image.name))
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            res['X-Accel-Redirect'],
+            '/protected-media/uploads/recipe/0d9b5a2c.jpg',
+        )
+        self.assertEqual(res.content, b'')
+
+    @override_settings(MEDIA_ACCEL='x-sendfile')
+    def test_x_sendfile(self):
+        res = self.client.get(image_url(self.recipe.image.name))
+        self.assertEqual(res['X-Sendfile'], self.recipe.image.path)
@@ -0,0 +1,99 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import recommend
+from core.models import Ingredient, Recipe
+from core.tests.helpers import sample_recipe
+
+COOKABLE_URL = reverse('recipe:recipe-cookable')
+
+
+def similar_url(recipe_id):
+    return reverse('recipe:recipe-similar', args=[recipe_id])
+
+
+class PublicRecommendApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_login_required(self):
+        res = self.client.get(COOKABLE_URL, {'ingredients': '1'})
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class PrivateRecommendApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('asdf@asdf', 'asdf')
+        self.client.force_authenticate(self.user)
+        self.egg, self.flour, self.milk = (
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('egg', 'flour', 'milk')
+        )
+        recommend.clear()
+
+    def test_similar_recipes(self):
+        """Test similar recipes are returned with their scores"""
+        pancake = sample_recipe(self.user, [self.egg, self.flour, self.milk])
+        crepe = sample_recipe(self.user, [self.egg, self.flour],
+                              title='Crepe')
+        sample_recipe(self.user, [self.milk], title='Latte')
+
+        res = self.client.get(similar_url(pancake.id), {'limit': 1})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(res.data), 1)
+        self.assertEqual(res.data[0]['recipe']['id'], crepe.id)
+        self.assertEqual(res.data[0]['recipe']['title'], 'Crepe')
+        self.assertAlmostEqual(res.data[0]['score'], 2 / 3)
+
+    def test_similar_skips_other_users(self):
+        """Test another user's recipe is not found"""
+        other = get_user_model().objects.create_user('other@asdf', 'asdf')
+        recipe = sample_recipe(other, [])
+
+        res = self.client.get(similar_url(recipe.id))
+
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_similar_skips_deleted_recipes(self):
+        """Test recipes removed after the index was built are left out"""
+        pancake = sample_recipe(self.user, [self.egg, self.flour])
+        crepe = sample_recipe(self.user, [self.egg, self.flour])
+        self.client.get(similar_url(pancake.id))
+        Recipe.objects.filter(pk=crepe.pk).delete()
+
+        res = self.client.get(similar_url(pancake.id))
+
+        self.assertEqual(res.data, [])
+
+    def test_cookable_recipes(self):
+        """Test recipes are ranked by the ingredients they are missing"""
+        cake = sample_recipe(self.user, [self.egg, self.flour, self.milk])
+        omelette = sample_recipe(self.user, [self.egg])
+
+        res = self.client.get(COOKABLE_URL, {
+            'ingredients': f'{self.egg.id},{self.flour.id}',
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [(row['recipe']['id'], row['missing']) for row in res.data],
+            [(omelette.id, 0), (cake.id, 1)]
+        )
+
+    def test_cookable_invalid_ingredients(self):
+        """Test ingredients must be a list of ids"""
+        for ingredients in ('egg,flour', '99999999999', f'{self.egg.id},-1'):
+            with self.subTest(ingredients=ingredients):
+                res = self.client.get(COOKABLE_URL,
+                                      {'ingredients': ingredients})
+
+                self.assertEqual(res.status_code,
+                                 status.HTTP_400_BAD_REQUEST)
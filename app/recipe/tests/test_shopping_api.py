@@ -0,0 +1,88 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core.models import Ingredient
+from core.tests.helpers import sample_recipe
+
+SHOPPING_LIST_URL = reverse('recipe:recipe-shopping-list')
+
+
+class PublicShoppingListApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_login_required(self):
+        res = self.client.get(SHOPPING_LIST_URL, {'ids': '1'})
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateShoppingListApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('asdf@asdf', 'asdf')
+        self.client.force_authenticate(self.user)
+        self.egg, self.flour, self.milk = (
+            Ingredient.objects.create(user=self.user, name=name)
+            for name in ('egg', 'flour', 'milk')
+        )
+
+    def test_merges_ingredients(self):
+        """Test ingredients are listed once with the recipes using them"""
+        pancake = sample_recipe(self.user, [self.egg, self.flour, self.milk],
+                                price=4.50, time_minutes=20)
+        omelette = sample_recipe(self.user, [self.egg],
+                                 price=2.25, time_minutes=5)
+
+        with self.assertNumQueries(2):
+            res = self.client.get(SHOPPING_LIST_URL, {
+                'ids': f'{omelette.id},{pancake.id}',
+            })
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['recipes'], [pancake.id, omelette.id])
+        self.assertEqual(res.data['price'], '6.75')
+        self.assertEqual(res.data['time_minutes'], 25)
+        self.assertEqual(res.data['ingredients'], [
+            {'id': self.egg.id, 'name': 'egg',
+             'recipes': [pancake.id, omelette.id]},
+            {'id': self.flour.id, 'name': 'flour', 'recipes': [pancake.id]},
+            {'id': self.milk.id, 'name': 'milk', 'recipes': [pancake.id]},
+        ])
+
+    def test_deleted_ingredients_skipped(self):
+        """Test soft deleted ingredients are left off the list"""
+        pancake = sample_recipe(self.user, [self.egg, self.flour])
+        Ingredient.objects.filter(pk=self.flour.pk).update(
+            deleted_at=timezone.now()
+        )
+
+        res = self.client.get(SHOPPING_LIST_URL, {'ids': str(pancake.id)})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([row['name'] for row in res.data['ingredients']],
+                         ['egg'])
+
+    def test_unknown_recipes(self):
+        """Test recipes of other users are rejected"""
+        other = get_user_model().objects.create_user('other@asdf', 'asdf')
+        mine = sample_recipe(self.user, [self.egg])
+        theirs = sample_recipe(other, [])
+
+        res = self.client.get(SHOPPING_LIST_URL, {
+            'ids': f'{mine.id},{theirs.id}',
+        })
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(res.data['ids'], [f'Unknown recipes: [{theirs.id}]'])
+
+    def test_invalid_ids(self):
+        """Test ids must be given as comma separated integers"""
+        res = self.client.get(SHOPPING_LIST_URL, {'ids': 'pancake'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
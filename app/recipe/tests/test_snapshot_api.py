@@ -0,0 +1,106 @@
+from unittest.mock import patch
+
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import bulk, snapshots
+from core.models import Recipe, Tag
+from core.tests.helpers import sample_recipe
+from recipe.serializers import RecipeSerializer
+from recipe.views import RecipeViewSet, load_recipe_attrs
+
+RECIPES_URL = reverse('recipe:recipe-list')
+
+
+def on_commit_now(func, using=None):
+    func()
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0, RECIPE_SNAPSHOT_MAX_AGE=60)
+class RecipeSnapshotApiTests(TestCase):
+
+    def setUp(self):
+        caches['snapshots'].clear()
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user(
+            'asdf@asdf', 'asdf', recipe_list_snapshot=True,
+        )
+        self.client.force_authenticate(self.user)
+        tag = Tag.objects.create(user=self.user, name='Vegan')
+        for n in range(5):
+            recipe = sample_recipe(self.user, title=f'Recipe {n}')
+            bulk.add_links(recipe, 'tags', [tag])
+
+    def expected(self):
+        recipes = Recipe.objects.filter(user=self.user).order_by('-id')
+        return RecipeSerializer(load_recipe_attrs(recipes), many=True).data
+
+    def test_snapshot_matches_list(self):
+        """Test the snapshot serves what the list would"""
+        res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['Content-Type'], 'application/json')
+        self.assertEqual(res.json(), self.expected())
+
+    def test_fresh_snapshot_skips_database(self):
+        """Test a fresh snapshot is served without queries"""
+        self.client.get(RECIPES_URL)
+
+        with self.assertNumQueries(0):
+            res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(len(res.json()), 5)
+
+    def test_age_bounds_staleness(self):
+        """Test unannounced changes show once the snapshot is too old"""
+        self.client.get(RECIPES_URL)
+        # TestCase never commits, so no stale mark is left
+        Recipe.objects.filter(user=self.user).update(
+            title='Renamed', updated_at=timezone.now(),
+        )
+        self.assertNotIn('Renamed', res_titles(self.client))
+
+        with override_settings(RECIPE_SNAPSHOT_MAX_AGE=0):
+            self.assertEqual(res_titles(self.client), {'Renamed'})
+
+    @patch('core.snapshots.transaction.on_commit', on_commit_now)
+    @patch('core.snapshots.SEGMENT_SIZE', 2)
+    def test_changes_rendered_incrementally(self):
+        """Test only changed recipes are serialized again"""
+        self.client.get(RECIPES_URL)
+        first, second = Recipe.objects.filter(user=self.user)\
+            .order_by('id')[:2]
+        self.client.patch(reverse('recipe:recipe-detail', args=[first.id]),
+                          {'title': 'Changed'})
+        self.client.delete(reverse('recipe:recipe-detail', args=[second.id]))
+        sample_recipe(self.user, title='New')
+
+        with patch.object(RecipeViewSet, 'render_recipes', autospec=True,
+                          side_effect=RecipeViewSet.render_recipes) as render:
+            res = self.client.get(RECIPES_URL)
+
+        self.assertEqual(res.json(), self.expected())
+        self.assertEqual(len(res.json()), 5)
+        self.assertEqual(render.call_count, 1)
+        self.assertEqual(len(render.call_args[0][1]), 2)
+
+    def test_not_flagged(self):
+        """Test users without the flag get the list serialized as usual"""
+        self.user.recipe_list_snapshot = False
+        self.user.save()
+
+        with patch.object(snapshots, 'recipe_list') as recipe_list:
+            res = self.client.get(RECIPES_URL)
+
+        recipe_list.assert_not_called()
+        self.assertEqual(res.json(), self.expected())
+
+
+def res_titles(client):
+    return {row['title'] for row in client.get(RECIPES_URL).json()}
@@ -0,0 +1,62 @@
+from django.contrib.auth import get_user_model
+from django.test import TestCase
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import bulk
+from core.models import Recipe, Tag
+
+STATS_URL = reverse('recipe:stats')
+
+
+class PublicStatsApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_login_required(self):
+        res = self.client.get(STATS_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class PrivateStatsApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('asdf@asdf', 'asdf')
+        self.client.force_authenticate(self.user)
+
+    def test_empty_stats(self):
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['recipe_count'], 0)
+        self.assertIsNone(res.data['time_minutes_avg'])
+        self.assertEqual(res.data['tags'], [])
+
+    def test_stats_limited_to_user(self):
+        user2 = get_user_model().objects.create_user('asdf2@asdf', 'asdf')
+        tag = Tag.objects.create(user=self.user, name='vegan')
+        other_tag = Tag.objects.create(user=user2, name='vegan')
+        recipe = Recipe.objects.create(
+            user=self.user, title='a', time_minutes=20, price=4.00,
+        )
+        bulk.add_links(recipe, 'tags', [tag])
+        Recipe.objects.create(
+            user=self.user, title='b', time_minutes=40, price=6.00,
+        )
+        other = Recipe.objects.create(
+            user=user2, title='c', time_minutes=90, price=1.00,
+        )
+        bulk.add_links(other, 'tags', [other_tag])
+
+        res = self.client.get(STATS_URL)
+
+        self.assertEqual(res.data['recipe_count'], 2)
+        self.assertEqual(res.data['time_minutes_avg'], 30)
+        self.assertEqual(res.data['time_minutes_max'], 40)
+        self.assertEqual(res.data['price_avg'], '5.00')
+        self.assertEqual(res.data['tags'], [
+            {'id': tag.id, 'name': 'vegan', 'recipe_count': 1},
+        ])
@@ -0,0 +1,146 @@
+import base64
+import json
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import bulk
+from core.models import Ingredient, Tag
+from core.tests.helpers import sample_recipe
+
+SYNC_URL = reverse('recipe:sync')
+
+
+class PublicSyncApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+
+    def test_login_required(self):
+        res = self.client.get(SYNC_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+@override_settings(SYNC_SETTLE_SECONDS=0)
+class PrivateSyncApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('asdf@asdf', 'asdf')
+        self.client.force_authenticate(self.user)
+        self.tag = Tag.objects.create(user=self.user, name='Vegan')
+        self.recipe = sample_recipe(self.user)
+        bulk.add_links(self.recipe, 'tags', [self.tag])
+
+    def sync(self, cursor=None, **params):
+        if cursor is not None:
+            params['cursor'] = cursor
+        res = self.client.get(SYNC_URL, params)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        return res.data
+
+    def test_initial_sync_returns_everything(self):
+        other = get_user_model().objects.create_user('other@asdf', 'asdf')
+        sample_recipe(other)
+        ingredient = Ingredient.objects.create(user=self.user, name='Salt')
+
+        data = self.sync()
+
+        self.assertEqual([r['id'] for r in data['recipes']],
+                         [self.recipe.id])
+        self.assertEqual(data['recipes'][0]['tags'], [self.tag.id])
+        self.assertEqual([t['id'] for t in data['tags']], [self.tag.id])
+        self.assertEqual([i['id'] for i in data['ingredients']],
+                         [ingredient.id])
+        self.assertFalse(data['has_more'])
+
+    def test_nothing_changed(self):
+        cursor = self.sync()['cursor']
+
+        data = self.sync(cursor)
+
+        self.assertEqual(data['recipes'], [])
+        self.assertEqual(data['tags'], [])
+        self.assertEqual(data['deleted'],
+                         {'recipes': [], 'tags': [], 'ingredients': []})
+        self.assertEqual(data['cursor'], cursor)
+
+    def test_updates_and_link_changes_since_cursor(self):
+        untouched = sample_recipe(self.user, title='Untouched')
+        cursor = self.sync()['cursor']
+        self.recipe.title = 'Changed'
+        self.recipe.save()
+        sample_recipe(self.user, title='Linked')
+        cursor2 = self.sync(cursor)['cursor']
+        bulk.add_links(untouched, 'tags', [self.tag])
+
+        data = self.sync(cursor)
+
+        self.assertEqual([r['title'] for r in data['recipes']],
+                         ['Changed', 'Linked', 'Untouched'])
+        self.assertEqual(
+            [r['id'] for r in self.sync(cursor2)['recipes']],
+            [untouched.id],
+        )
+
+    def test_deletes_leave_tombstones(self):
+        cursor = self.sync()['cursor']
+        other = sample_recipe(self.user)
+        other_id, tag_id = other.id, self.tag.id
+        other.delete()
+        self.tag.delete()
+
+        data = self.sync(cursor)
+
+        self.assertEqual(data['deleted']['recipes'], [other_id])
+        self.assertEqual(data['deleted']['tags'], [tag_id])
+        self.assertEqual([r['id'] for r in data['recipes']],
+                         [self.recipe.id])
+        self.assertEqual(data['recipes'][0]['tags'], [])
+
+    def test_copies_are_synced(self):
+        cursor = self.sync()['cursor']
+
+        copy = bulk.copy_recipes(self.user, [self.recipe.id])[0]
+
+        self.assertEqual([r['id'] for r in self.sync(cursor)['recipes']],
+                         [copy.id])
+
+    def test_bounded_batches(self):
+        for i in range(4):
+            Tag.objects.create(user=self.user, name=f'tag{i}')
+
+        seen, cursor, has_more = [], None, True
+        while has_more:
+            data = self.sync(cursor, limit=2)
+            self.assertLessEqual(len(data['tags']), 2)
+            seen.extend(t['id'] for t in data['tags'])
+            cursor, has_more = data['cursor'], data['has_more']
+
+        self.assertEqual(
+            seen, list(Tag.objects.order_by('id').values_list('id', flat=True))
+        )
+
+    def test_invalid_cursor(self):
+        """Test malformed cursors, well-formed JSON included, are rejected"""
+        cursors = ['not-a-cursor'] + [
+            base64.urlsafe_b64encode(json.dumps(data).encode()).decode()
+            for data in ([], 'x', {'recipes': 'ab'}, {'recipes': [1, 2, 3]},
+                         {'recipes': {'a': 1}})
+        ]
+        for cursor in cursors:
+            with self.subTest(cursor=cursor):
+                res = self.client.get(SYNC_URL, {'cursor': cursor})
+
+                self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+                self.assertIn('cursor', res.data)
+
+    @override_settings(SYNC_SETTLE_SECONDS=60)
+    def test_recent_changes_held_back(self):
+        data = self.sync()
+
+        self.assertEqual(data['recipes'], [])
+        self.assertEqual(data['tags'], [])
@@ -1,6 +1,9 @@
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from django.contrib.auth import get_user_model
 
+from core import bulk
 from core.models import Tag, Recipe
 from django.urls import reverse
 from recipe.serializers import TagSerializer
@@ -114,3 +117,61 @@ class PrivateTagsApiTests(TestCase):
         recipe2.tags.add(tag1)
         res = self.client.get(TAGS_URL, {'assigned_only': 1})
         self.assertEqual(len(res.data), 1)
+
+    def test_retrieve_tags_ordered_by_recipe_count(self):
+        popular = Tag.objects.create(user=self.user, name='popular')
+        rare = Tag.objects.create(user=self.user, name='rare')
+        unused = Tag.objects.create(user=self.user, name='unused')
+        for title in ('a', 'b'):
+            recipe = Recipe.objects.create(
+                title=title,
+                time_minutes=10,
+                price=10.0,
+                user=self.user,
+            )
+            bulk.add_links(recipe, 'tags', [popular])
+        bulk.add_links(recipe, 'tags', [rare])
+
+        res = self.client.get(TAGS_URL, {'ordering': '-recipe_count'})
+
+        self.assertEqual(
+            [tag['id'] for tag in res.data],
+            [popular.id, rare.id, unused.id],
+        )
+
+    def test_assigned_only_skips_recipe_join(self):
+        tag = Tag.objects.create(user=self.user, name='asdf')
+        recipe = Recipe.objects.create(
+            title='asdf',
+            time_minutes=10,
+            price=10.0,
+            user=self.user,
+        )
+        bulk.add_links(recipe, 'tags', [tag])
+
+        with CaptureQueriesContext(connection) as ctx:
+            res = self.client.get(TAGS_URL, {'assigned_only': 1})
+
+        self.assertEqual(len(res.data), 1)
+        through = Recipe.tags.through._meta.db_table
+        self.assertFalse(
+            any(through in query['sql'] for query in ctx.captured_queries)
+        )
+
+    def test_create_tags_batch(self):
+        """Test tags can be created from a list, too"""
+        existing = Tag.objects.create(user=self.user, name='Vegan')
+
+        res = self.client.post(TAGS_URL, [
+            {'name': 'Vegan'}, {'name': 'Dessert'},
+        ], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual([row['id'] for row in res.data], [
+            existing.id, Tag.objects.get(user=self.user, name='Dessert').id,
+        ])
+        self.assertEqual([row['created'] for row in res.data], [False, True])
+
+        res = self.client.post(TAGS_URL, [{'name': 'Vegan'}], format='json')
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
@@ -0,0 +1,128 @@
+import socket
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework import status
+from rest_framework.test import APIClient
+
+from core import webhooks
+from core.models import Recipe, Tag, Webhook
+
+WEBHOOKS_URL = reverse('recipe:webhook-list')
+
+
+# Made up DNS, so the tests need no network
+HOSTS = {'partner.example': '93.184.216.34', 'internal.example': '10.0.0.5'}
+getaddrinfo = socket.getaddrinfo
+
+
+def fake_getaddrinfo(host, port, *args, **kwargs):
+    return getaddrinfo(HOSTS.get(host, host), port, *args, **kwargs)
+
+
+def detail_url(webhook_id):
+    return reverse('recipe:webhook-detail', args=[webhook_id])
+
+
+@override_settings(WEBHOOK_ALLOW_PRIVATE_HOSTS=False)
+class WebhookApiTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.user = get_user_model().objects.create_user('asdf@asdf', 'asdf')
+        self.client.force_authenticate(self.user)
+        patcher = mock.patch('socket.getaddrinfo', fake_getaddrinfo)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_login_required(self):
+        res = APIClient().get(WEBHOOKS_URL)
+
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_subscribe(self):
+        """Test a new webhook gets a secret and only future events"""
+        webhooks.subscribe(self.user, 'https://partner.example/first')
+        Recipe.objects.create(user=self.user, title='Old', time_minutes=1,
+                              price=1)
+
+        res = self.client.post(WEBHOOKS_URL,
+                               {'url': 'https://partner.example/hook'})
+
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(res.data['secret']), 64)
+        webhook = Webhook.objects.get(id=res.data['id'])
+        self.assertEqual(res.data['last_event_id'], webhook.last_event_id)
+        self.assertGreater(webhook.last_event_id, 0)
+
+    def test_invalid_url(self):
+        res = self.client.post(WEBHOOKS_URL, {'url': 'ftp://partner'})
+
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_private_url_rejected(self):
+        """Test webhooks cannot point into the internal network"""
+        for url in ('http://internal.example/hook',
+                    'http://169.254.169.254/latest/meta-data/',
+                    'http://127.0.0.1:8000/api/'):
+            with self.subTest(url=url):
+                res = self.client.post(WEBHOOKS_URL, {'url': url})
+
+                self.assertEqual(res.status_code,
+                                 status.HTTP_400_BAD_REQUEST)
+                self.assertIn('not a public address', res.data['url'][0])
+        self.assertFalse(Webhook.objects.exists())
+
+    def test_webhooks_limited_to_user(self):
+        other = get_user_model().objects.create_user('other@asdf', 'asdf')
+        theirs = webhooks.subscribe(other, 'https://other.example/hook')
+        webhooks.subscribe(self.user, 'https://partner.example/hook')
+
+        res = self.client.get(WEBHOOKS_URL)
+
+        self.assertEqual([row['url'] for row in res.data],
+                         ['https://partner.example/hook'])
+        self.assertEqual(self.client.get(detail_url(theirs.id)).status_code,
+                         status.HTTP_404_NOT_FOUND)
+
+    def test_reactivate_resets_failures(self):
+        """Test a reactivated webhook starts over from the latest event"""
+        webhook = webhooks.subscribe(self.user, 'https://partner.example/h')
+        Webhook.objects.filter(pk=webhook.pk).update(is_active=False,
+                                                     failures=20)
+        Recipe.objects.create(user=self.user, title='Missed', time_minutes=1,
+                              price=1)
+
+        res = self.client.patch(detail_url(webhook.id), {'is_active': True})
+
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        webhook.refresh_from_db()
+        self.assertTrue(webhook.is_active)
+        self.assertEqual(webhook.failures, 0)
+        self.assertIsNone(webhook.next_delivery_at)
+        self.assertEqual(webhook.last_event_id,
+                         webhooks.latest_event_id(self.user))
+        self.assertEqual(res.data['last_event_id'], webhook.last_event_id)
+
+    def test_change_and_event_commit_together(self):
+        """Test a tag is not created when its event cannot be written"""
+        webhooks.subscribe(self.user, 'https://partner.example/h')
+
+        with mock.patch.object(webhooks, 'record',
+                               side_effect=DatabaseError('outbox')):
+            with self.assertRaises(DatabaseError):
+                self.client.post(reverse('recipe:tag-list'),
+                                 {'name': 'Vegan'})
+
+        self.assertFalse(Tag.objects.exists())
+
+    def test_unsubscribe(self):
+        webhook = webhooks.subscribe(self.user, 'https://partner.example/h')
+
+        res = self.client.delete(detail_url(webhook.id))
+
+        self.assertEqual(res.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertFalse(Webhook.objects.exists())
@@ -9,9 +9,12 @@ router = DefaultRouter()
 router.register('tags', viewset=views.TagViewSet)
 router.register('ingredients', viewset=views.IngredientViewSet)
 router.register('recipe', viewset=views.RecipeViewSet)
+router.register('webhooks', viewset=views.WebhookViewSet)
 
 app_name = 'recipe'
 
 urlpatterns = [
+    path('stats/', views.RecipeStatsView.as_view(), name='stats'),
+    path('sync/', views.RecipeSyncView.as_view(), name='sync'),
     path('', include(router.urls))
 ]
@@ -1,18 +1,34 @@
+from functools import partial
+
 import rest_framework
-from core.models import Tag, Ingredient, Recipe
-from recipe import serializers
-from rest_framework import viewsets, mixins, status, filters
-from rest_framework.authentication import TokenAuthentication
+from django.http import Http404
+from django.utils.http import parse_etags
+from core.models import Tag, Ingredient, Recipe, RecipeStats, \
+    VersionConflict, Webhook, recipe_image_name
+from core import bulk, concurrency, deletion, jobs, names, sharding, \
+    shopping, snapshots, sync, tasks
+from core.sharding import ShardedTokenAuthentication
+from recipe import media, serializers
+from rest_framework import viewsets, mixins, status, filters, generics
 from rest_framework.decorators import action
+from rest_framework.exceptions import APIException, ValidationError
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 
 
 class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
                             mixins.ListModelMixin,
                             mixins.CreateModelMixin):
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (ShardedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
+    filter_backends = (filters.OrderingFilter,)
+    ordering_fields = ('name', 'recipe_count')
+    ordering = ('-name',)
+    # Most names one POST may create
+    max_batch = 1000
 
     def get_queryset(self):
         assigned_only = bool(
@@ -20,11 +36,40 @@ class BaseRecipeAttrViewSet(viewsets.GenericViewSet,
         )
         queryset = self.queryset
         if assigned_only:
-            queryset = queryset.filter(recipe__isnull=False)
-        return queryset.filter(user=self.request.user).order_by('-name').distinct()
+            queryset = queryset.filter(recipe_count__gt=0)
+        return queryset.filter(user=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        """Create one object, or a list of them in one go
+
+        Names of a list the user already has resolve to the existing
+        objects, every item is reported with its id and ``created``.
+        """
+        if not isinstance(request.data, list):
+            return super().create(request, *args, **kwargs)
+        if len(request.data) > self.max_batch:
+            raise ValidationError({api_settings.NON_FIELD_ERRORS_KEY: [
+                f'At most {self.max_batch} items per request.'
+            ]})
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        rows = bulk.get_or_create_named(
+            self.queryset.model, request.user,
+            [item['name'] for item in serializer.validated_data],
+        )
+        return Response(
+            serializers.BatchCreatedSerializer([
+                {'id': instance.pk, 'name': instance.name, 'created': created}
+                for instance, created in rows
+            ], many=True).data,
+            status=status.HTTP_201_CREATED
+            if any(created for _, created in rows) else status.HTTP_200_OK,
+        )
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        # The row, the name dictionary and the outbox event commit together
+        with sharding.atomic():
+            serializer.save(user=self.request.user)
 
 
 class TagViewSet(BaseRecipeAttrViewSet):
@@ -37,26 +82,246 @@ class IngredientViewSet(BaseRecipeAttrViewSet):
     serializer_class = serializers.IngredientSerializer
 
 
+class PreconditionFailed(APIException):
+    status_code = status.HTTP_412_PRECONDITION_FAILED
+    default_detail = 'The recipe does not match the If-Match version.'
+    default_code = 'precondition_failed'
+
+
+class Conflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The recipe was changed by another request.'
+    default_code = 'conflict'
+
+
+def version_etag(version):
+    return f'"{version}"'
+
+
+def prefers_async(request):
+    """Whether the client sent ``Prefer: respond-async`` (RFC 7240)"""
+    return any(
+        preference.split(';')[0].strip().lower() == 'respond-async'
+        for preference in request.META.get('HTTP_PREFER', '').split(',')
+    )
+
+
+def load_recipe_attrs(recipes):
+    """Load the tags, ingredients and quantities of ``recipes``"""
+    return serializers.load_links(list(recipes))
+
+
 class RecipeViewSet(viewsets.ModelViewSet):
 
     serializer_class = serializers.RecipeSerializer
     queryset = Recipe.objects.all()
-    authentication_classes = (TokenAuthentication,)
+    authentication_classes = (ShardedTokenAuthentication,)
     permission_classes = (IsAuthenticated,)
 
     def get_queryset(self):
-        return self.queryset.filter(user=self.request.user)
+        return self.queryset.filter(user=self.request.user).order_by('-id')
+
+    def render_recipes(self, recipes):
+        """The JSON document of each of ``recipes``, for core.snapshots"""
+        renderer = JSONRenderer()
+        return [renderer.render(row) for row in self.get_serializer(
+            load_recipe_attrs(recipes), many=True
+        ).data]
+
+    def list(self, request, *args, **kwargs):
+        if request.user.recipe_list_snapshot and self.paginator is None \
+                and request.accepted_renderer.format == 'json':
+            return snapshots.recipe_list(
+                request.user, self.render_recipes
+            ).response(request)
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(
+                load_recipe_attrs(page), many=True
+            )
+            return self.get_paginated_response(serializer.data)
+        serializer = self.get_serializer(
+            load_recipe_attrs(queryset), many=True
+        )
+        return Response(serializer.data)
+
+    def retrieve(self, request, *args, **kwargs):
+        recipe = self.get_object()
+        # The links and both name dictionaries are independent reads
+        concurrency.parallel(
+            partial(load_recipe_attrs, [recipe]),
+            partial(names.get, Ingredient, request.user),
+            partial(names.get, Tag, request.user),
+        )
+        return Response(
+            self.get_serializer(recipe).data,
+            headers={'ETag': version_etag(recipe.version)}
+        )
 
     def get_serializer_class(self):
         if self.action == 'retrieve':
             return serializers.RecipeDetailSerializer
         elif self.action == 'upload_image':
             return serializers.RecipeImageSerializer
+        elif self.action == 'copy_many':
+            return serializers.RecipeCopySerializer
         return serializers.RecipeSerializer
 
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    def perform_destroy(self, instance):
+        deletion.delete_recipe(instance)
+
+    def create(self, request, *args, **kwargs):
+        response = super().create(request, *args, **kwargs)
+        response['ETag'] = version_etag(response.data['version'])
+        return response
+
+    def save_versioned(self, serializer):
+        """Save ``serializer`` unless the recipe changed since it was read
+
+        With an If-Match header the client's version has to be current,
+        otherwise the version loaded by this request is used. Either way
+        the check is part of the UPDATE itself, no row is locked.
+        """
+        if_match = self.check_if_match(serializer.instance)
+        try:
+            serializer.save()
+        except VersionConflict:
+            raise PreconditionFailed() if if_match else Conflict()
+
+    def check_if_match(self, recipe):
+        """Raise PreconditionFailed unless If-Match allows ``recipe``
+
+        Returns the header, if any.
+        """
+        if_match = self.request.META.get('HTTP_IF_MATCH')
+        if if_match and version_etag(recipe.version) \
+                not in parse_etags(if_match) and if_match.strip() != '*':
+            raise PreconditionFailed()
+        return if_match
+
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop('partial', False)
+        serializer = self.get_serializer(
+            self.get_object(), data=request.data, partial=partial
+        )
+        serializer.is_valid(raise_exception=True)
+        self.save_versioned(serializer)
+        return Response(
+            serializer.data,
+            headers={'ETag': version_etag(serializer.instance.version)}
+        )
+
+    def serialize_copies(self, copies):
+        serializer = serializers.RecipeSerializer(
+            load_recipe_attrs(copies), many=True
+        )
+        return serializer.data
+
+    @action(methods=['POST'], detail=True)
+    def copy(self, request, pk=None):
+        recipe = self.get_object()
+        copies = bulk.copy_recipes(request.user, [recipe.id])
+        return Response(
+            self.serialize_copies(copies)[0],
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(methods=['POST'], detail=False, url_path='copy')
+    def copy_many(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = set(serializer.validated_data['ids'])
+        missing = ids - set(
+            self.get_queryset().filter(id__in=ids)
+            .values_list('id', flat=True)
+        )
+        if missing:
+            return Response(
+                {'ids': [f'Unknown recipes: {sorted(missing)}']},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        copies = bulk.copy_recipes(request.user, ids)
+        return Response(
+            self.serialize_copies(copies),
+            status=status.HTTP_201_CREATED
+        )
+
+    def serialize_ranked(self, ranked, keys):
+        """``[{'recipe': ..., key: ...}]`` for ``ranked`` id tuples
+
+        Recipes deleted since the user's index was refreshed are skipped.
+        """
+        recipes = self.get_queryset().in_bulk([row[0] for row in ranked])
+        ranked = [row for row in ranked if row[0] in recipes]
+        data = serializers.RecipeSerializer(
+            load_recipe_attrs(recipes[row[0]] for row in ranked), many=True
+        ).data
+        return [
+            dict(zip(('recipe',) + keys, (recipe,) + row[1:]))
+            for recipe, row in zip(data, ranked)
+        ]
+
+    @action(methods=['GET'], detail=True)
+    def similar(self, request, pk=None):
+        # Imported on first use, NumPy would add to every worker's boot
+        from core import recommend
+        query = serializers.SimilarQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        recipe = self.get_object()
+        ranked = recommend.get_index(request.user).similar(
+            recipe.id, **query.validated_data
+        )
+        return Response(self.serialize_ranked(ranked, ('score',)))
+
+    @action(methods=['GET'], detail=False)
+    def cookable(self, request):
+        from core import recommend
+        query = serializers.CookableQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        ranked = recommend.get_index(request.user).cookable(
+            query.validated_data['ingredients'],
+            query.validated_data['limit'],
+        )
+        return Response(
+            self.serialize_ranked(ranked, ('missing', 'coverage'))
+        )
+
+    @action(methods=['GET'], detail=False, url_path='shopping-list')
+    def shopping_list(self, request):
+        query = serializers.ShoppingListQuerySerializer(
+            data=request.query_params
+        )
+        query.is_valid(raise_exception=True)
+        try:
+            result = shopping.shopping_list(
+                request.user, query.validated_data['ids']
+            )
+        except shopping.UnknownRecipes as e:
+            return Response(
+                {'ids': [str(e)]}, status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(serializers.ShoppingListSerializer(result).data)
+
+    def defer_image(self, recipe, image):
+        """Stage ``image`` and leave storing it to a job
+
+        The response is ``202 Accepted`` with the id of the job. The
+        recipe's version (and ETag) changes once the job has run.
+        """
+        self.check_if_match(recipe)
+        staged = Recipe._meta.get_field('image').storage.stage(image)
+        job = jobs.enqueue(tasks.store_recipe_image,
+                           args=(recipe.id, recipe.user_id, staged))
+        return Response(
+            {'id': recipe.id, 'job': job.id},
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Preference-Applied': 'respond-async'},
+        )
+
     @action(methods=['POST'], detail=True, url_path='upload-image')
     def upload_image(self, request, pk=None):
         recipe = self.get_object()
@@ -64,12 +329,83 @@ class RecipeViewSet(viewsets.ModelViewSet):
             recipe, data=request.data
         )
         if serializer.is_valid():
-            serializer.save()
+            image = serializer.validated_data.get('image')
+            if image and prefers_async(request):
+                return self.defer_image(recipe, image)
+            self.save_versioned(serializer)
             return Response(
                 serializer.data,
-                status=status.HTTP_200_OK
+                status=status.HTTP_200_OK,
+                headers={'ETag': version_etag(recipe.version)}
             )
         return Response(
             serializer.errors,
             status=status.HTTP_400_BAD_REQUEST
         )
+
+
+class WebhookViewSet(viewsets.ModelViewSet):
+    """Partner URLs receiving the user's changes, see core.webhooks"""
+    serializer_class = serializers.WebhookSerializer
+    queryset = Webhook.objects.all()
+    authentication_classes = (ShardedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get_queryset(self):
+        return self.queryset.filter(user=self.request.user).order_by('id')
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+
+class RecipeStatsView(generics.RetrieveAPIView):
+    serializer_class = serializers.RecipeStatsSerializer
+    authentication_classes = (ShardedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get_object(self):
+        return RecipeStats.objects.get_or_create(user=self.request.user)[0]
+
+
+class RecipeSyncView(APIView):
+    """Recipes, tags and ingredients changed since the client's cursor"""
+    authentication_classes = (ShardedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request):
+        query = serializers.SyncQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        batch, cursor, has_more = sync.changes(
+            request.user,
+            query.validated_data.get('cursor'),
+            query.validated_data['limit'],
+        )
+        deleted = {name: [] for name in sync.TRACKED.values()}
+        for tombstone in batch['deleted']:
+            deleted[sync.TRACKED[tombstone.model]].append(tombstone.object_id)
+        return Response({
+            'recipes': serializers.RecipeSerializer(
+                load_recipe_attrs(batch['recipes']), many=True
+            ).data,
+            'tags': serializers.TagSerializer(
+                batch['tags'], many=True
+            ).data,
+            'ingredients': serializers.IngredientSerializer(
+                batch['ingredients'], many=True
+            ).data,
+            'deleted': deleted,
+            'cursor': cursor,
+            'has_more': has_more,
+        })
+
+
+class RecipeImageView(APIView):
+    """Serve an uploaded recipe image to the recipe's owner"""
+    authentication_classes = (ShardedTokenAuthentication,)
+    permission_classes = (IsAuthenticated,)
+
+    def get(self, request, filename):
+        name = recipe_image_name(filename)
+        if not Recipe.objects.filter(user=request.user, image=name).exists():
+            raise Http404
+        return media.serve(request, name)